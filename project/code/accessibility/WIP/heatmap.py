@@ -1,25 +1,24 @@
 '''
 Usage:
 cd project/
-python code/heatmap.py --experiment_id=BNMC --preference=min_time
+python -m code.accessibility.WIP.heatmap BNMC min_time
+python -m code.accessibility.WIP.heatmap BNMC min_time --chunksize 1000000   (results.csv read in chunks)
 '''
 
 #Modules
 import argparse
-import folium
 import os
 import pandas as pd
-import geopandas as gpd
-import matplotlib.pyplot as plt
 import numpy as np
-from shapely.geometry import Point, box
-import veroviz as vrv
 #Functions
-from accessiblity.utils import getDirectory, getAllRoutes, checkPreference, getAPIKey
-ORS_API_KEY = getAPIKey()
+from ..utils import getDirectory, getAllRoutes, checkPreference, getExperimentOD
+from ..heatmap_grid import HeatmapGrid, aggregateGrid, gridToGeoJSON, attachOriginLocations
+from ..lazy import lazyImport
+from ..streaming import streamAggregate
+folium = lazyImport('folium')
 
 
-def aggregateResults(df: pd.DataFrame):
+def aggregateResults(df: pd.DataFrame, agg_func: str = 'max'):
     '''
     Group the rows of the df by the columns poi_name and start_name
     Aggregate the total_time and total_walk columns by getting the max or mean of those
@@ -35,26 +34,45 @@ def aggregateResults(df: pd.DataFrame):
         grouped and sorted dataframe
 
     '''
-    def calculate_max(series):
-        return series.max()
+    aggregations = {
+        'total_time': agg_func,  # Aggregation based on the argument
+        'total_walk': agg_func,  # Aggregation based on the argument
+    }
+    # Locations are constant within a group, keep the ones that are available
+    for col in ['origin_lat', 'origin_lon', 'destination_lat', 'destination_lon']:
+        if col in df.columns:
+            aggregations[col] = 'first'
 
-    agg_operation = calculate_max
-
-    grouped = df.groupby(['origin_id', 'destination_id']).agg({
-        'total_time': agg_operation,  # Aggregation based on the argument
-        'total_walk': agg_operation,  # Aggregation based on the argument
-        'origin_lat': 'first',
-        'origin_lon': 'first',
-        'destination_lat': 'first',
-        'destination_lon': 'first'
-    }).reset_index()
+    grouped = df.groupby(['origin_id', 'destination_id']).agg(aggregations).reset_index()
 
     sorted_group = grouped.sort_values(by='origin_id').reset_index(drop=True)
 
     return sorted_group
 
 
-def createHeatmap(results_df: pd.DataFrame, preference: str):
+def aggregateResultsFile(results_path: str, preference: str, agg_func: str = 'max', chunksize: int = 1000000):
+    '''
+    Same table as aggregateResults() for the routes of one preference, reading the
+    results file in chunks instead of loading it in memory (see accessibility.streaming)
+
+    Parameters
+    ----------
+    results_path: str
+        results.csv (or a Parquet file with the same columns)
+    agg_func: str
+        Can be "max" or "mean"
+    chunksize: int
+        number of rows read at once
+    '''
+    values = ['total_time', 'total_walk']
+    grouped = streamAggregate(results_path, keys=['origin_id', 'destination_id'], values=values,
+                              stats=[agg_func], where={'preference': preference}, chunksize=chunksize)
+    grouped = grouped.rename(columns={f"{value}_{agg_func}": value for value in values})
+    return grouped[['origin_id', 'destination_id'] + values]
+
+
+def createHeatmap(results_df: pd.DataFrame, preference: str, origins: pd.DataFrame = None,
+                  agg_metric: str = 'max', cell_size: float = None, num_div: int = 10, grouped: pd.DataFrame = None):
     '''
     Create heatmap which layers over a map of the 3 neigborhoods
 
@@ -66,62 +84,48 @@ def createHeatmap(results_df: pd.DataFrame, preference: str):
     preferences: str
         preference must be to minimize either time or walking | "min_time" or "min_walk"
 
+    origins: pd.DataFrame
+        read from origins.csv | used to locate the origins when results_df has no origin_lat/origin_lon
+
+    agg_metric: str
+        how the routes of an OD pair are combined before averaging over a cell | "max" or "mean"
+
+    cell_size: float
+        size of a grid cell in meters | if None, the grid has num_div cells along each side
+
+    grouped: pd.DataFrame
+        routes already aggregated per OD pair, e.g. by aggregateResultsFile() | if given, results_df is not used
+
     Returns
     ----------
     m
         heatmap
 
     Notes
-
+    The grid is built and aggregated by accessibility.heatmap_grid without geopandas.
     '''
+    if grouped is not None:
+        if origins is not None:
+            grouped = attachOriginLocations(grouped, origins)
+    else:
+        if origins is not None:
+            results_df = attachOriginLocations(results_df, origins)
+        if 'preference' in results_df.columns:
+            results_df = results_df[results_df['preference'] == preference]
 
-    grouped = aggregateResults(results_df)
-
-    gdf = gpd.GeoDataFrame(grouped, geometry=gpd.points_from_xy(grouped.origin_lon, grouped.origin_lat))
+        grouped = aggregateResults(results_df, agg_metric)
 
-    if preference == 'best_time':
+    if preference == 'min_time':
         obj_col = 'total_time'
     else:
         obj_col = 'total_walk'
 
-    # Define the bounds of the grid
-    num_div = 10  # 10 seems like a good number for this value
-    x_min, y_min, x_max, y_max = gdf.total_bounds
-    width = (x_max - x_min) / num_div  # Number of cells horizontally
-    height = (y_max - y_min) / num_div  # Number of cells vertically
-
-    # Create the cells in the grid
-    rows = int(np.ceil((y_max - y_min) / height))
-    cols = int(np.ceil((x_max - x_min) / width))
-    grid_cells = []
-
-    for i in range(cols):
-        for j in range(rows):
-            minx = x_min + i * width
-            maxx = x_min + (i + 1) * width
-            miny = y_min + j * height
-            maxy = y_min + (j + 1) * height
-            grid_cells.append(box(minx, miny, maxx, maxy))
-
-    grid = gpd.GeoDataFrame(grid_cells, columns=['geometry'])
-
-    # Ensure the grid has an explicit index column before the spatial join
-    grid['grid_index'] = range(len(grid))
+    # Define the grid and average the objective in each cell
+    grid = HeatmapGrid.fromPoints(grouped['origin_lat'], grouped['origin_lon'],
+                                  cell_size=cell_size, num_div=num_div)
+    aggregated = aggregateGrid(grouped, grid, metrics=[obj_col], agg='mean')
 
-    # Spatial join between the grid and the GeoDataFrame
-    merged = gpd.sjoin(grid, gdf, how='left', predicate='intersects')
-
-    # Ensure 'total_time' is a float to avoid data type issues during aggregation
-    merged[obj_col] = merged[obj_col].astype(float)
-
-    # Aggregate 'total_time' in each grid cell using 'grid_index' to identify cells
-    aggregated = merged.dissolve(by="grid_index", aggfunc="mean")
-
-    # Plotting
-    fig, ax = plt.subplots(figsize=(12, 10))
-    grid.plot(ax=ax, facecolor='none', edgecolor='grey')
-
-    if preference== 'best_time':
+    if preference == 'min_time':
         lg_txt = 'Time'
     else:
         lg_txt = 'Walking Distance'
@@ -133,24 +137,17 @@ def createHeatmap(results_df: pd.DataFrame, preference: str):
 
     if agg_metric == 'mean':
         lg_metric = "Average"
-    if agg_metric == 'max':
+    elif agg_metric == 'max':
         lg_metric = "Maximum"
     else:
         lg_metric = "Range"
-    aggregated.plot(column=obj_col, ax=ax, legend=True,
-                    legend_kwds={'label': f"{lg_metric} {lg_txt} by Grid Cell",
-                                'orientation': "horizontal"})
-    plt.show()
-
-    # After aggregating, reset the index so 'grid_index' becomes a column
-    aggregated.reset_index(inplace=True)
 
-    # Convert the aggregated GeoDataFrame to GeoJSON
-    aggregated_json = aggregated.to_json()
+    # Convert the aggregated cells to GeoJSON
+    aggregated_json = gridToGeoJSON(aggregated, grid)
 
     # Create a folium map centered around the mean of the data points
-    map_center_lat = gdf.geometry.y.mean()
-    map_center_lon = gdf.geometry.x.mean()
+    map_center_lat = grouped['origin_lat'].mean()
+    map_center_lon = grouped['origin_lon'].mean()
     m = folium.Map(location=[map_center_lat, map_center_lon], zoom_start=14)
 
     # Add choropleth layer without drawing the grid lines
@@ -158,8 +155,8 @@ def createHeatmap(results_df: pd.DataFrame, preference: str):
         geo_data=aggregated_json,
         name='choropleth',
         data=aggregated,
-        columns=['grid_index', obj_col],
-        key_on='feature.properties.grid_index',
+        columns=['cell_id', obj_col],
+        key_on='feature.properties.cell_id',
         fill_color='YlOrRd',  # Color scheme
         fill_opacity=0.7,
         line_opacity=0,  # Setting line opacity to 0 to hide grid lines
@@ -179,13 +176,20 @@ if __name__ == '__main__':
     parser = argparse.ArgumentParser(description="Experiment Details")
     parser.add_argument('experiment_id', type=str, help='Experiment ID')
     parser.add_argument('preference', type=str, help='Preference for the experiment')
+    parser.add_argument('--chunksize', type=int, default=None,
+                        help='Read results.csv in chunks of this many rows instead of loading it in memory')
     args = parser.parse_args()
 
     preference = checkPreference(args.preference)
     directory = getDirectory(args.experiment_id)
-    all_routes = getAllRoutes(directory)
+    origins, _ = getExperimentOD(directory)
 
-    createHeatmap(all_routes, preference)
+    if args.chunksize:
+        grouped = aggregateResultsFile(os.path.join(directory, 'results.csv'), preference, chunksize=args.chunksize)
+        createHeatmap(None, preference, origins=origins, grouped=grouped)
+    else:
+        all_routes = getAllRoutes(directory)
+        createHeatmap(all_routes, preference, origins=origins)
     
 
 
@@ -0,0 +1,155 @@
+'''
+Client of the routing service (code/service.py), and a load generator to benchmark it.
+
+Only the standard library is used, so the client can be imported by any script
+(vizRoute.py, ai_map.py, notebooks) without pulling in pandas or veroviz.
+The connection is kept open between requests.
+
+Usage:
+    from accessibility.client import RoutingClient
+    client = RoutingClient(port=8765)
+    route = client.bestRoute(origin_id=1, destination_id=1, time=28800, preference='min_time')
+
+    cd project/
+    python -m code.accessibility.client --port 8765 --requests 20000 --concurrency 8
+'''
+''' IMPORTS '''
+import json
+import time
+import random
+import argparse
+import threading
+import http.client
+from urllib.parse import urlencode
+
+class RoutingClient:
+    def __init__(self, host='127.0.0.1', port=8765, timeout=10):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.connection = None
+
+    def request(self, path, **params):
+        '''
+        Send one GET request and return the decoded JSON answer (None if not found)
+        '''
+        query = urlencode({k: v for k, v in params.items() if v is not None})
+        for attempt in range(2):
+            if self.connection is None:
+                self.connection = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+            try:
+                self.connection.request('GET', f"{path}?{query}" if query else path)
+                response = self.connection.getresponse()
+                body = json.loads(response.read())
+                break
+            except (http.client.HTTPException, ConnectionError):
+                # The server closed the connection: reconnect once
+                self.close()
+                if attempt:
+                    raise
+        if response.status == 404:
+            return None
+        if response.status != 200:
+            raise ValueError(body.get('error', f"HTTP {response.status}"))
+        return body
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+    def health(self):
+        return self.request('/health')
+
+    def bestRoute(self, origin_id, destination_id, time, preference='min_time'):
+        '''
+        Best route of the time slot starting at time (seconds or "HH:MM:SS"), as a dictionary
+        with the columns of results.csv
+        '''
+        return self.request('/best_route', origin=origin_id, destination=destination_id, time=time,
+                            preference=preference)
+
+    def departures(self, origin_id, destination_id, time, window=3600):
+        return self.request('/departures', origin=origin_id, destination=destination_id, time=time, window=window)
+
+    def arriveBy(self, origin_id, destination_id, arrive_by):
+        return self.request('/arrive_by', origin=origin_id, destination=destination_id, arrive_by=arrive_by)
+
+    def score(self, origin_id=None, preference='min_time'):
+        return self.request('/score', origin=origin_id, preference=preference)
+
+    def geometry(self, origin_id, destination_id, time, preference='min_time'):
+        return self.request('/geometry', origin=origin_id, destination=destination_id, time=time,
+                            preference=preference)
+
+    def layer(self, name):
+        return self.request('/layer', name=name)
+
+
+def loadTest(host='127.0.0.1', port=8765, requests=10000, concurrency=4, seed=0):
+    '''
+    Send random best_route/departures/arrive_by/score/geometry queries from several threads.
+
+    Returns
+    -------
+    report: dict
+        number of requests, requests per second and latency percentiles (milliseconds)
+    '''
+    client = RoutingClient(host, port)
+    origin_ids = [f['properties']['id'] for f in client.layer('origins')['features']]
+    destination_ids = [f['properties']['id'] for f in client.layer('destinations')['features']]
+    client.close()
+
+    latencies = []
+    lock = threading.Lock()
+
+    def worker(n, worker_seed):
+        rng = random.Random(worker_seed)
+        worker_client = RoutingClient(host, port)
+        mine = []
+        for _ in range(n):
+            o, d = rng.choice(origin_ids), rng.choice(destination_ids)
+            t = rng.randrange(5 * 3600, 22 * 3600, 900)
+            kind = rng.random()
+            start = time.perf_counter()
+            if kind < 0.4:
+                worker_client.bestRoute(o, d, t, rng.choice(['min_time', 'min_walk']))
+            elif kind < 0.6:
+                worker_client.departures(o, d, t)
+            elif kind < 0.8:
+                worker_client.arriveBy(o, d, t + 3600)
+            elif kind < 0.9:
+                worker_client.score(o)
+            else:
+                worker_client.geometry(o, d, t)
+            mine.append(time.perf_counter() - start)
+        worker_client.close()
+        with lock:
+            latencies.extend(mine)
+
+    threads = [threading.Thread(target=worker, args=(requests // concurrency, seed + i)) for i in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    def percentile(p):
+        return 1000 * latencies[min(len(latencies) - 1, int(p / 100 * len(latencies)))] if latencies else float('nan')
+    return {'requests': len(latencies), 'seconds': elapsed, 'requests_per_second': len(latencies) / elapsed,
+            'p50_ms': percentile(50), 'p95_ms': percentile(95), 'p99_ms': percentile(99)}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Load generator for the routing service.')
+    parser.add_argument('--host', default='127.0.0.1', help='Address of the service.')
+    parser.add_argument('--port', type=int, default=8765, help='Port of the service.')
+    parser.add_argument('--requests', type=int, default=10000, help='Total number of requests.')
+    parser.add_argument('--concurrency', type=int, default=4, help='Number of client threads.')
+    args = parser.parse_args()
+
+    report = loadTest(args.host, args.port, args.requests, args.concurrency)
+    for key, value in report.items():
+        print(f"{key}: {value:.3f}" if isinstance(value, float) else f"{key}: {value}")
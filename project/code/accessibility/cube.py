@@ -0,0 +1,236 @@
+'''
+Pre-aggregated accessibility cube of an experiment, built once from its best routes so
+reports read slices instead of regrouping best_routes.csv / results.csv every time.
+
+Every cell of the cube is a group of best routes:
+    level       'origin' (key = origin_id), 'neighborhood' (key = neighborhood name, the
+                origins are assigned with the is_in_<name> columns of spatial.tagNeighborhoods,
+                so an origin in two neighborhoods counts in both) or 'region' (key = 'all')
+    preference  'min_time', 'min_walk', ...
+    time        start of the slot, or ALL_TIMES (-1) for all the slots of the day
+and holds
+    routes                              number of best routes
+    reachable                           OD pairs with a route / (origins of the group x destinations);
+                                        at origin level over ALL_TIMES this is ai_1 of gen_ai.py
+    total_time_*, total_walk_*          mean, min, max and percentiles (p10, p50, p90 by default)
+    total_time_score_mean, walking_score_mean
+
+The (origin or neighborhood, preference, ALL_TIMES) cells exist for every origin and
+neighborhood, with routes = 0 and reachable = 0 if nothing is reached.
+
+The cube is saved as a SQLite table without rowid whose primary key is
+(level, key, preference, time): the rows are stored in key order, so a slice is an index
+range scan and no separate index is kept.
+
+Usage:
+    from accessibility.cube import readCube
+    readCube('experiments/BNMC/cube.db', level='neighborhood', preference='min_time')
+
+    cd project/
+    python -m code.accessibility.cube BNMC
+'''
+''' IMPORTS '''
+import argparse
+import os
+import sqlite3
+import numpy as np
+import pandas as pd
+from .regions import getRegion
+from .spatial import tagNeighborhoods
+
+ALL_TIMES = -1
+LEVELS = ('origin', 'neighborhood', 'region')
+MEASURES = ('total_time', 'total_walk')
+SCORES = ('total_time_score', 'walking_score')
+PERCENTILES = (10, 50, 90)
+
+def originGroups(origins: pd.DataFrame, neighborhoods: dict, boundary='boundaryLoose'):
+    '''
+    Return the group of every origin at every level
+
+    Parameters
+    ----------
+    origins: pd.DataFrame
+        origins.csv | name, lat, lon
+    neighborhoods: dict
+        output of getNeighborhoods() or getRegion()
+
+    Returns
+    -------
+    groups: pd.DataFrame
+        one row per (level, key, origin_id) | an origin is in one group per neighborhood it is in
+    '''
+    tagged = tagNeighborhoods(origins, neighborhoods, boundary=boundary)
+    frames = [pd.DataFrame({'level': 'origin', 'key': origins['name'].astype(str), 'origin_id': origins['name']}),
+              pd.DataFrame({'level': 'region', 'key': 'all', 'origin_id': origins['name']})]
+    for name in neighborhoods:
+        members = tagged.loc[tagged[f'is_in_{name}'], 'name']
+        frames.append(pd.DataFrame({'level': 'neighborhood', 'key': name, 'origin_id': members}))
+    return pd.concat(frames, ignore_index=True)
+
+def groupStatistics(df: pd.DataFrame, keys: list, percentiles=PERCENTILES):
+    '''
+    Aggregate the best routes of every group
+
+    Parameters
+    ----------
+    df: pd.DataFrame
+        best routes with the key columns and an 'od' column (one code per OD pair)
+    keys: list
+        columns that identify a group
+
+    Returns
+    -------
+    statistics: pd.DataFrame
+        one row per group with the key columns, routes, od_pairs and the statistics of the measures
+    '''
+    grouped = df.groupby(keys, sort=True)
+    parts = [grouped.size().rename('routes'), grouped['od'].nunique().rename('od_pairs')]
+    for measure in MEASURES:
+        stats = grouped[measure].agg(['mean', 'min', 'max'])
+        quantiles = grouped[measure].quantile([p / 100 for p in percentiles]).unstack()
+        stats[[f'p{p}' for p in percentiles]] = quantiles.to_numpy()
+        parts.append(stats.rename(columns=lambda stat: f'{measure}_{stat}'))
+    for score in SCORES:
+        if score in df.columns:
+            parts.append(grouped[score].mean().rename(f'{score}_mean'))
+    return pd.concat(parts, axis=1).reset_index()
+
+def buildCube(best_routes: pd.DataFrame, origins: pd.DataFrame, destinations: pd.DataFrame, neighborhoods: dict,
+              percentiles=PERCENTILES, boundary='boundaryLoose'):
+    '''
+    Aggregate the best routes of an experiment at every level, preference and slot
+
+    Parameters
+    ----------
+    best_routes: pd.DataFrame
+        best_routes.csv or results.csv | without a preference column all routes are min_time
+    origins, destinations: pd.DataFrame
+        origins.csv and destinations.csv
+    neighborhoods: dict
+        output of getNeighborhoods() or getRegion()
+
+    Returns
+    -------
+    cube: pd.DataFrame
+        one row per (level, key, preference, time), see the top of this file
+    '''
+    groups = originGroups(origins, neighborhoods, boundary=boundary)
+    group_size = groups.groupby(['level', 'key']).size().rename('origins')
+
+    if 'preference' not in best_routes.columns:
+        best_routes = best_routes.assign(preference='min_time')
+    columns = ['origin_id', 'destination_id', 'time', 'preference'] + list(MEASURES) + \
+        [score for score in SCORES if score in best_routes.columns]
+    routes = best_routes[columns].copy()
+    routes['preference'] = routes['preference'].astype(str)
+    routes['od'] = routes['origin_id'].astype(np.int64) * (int(destinations['name'].max()) + 1) + \
+        routes['destination_id'].astype(np.int64)
+    # Every route once per group of its origin
+    routes = routes.merge(groups, on='origin_id')
+
+    by_slot = groupStatistics(routes, ['level', 'key', 'preference', 'time'], percentiles)
+    all_slots = groupStatistics(routes, ['level', 'key', 'preference'], percentiles).assign(time=ALL_TIMES)
+
+    # The groups that reach nothing still get their (preference, ALL_TIMES) cells
+    preferences = sorted(routes['preference'].unique())
+    index = pd.MultiIndex.from_tuples([(level, key, preference) for (level, key) in group_size.index
+                                       for preference in preferences], names=['level', 'key', 'preference'])
+    all_slots = all_slots.set_index(['level', 'key', 'preference']).reindex(index).reset_index()
+    all_slots[['routes', 'od_pairs']] = all_slots[['routes', 'od_pairs']].fillna(0)
+    all_slots['time'] = ALL_TIMES
+
+    cube = pd.concat([by_slot, all_slots], ignore_index=True)
+    cube = cube.join(group_size, on=['level', 'key'])
+    cube['reachable'] = cube['od_pairs'] / (cube['origins'] * len(destinations))
+    cube['routes'] = cube['routes'].astype(np.int32)
+    cube['time'] = cube['time'].astype(np.int32)
+    cube = cube.drop(columns=['od_pairs', 'origins'])
+    first = ['level', 'key', 'preference', 'time', 'routes', 'reachable']
+    cube = cube[first + [col for col in cube.columns if col not in first]]
+    return cube.sort_values(by=['level', 'key', 'preference', 'time'], kind='mergesort').reset_index(drop=True)
+
+def saveCube(cube: pd.DataFrame, file_path: str):
+    '''
+    Save the cube in a SQLite table keyed by (level, key, preference, time), replacing the file
+    '''
+    tmp_path = file_path + '.tmp'
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    measures = [col for col in cube.columns if col not in ('level', 'key', 'preference', 'time', 'routes')]
+    connection = sqlite3.connect(tmp_path)
+    with connection:
+        connection.execute(f"""CREATE TABLE cube (level TEXT NOT NULL, key TEXT NOT NULL, preference TEXT NOT NULL,
+                               time INTEGER NOT NULL, routes INTEGER NOT NULL,
+                               {', '.join(f'{col} REAL' for col in measures)},
+                               PRIMARY KEY (level, key, preference, time)) WITHOUT ROWID""")
+        rows = cube[['level', 'key', 'preference', 'time', 'routes'] + measures].astype(object)
+        connection.executemany(f"INSERT INTO cube VALUES ({', '.join('?' * len(rows.columns))})",
+                               rows.where(rows.notna(), None).itertuples(index=False, name=None))
+    connection.execute('VACUUM')
+    connection.close()
+    os.replace(tmp_path, file_path)
+
+def readCube(file_path: str, level: str = None, key=None, preference: str = None, time: int = None):
+    '''
+    Read a slice of a saved cube
+
+    Parameters
+    ----------
+    file_path: str
+        cube.db of an experiment
+    level: str
+        "origin", "neighborhood" or "region" | all levels if not given
+    key: str, int or list
+        origin_id(s) or neighborhood name(s) | all if not given
+    preference: str
+        all preferences if not given
+    time: int
+        start of a slot, ALL_TIMES for the whole day | all slots (and ALL_TIMES) if not given
+
+    Returns
+    -------
+    cube: pd.DataFrame
+        the rows of the slice, in (level, key, preference, time) order
+    '''
+    if not os.path.exists(file_path):
+        raise FileNotFoundError(f"Cube {file_path} not found!")
+    where, parameters = [], []
+    for col, value in [('level', level), ('preference', preference), ('time', time)]:
+        if value is not None:
+            where.append(f'{col} = ?')
+            parameters.append(value)
+    if key is not None:
+        keys = [str(k) for k in (key if isinstance(key, (list, tuple, np.ndarray, pd.Series)) else [key])]
+        where.append(f"key IN ({', '.join('?' * len(keys))})")
+        parameters.extend(keys)
+    query = 'SELECT * FROM cube' + (f" WHERE {' AND '.join(where)}" if where else '') + \
+        ' ORDER BY level, key, preference, time'
+    connection = sqlite3.connect(file_path)
+    try:
+        cube = pd.read_sql_query(query, connection, params=parameters)
+    finally:
+        connection.close()
+    return cube
+
+if __name__ == '__main__':
+    from .utils import EXPERIMENTS_DIR
+
+    parser = argparse.ArgumentParser(description='Build the accessibility cube of an experiment.')
+    parser.add_argument('experiment_id', help='Experiment whose best routes are aggregated.')
+    parser.add_argument('--region', default='BNMC', help='Region whose neighborhoods are used. Default is BNMC.')
+    parser.add_argument('--percentiles', type=int, nargs='+', default=list(PERCENTILES),
+                        help='Percentiles of total_time and total_walk. Default is 10 50 90.')
+    args = parser.parse_args()
+
+    directory = os.path.join(EXPERIMENTS_DIR, args.experiment_id)
+    routes_file = os.path.join(directory, 'best_routes.csv')
+    if not os.path.exists(routes_file):
+        routes_file = os.path.join(directory, 'results.csv')
+    best_routes = pd.read_csv(routes_file, encoding='utf-8-sig')  # results.csv starts with a byte order mark
+    cube = buildCube(best_routes, pd.read_csv(os.path.join(directory, 'origins.csv')),
+                     pd.read_csv(os.path.join(directory, 'destinations.csv')), getRegion(args.region),
+                     percentiles=args.percentiles)
+    saveCube(cube, os.path.join(directory, 'cube.db'))
+    print(f"Saved {len(cube)} cells of {routes_file} to {os.path.join(directory, 'cube.db')}")
+    print(readCube(os.path.join(directory, 'cube.db'), level='region', time=ALL_TIMES).T)
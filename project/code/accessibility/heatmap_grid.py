@@ -0,0 +1,209 @@
+'''
+Grid aggregation for the accessibility heatmaps.
+
+Points are projected to meters around the center of the grid, binned into cells
+with integer division and reduced with np.bincount, so every metric and every
+time slot is aggregated in one pass over the rows. The occupied cells are
+exported as a GeoJSON dictionary that folium can draw directly.
+'''
+''' IMPORTS '''
+import numpy as np
+import pandas as pd
+
+EARTH_RADIUS_METERS = 6371008.8
+
+class HeatmapGrid():
+    def __init__(self, min_lat, min_lon, max_lat, max_lon, cell_width, cell_height=None):
+        '''
+        Regular grid over a bounding box
+
+        Parameters
+        ----------
+        min_lat, min_lon, max_lat, max_lon: float
+            bounding box covered by the grid
+        cell_width, cell_height: float
+            size of a cell in meters | cells are square if cell_height is not given
+        '''
+        self.lat0 = (min_lat + max_lat) / 2
+        self.lon0 = (min_lon + max_lon) / 2
+        self.cell_width  = float(cell_width)
+        self.cell_height = float(cell_width if cell_height is None else cell_height)
+
+        self.min_x, self.min_y = self.project(min_lat, min_lon)
+        max_x, max_y = self.project(max_lat, max_lon)
+        self.ncols = max(int(np.ceil((max_x - self.min_x) / self.cell_width)), 1)
+        self.nrows = max(int(np.ceil((max_y - self.min_y) / self.cell_height)), 1)
+        self.ncells = self.ncols * self.nrows
+
+    @classmethod
+    def fromPoints(cls, lats, lons, cell_size=None, num_div=10):
+        '''
+        Build a grid covering the points
+
+        Parameters
+        ----------
+        lats, lons: array-like
+            coordinates of the points
+        cell_size: float
+            size of a (square) cell in meters
+        num_div: int
+            used when cell_size is None | number of cells along each side of the bounding box
+        '''
+        lats = np.asarray(lats, dtype=float)
+        lons = np.asarray(lons, dtype=float)
+        bounds = (np.nanmin(lats), np.nanmin(lons), np.nanmax(lats), np.nanmax(lons))
+        if cell_size is not None:
+            return cls(*bounds, cell_width=cell_size)
+
+        grid = cls(*bounds, cell_width=1.0)
+        max_x, max_y = grid.project(bounds[2], bounds[3])
+        width  = (max_x - grid.min_x) / num_div
+        height = (max_y - grid.min_y) / num_div
+        return cls(*bounds, cell_width=width if width > 0 else 1.0, cell_height=height if height > 0 else 1.0)
+
+    def project(self, lats, lons):
+        '''
+        Equirectangular projection to meters around the center of the grid
+        '''
+        x = np.radians(np.asarray(lons, dtype=float) - self.lon0) * EARTH_RADIUS_METERS * np.cos(np.radians(self.lat0))
+        y = np.radians(np.asarray(lats, dtype=float) - self.lat0) * EARTH_RADIUS_METERS
+        return x, y
+
+    def unproject(self, x, y):
+        '''
+        Inverse of project(), returns (lats, lons)
+        '''
+        lons = self.lon0 + np.degrees(np.asarray(x, dtype=float) / (EARTH_RADIUS_METERS * np.cos(np.radians(self.lat0))))
+        lats = self.lat0 + np.degrees(np.asarray(y, dtype=float) / EARTH_RADIUS_METERS)
+        return lats, lons
+
+    def cellIndex(self, lats, lons):
+        '''
+        Return the cell id of every point | -1 for points outside the grid
+        Points on the upper edges of the bounding box belong to the last row/column.
+        '''
+        x, y = self.project(lats, lons)
+        col = np.floor((x - self.min_x) / self.cell_width)
+        row = np.floor((y - self.min_y) / self.cell_height)
+        # Points exactly on the upper boundary would otherwise start a new row/column
+        col = np.where(col == self.ncols, self.ncols - 1, col)
+        row = np.where(row == self.nrows, self.nrows - 1, row)
+
+        inside = (col >= 0) & (col < self.ncols) & (row >= 0) & (row < self.nrows)
+        cells = np.full(len(x), -1, dtype=np.int64)
+        cells[inside] = row[inside].astype(np.int64) * self.ncols + col[inside].astype(np.int64)
+        return cells
+
+    def cellPolygon(self, cell):
+        '''
+        Return the corners of a cell as a closed GeoJSON ring of [lon, lat] points
+        '''
+        row, col = divmod(int(cell), self.ncols)
+        x = self.min_x + np.array([col, col + 1, col + 1, col, col]) * self.cell_width
+        y = self.min_y + np.array([row, row, row + 1, row + 1, row]) * self.cell_height
+        lats, lons = self.unproject(x, y)
+        return [[float(lon), float(lat)] for lat, lon in zip(lats, lons)]
+
+def aggregateGrid(df: pd.DataFrame, grid: HeatmapGrid, metrics: list, by=None, agg='mean',
+                  lat_col='origin_lat', lon_col='origin_lon'):
+    '''
+    Aggregate metrics per grid cell (and per value of `by`) in a single pass
+
+    Parameters
+    ----------
+    df: pd.DataFrame
+        one row per point, e.g. results.csv joined with the origin locations
+    grid: HeatmapGrid
+    metrics: list
+        columns to aggregate, e.g. ['total_time', 'total_walk', 'accessibility_score']
+    by: str
+        optional column giving separate layers, e.g. 'time' for one layer per time slot
+    agg: str
+        "mean", "sum", "max" or "min" | missing values are ignored
+    lat_col, lon_col: str
+        columns with the location of each row
+
+    Returns
+    -------
+    aggregated: pd.DataFrame
+        one row per occupied (layer, cell) with the columns [by], cell_id, row, col,
+        count and one column per metric
+    '''
+    cells = grid.cellIndex(df[lat_col].to_numpy(), df[lon_col].to_numpy())
+    keep = cells >= 0
+
+    if by is None:
+        layer_codes = np.zeros(len(df), dtype=np.int64)
+        layers = None
+    else:
+        layer_codes, layers = pd.factorize(df[by], sort=True)
+        keep &= layer_codes >= 0
+    keys = layer_codes[keep] * grid.ncells + cells[keep]
+
+    # Compress the (layer, cell) keys so every reduction only spans the occupied cells
+    occupied, key_index = np.unique(keys, return_inverse=True)
+    counts = np.bincount(key_index, minlength=len(occupied))
+
+    out = {}
+    if layers is not None:
+        out[by] = np.asarray(layers)[occupied // grid.ncells]
+    out['cell_id'] = occupied % grid.ncells
+    out['row'], out['col'] = np.divmod(out['cell_id'], grid.ncols)
+    out['count'] = counts
+
+    for metric in metrics:
+        values = df[metric].to_numpy(dtype=float)[keep]
+        valid = ~np.isnan(values)
+        if agg in ('mean', 'sum'):
+            sums = np.bincount(key_index[valid], weights=values[valid], minlength=len(occupied))
+            if agg == 'sum':
+                out[metric] = sums
+            else:
+                n = np.bincount(key_index[valid], minlength=len(occupied))
+                with np.errstate(invalid='ignore', divide='ignore'):
+                    out[metric] = np.where(n > 0, sums / n, np.nan)
+        elif agg in ('max', 'min'):
+            reduced = pd.Series(values[valid]).groupby(key_index[valid]).agg(agg)
+            out[metric] = reduced.reindex(np.arange(len(occupied))).to_numpy()
+        else:
+            raise ValueError(f"Invalid aggregation {agg}. Must be mean, sum, max or min")
+
+    return pd.DataFrame(out)
+
+def gridToGeoJSON(aggregated: pd.DataFrame, grid: HeatmapGrid, properties=None):
+    '''
+    Convert the output of aggregateGrid() to a GeoJSON FeatureCollection (as a dictionary)
+
+    Parameters
+    ----------
+    aggregated: pd.DataFrame
+        output of aggregateGrid() for a single layer
+    properties: list
+        columns to copy into the feature properties | defaults to every column
+
+    Returns
+    -------
+    geojson: dict
+        one Polygon feature per cell, with the property 'cell_id' used as the key for folium.Choropleth
+    '''
+    if properties is None:
+        properties = list(aggregated.columns)
+    records = aggregated[properties].to_dict(orient='records')
+    features = []
+    for cell, record in zip(aggregated['cell_id'].to_numpy(), records):
+        record = {k: (None if (isinstance(v, float) and np.isnan(v)) else (v.item() if hasattr(v, 'item') else v))
+                  for k, v in record.items()}
+        record['cell_id'] = int(cell)
+        features.append({'type': 'Feature',
+                         'id': str(int(cell)),
+                         'properties': record,
+                         'geometry': {'type': 'Polygon', 'coordinates': [grid.cellPolygon(cell)]}})
+    return {'type': 'FeatureCollection', 'features': features}
+
+def attachOriginLocations(results: pd.DataFrame, origins: pd.DataFrame):
+    '''
+    Add origin_lat and origin_lon to the rows of results.csv using origins.csv
+    '''
+    locations = origins[['name', 'lat', 'lon']].rename(columns={'name': 'origin_id', 'lat': 'origin_lat', 'lon': 'origin_lon'})
+    results = results.drop(columns=['origin_lat', 'origin_lon'], errors='ignore')
+    return results.merge(locations, on='origin_id', how='left')
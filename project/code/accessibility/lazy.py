@@ -0,0 +1,46 @@
+'''
+Lazy loading of the heavy dependencies (veroviz, matplotlib, geopandas, folium).
+
+    vrv = lazyImport('veroviz')
+
+binds a placeholder that imports veroviz the first time one of its attributes is used,
+so importing a module only costs what the module actually runs. Scoring code
+(gen_ai.py, use_preferences.py, ...) can then be imported in workers without pulling
+in the plotting stacks, and a missing optional dependency only fails the function
+that needs it.
+'''
+''' IMPORTS '''
+import importlib
+import os
+
+class lazyImport:
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def _load(self):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return self._module
+
+    def __getattr__(self, attribute):
+        return getattr(self._load(), attribute)
+
+    def __repr__(self):
+        state = 'loaded' if self._module is not None else 'not loaded'
+        return f"<lazy module '{self._name}' ({state})>"
+
+# ORS key, read the first time a remote provider is called
+_API_KEY = None
+
+def getORSKey():
+    '''
+    Return the openrouteservice API key from the ORSKEY environment variable.
+    Only called right before a request to ORS, so everything else runs without a key.
+    '''
+    global _API_KEY
+    if _API_KEY is None:
+        if 'ORSKEY' not in os.environ:
+            raise RuntimeError("The ORSKEY environment variable must be set to use openrouteservice (ORS-online)")
+        _API_KEY = os.environ['ORSKEY']
+    return _API_KEY
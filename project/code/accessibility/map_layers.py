@@ -0,0 +1,113 @@
+'''
+Build the point layers of the accessibility maps in one pass.
+
+The nodes of a layer are built as a single veroviz-style nodes dataframe with a
+vectorized color column, instead of one dataframe per color filled column by column.
+Small layers are drawn as regular veroviz markers; large layers (e.g. a city-wide
+origin grid) are added to the map as one GeoJSON layer of canvas circle markers,
+optionally clustered, so the map stays interactive.
+'''
+''' IMPORTS '''
+import numpy as np
+import pandas as pd
+
+# Same colors as the original three layers: fully, partially and not accessible
+SCORE_COLORS = ['red', 'orange', 'green']
+
+def scoreColors(scores, colors=SCORE_COLORS):
+    '''
+    Return the color of every accessibility score (0 to 1)
+    0 -> colors[0], strictly between 0 and 1 -> colors[1], 1 -> colors[2]
+    '''
+    scores = np.asarray(scores, dtype=float)
+    return np.select([scores >= 1, scores > 0, scores <= 0], [colors[2], colors[1], colors[0]], default='gray')
+
+def buildNodes(ids, lats, lons, colors, popupText=None, iconText=None, iconType='20-white-12',
+               iconPrefix='custom', cesiumColor=None):
+    '''
+    Build a veroviz nodes dataframe from columns in one step
+
+    Parameters
+    ----------
+    ids, lats, lons: array-like
+        one value per node
+    colors: array-like or str
+        leaflet color of every node
+    popupText, iconText: array-like
+        default to the ids and to no text
+
+    Returns
+    -------
+    nodes: pd.DataFrame
+        with the columns of vrv.initDataframe('nodes')
+    '''
+    n = len(ids)
+    colors = np.broadcast_to(np.asarray(colors, dtype=object), (n,))
+    return pd.DataFrame({
+        'id': np.asarray(ids),
+        'lat': np.asarray(lats, dtype=float),
+        'lon': np.asarray(lons, dtype=float),
+        'altMeters': 0.0,
+        'nodeName': np.asarray(ids).astype(str),
+        'nodeType': None,
+        'popupText': np.asarray(ids if popupText is None else popupText),
+        'leafletIconPrefix': iconPrefix,
+        'leafletIconType': iconType,
+        'leafletColor': colors,
+        'leafletIconText': None if iconText is None else np.asarray(iconText),
+        'cesiumIconType': 'pin',
+        'cesiumColor': colors if cesiumColor is None else cesiumColor,
+        'cesiumIconText': None,
+        'elevMeters': None,
+    })
+
+def nodesToGeoJSON(nodes: pd.DataFrame):
+    '''
+    Convert a nodes dataframe to a GeoJSON FeatureCollection (as a dictionary) of points
+    '''
+    features = [{'type': 'Feature',
+                 'geometry': {'type': 'Point', 'coordinates': [float(lon), float(lat)]},
+                 'properties': {'id': str(i), 'color': str(c), 'popup': str(p)}}
+                for i, lat, lon, c, p in zip(nodes['id'], nodes['lat'], nodes['lon'],
+                                            nodes['leafletColor'], nodes['popupText'])]
+    return {'type': 'FeatureCollection', 'features': features}
+
+def addPointLayer(mapObject, nodes: pd.DataFrame, name: str = 'origins', cluster: bool = False, radius: int = 5):
+    '''
+    Add all the nodes to a folium map as one layer
+
+    Parameters
+    ----------
+    mapObject: folium.Map
+        e.g. the map returned by vrv.createLeaflet
+    nodes: pd.DataFrame
+        output of buildNodes()
+    cluster: bool
+        group nearby points in clusters when zoomed out
+
+    Returns
+    -------
+    mapObject: folium.Map
+    '''
+    import folium
+    from folium.plugins import MarkerCluster
+
+    # Draw the vector markers on a canvas instead of one SVG element per point
+    if hasattr(mapObject, 'options'):
+        mapObject.options['preferCanvas'] = True
+
+    layer = folium.GeoJson(
+        nodesToGeoJSON(nodes),
+        name=name,
+        marker=folium.CircleMarker(radius=radius, fill=True, fill_opacity=0.8, weight=1),
+        style_function=lambda feature: {'color': feature['properties']['color'],
+                                        'fillColor': feature['properties']['color']},
+        tooltip=folium.GeoJsonTooltip(fields=['popup'], labels=False),
+    )
+    if cluster:
+        container = MarkerCluster(name=name)
+        layer.add_to(container)
+        container.add_to(mapObject)
+    else:
+        layer.add_to(mapObject)
+    return mapObject
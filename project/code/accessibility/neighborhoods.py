@@ -3,8 +3,9 @@ import json
 import numpy as np
 import os
 import pandas as pd
-import veroviz as vrv
-vrv.checkVersion()
+from .spatial import filterToNeighborhoods, polygonBounds
+from .lazy import lazyImport
+vrv = lazyImport('veroviz')
 
 class Neighborhood():
     def __init__(self, boundaryTight, boundaryLoose, color, labelName, labelPoint=[]):
@@ -12,31 +13,45 @@ class Neighborhood():
         self.boundaryLoose = boundaryLoose
         self.color         = color
         self.labelName     = labelName
+        # Bounding boxes are computed once and reused by every point-in-polygon test
+        self.bounds        = {'boundaryTight': polygonBounds(boundaryTight),
+                              'boundaryLoose': polygonBounds(boundaryLoose)}
         
         if (len(labelPoint) == 0):
             # Find a point that is roughly in the middle of the boundary:
-            corners = vrv.getMapBoundary(locs=boundaryTight)
-            self.labelPoint = [(corners[0][0] + corners[1][0])/2, (corners[0][1] + corners[1][1])/2]
+            min_lat, min_lon, max_lat, max_lon = self.bounds['boundaryTight']
+            self.labelPoint = [(min_lat + max_lat)/2, (min_lon + max_lon)/2]
         else:
             self.labelPoint = labelPoint
 
+# Parsed neighborhoods, keyed by the absolute path of the file (or the url) they were loaded from
+_NEIGHBORHOOD_CACHE = {}
+
 def getNeighborhoods(url=None, file=None):
     '''
     url like "https://raw.githubusercontent.com/IE-670/bnmc/data/neighborhoods.json"
     file like "data/neighborhoods.json" 
+
+    The local file is used whenever it exists, the url is only a fallback.
+    Boundaries are parsed once per process and cached.
     '''
     if (url == file == None):
         return 'ERROR: Must provide url or file.'
-    
-    try:
+
+    key = os.path.abspath(file) if (file is not None and os.path.exists(file)) else url
+    if key is None:
+        raise FileNotFoundError(f"Neighborhood file {file} not found!")
+    if key in _NEIGHBORHOOD_CACHE:
+        return _NEIGHBORHOOD_CACHE[key]
+
+    if key == url:
         import urllib.request
-        with urllib.request.urlopen(url) as url:
-            data = json.loads(url.read().decode())
-        print("Loaded Neighborhood data from GitHub")				
-    except:
+        with urllib.request.urlopen(url) as response:
+            data = json.loads(response.read().decode())
+        print("Loaded Neighborhood data from GitHub")
+    else:
         with open(file) as fp:
             data = json.load(fp)
-        print("Loaded local copy of Neighborhood data")
        
     neighborhoods = {}
     for nb in data:
@@ -44,6 +59,7 @@ def getNeighborhoods(url=None, file=None):
                                          data[nb]["color"], data[nb]["labelName"], 
                                          data[nb]["labelPoint"])
 
+    _NEIGHBORHOOD_CACHE[key] = neighborhoods
     return neighborhoods    
 
 def createMapNeighborhoods(neighborhoods, mapObject=None, addLabel=True):
@@ -75,11 +91,11 @@ def createMapNeighborhoods(neighborhoods, mapObject=None, addLabel=True):
     return mapObject
 
 class Region(Neighborhood):
-    def __init__(self, folder_path):
+    def __init__(self, folder_path, region='BNMC'):
         '''self.boundaryTight, self.boundaryLoose, self.color = color, self.labelName = labelName'''
+        from .regions import getRegion
         self.folder_path = folder_path
-        self.neighborhoods = getNeighborhoods(url  = "https://raw.githubusercontent.com/IE-670/bnmc/data/neighborhoods.json", 
-                                              file = "../data/neighborhoods.json")
+        self.neighborhoods = getRegion(region)
         self.saveAttributes()
         #self.getData()
         # nbhdMapObject = createMapNeighborhoods(self.neighborhoods, mapObject=None, addLabel=True)
@@ -90,18 +106,13 @@ class Region(Neighborhood):
         # Save the bus stops to PD dataframe
         stops_file = os.path.join(self.folder_path,"stops.txt")
         stops_df = pd.read_csv(stops_file)
-        stops_df = stops_df.drop(columns=["stop_code","wheelchair_boarding","platform_code"])
+        stops_df = stops_df.drop(columns=["stop_code","platform_code"])
         
-        #Initialize an array to keep the bus stops found in the region
-        stops = []
-        self.busStopNodes = vrv.initDataframe('nodes')
-        for _,row in stops_df.iterrows():
-            stop_location = [row['stop_lat'],row['stop_lon']]
-            stop_id = row['stop_id']
-            inRegion = any(vrv.isPointInPoly(loc= stop_location, poly=self.neighborhoods[nb].boundaryLoose) for nb in self.neighborhoods)
-            if inRegion:
-                stops.append(row)
-                self.busStopNodes = vrv.createNodesFromLocs(locs=[stop_location],initNodes=self.busStopNodes,startNode=stop_id)
+        #Keep the bus stops found in the region, tested against every neighborhood at once
+        stops = filterToNeighborhoods(stops_df, self.neighborhoods, lat_col='stop_lat', lon_col='stop_lon')
+        self.busStopNodes = vrv.createNodesFromLocs(locs=stops[['stop_lat','stop_lon']].values.tolist(),
+                                                    initNodes=vrv.initDataframe('nodes'))
+        self.busStopNodes['id'] = stops['stop_id'].values
 
         '''TRIPS, STOP TIMES, ROUTES'''
         # Save stop times, trips and calendar attributes to PD dataframes
@@ -110,7 +121,7 @@ class Region(Neighborhood):
         stopTimes_df = stopTimes_df.drop(columns=["departure_time","stop_headsign","shape_dist_traveled","timepoint"])
 
         trips_df = pd.read_csv( os.path.join(self.folder_path,"trips.txt"))
-        trips_df = trips_df.drop(columns=["block_id","shape_id","wheelchair_accessible","bikes_allowed"])
+        trips_df = trips_df.drop(columns=["block_id","shape_id","bikes_allowed"])
         
         calendarAttr_df = pd.read_csv(os.path.join(self.folder_path,"calendar_attributes.txt"))
         
@@ -118,9 +129,9 @@ class Region(Neighborhood):
         routes_df = routes_df.drop(columns=["agency_id","route_url","route_desc","route_type","route_color","route_text_color","route_sort_order"])
 
         #save the filtered stops df to csv
-        pd.DataFrame(stops).to_csv(path_or_buf=os.path.join(self.folder_path,"filteredBusStops.csv"), index=False)
+        stops.to_csv(path_or_buf=os.path.join(self.folder_path,"filteredBusStops.csv"), index=False)
         #Merge the dataframes on stop_id, trip_id, service_id and route_id
-        df = stopTimes_df.merge(pd.DataFrame(stops), on="stop_id")
+        df = stopTimes_df.merge(stops, on="stop_id")
         print(f"Number of stop times for region {len(df)} ")
         df = df.merge(trips_df, on="trip_id")
         df = df.merge(calendarAttr_df, on="service_id")
@@ -128,7 +139,8 @@ class Region(Neighborhood):
 
         #Reorder the columns in the datatframe
         self.data = df.loc[:,['trip_id','trip_headsign','direction_id','service_description','service_id','route_id','route_short_name','route_long_name',\
-                              'stop_id','stop_sequence','stop_name','stop_lat','stop_lon','arrival_time']]
+                              'stop_id','stop_sequence','stop_name','stop_lat','stop_lon','arrival_time',\
+                              'wheelchair_boarding','wheelchair_accessible']]
         #self.data = df.sort_values(by = "trip_id")
         print(f"Dataframe has {self.data.shape[0]} rows across {self.data.shape[1]} columns:")
         print(f"There are {len(df.trip_id.unique())} unique trips belonging to {len(df.route_id.unique())} routes")
@@ -0,0 +1,95 @@
+'''
+Registry of the service areas (regions) the pipeline can be run for.
+
+A region is a set of neighborhood boundaries saved in the same format as
+data/neighborhoods.json. Regions are listed in data/regions.json as
+{"<region name>": "<path to the boundary file, relative to data/>"}, so a new
+service area only needs a boundary file and one line in the registry.
+Nothing here touches the network: boundaries are read from local files once per
+process and the parsed polygons (with their bounding boxes) are cached.
+'''
+''' IMPORTS '''
+import json
+import os
+import pandas as pd
+from .neighborhoods import getNeighborhoods
+from .spatial import filterToNeighborhoods
+
+DATA_DIR = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'data'))
+REGISTRY_FILE = os.path.join(DATA_DIR, 'regions.json')
+DEFAULT_REGION = 'BNMC'
+
+# Regions added with registerRegion() during this process
+_EXTRA_REGIONS = {}
+# Tagged stops, keyed by (region file, stops file, boundary)
+_STOPS_CACHE = {}
+
+def listRegions():
+    '''
+    Return a dictionary mapping every known region name to its boundary file
+    '''
+    regions = {}
+    if os.path.exists(REGISTRY_FILE):
+        with open(REGISTRY_FILE) as fp:
+            for name, file in json.load(fp).items():
+                regions[name] = os.path.join(DATA_DIR, file)
+    regions.update(_EXTRA_REGIONS)
+    return regions
+
+def registerRegion(name: str, file: str):
+    '''
+    Register a boundary file under a region name for the rest of this process
+    '''
+    if not os.path.exists(file):
+        raise FileNotFoundError(f"Boundary file {file} not found!")
+    _EXTRA_REGIONS[name] = os.path.abspath(file)
+
+def getRegionFile(region: str = DEFAULT_REGION):
+    '''
+    Return the boundary file of a region
+
+    Parameters
+    ----------
+    region: str
+        a registered region name, or the path to a boundary file
+    '''
+    regions = listRegions()
+    if region in regions:
+        return regions[region]
+    if os.path.exists(region):
+        return os.path.abspath(region)
+    raise ValueError(f"Unknown region {region}. Known regions are {sorted(regions)}")
+
+def getRegion(region: str = DEFAULT_REGION):
+    '''
+    Return the neighborhoods of a region | dictionary of Neighborhood objects keyed by name
+    '''
+    return getNeighborhoods(file=getRegionFile(region))
+
+def getRegionStops(region: str = DEFAULT_REGION, stops_file: str = None, boundary: str = 'boundaryLoose'):
+    '''
+    Return the bus stops inside at least one neighborhood of the region
+
+    Parameters
+    ----------
+    region: str
+        a registered region name, or the path to a boundary file
+    stops_file: str
+        path to the GTFS stops.txt | defaults to data/google_transit/stops.txt
+    boundary: str
+        "boundaryLoose" or "boundaryTight"
+
+    Returns
+    -------
+    stops: pd.DataFrame
+        stops.txt rows with an is_in_<name> column for every neighborhood of the region,
+        num_neighborhoods and in_multiple_neighborhoods
+    '''
+    if stops_file is None:
+        stops_file = os.path.join(DATA_DIR, 'google_transit', 'stops.txt')
+    key = (getRegionFile(region), os.path.abspath(stops_file), boundary)
+    if key not in _STOPS_CACHE:
+        stops_df = pd.read_csv(stops_file)
+        _STOPS_CACHE[key] = filterToNeighborhoods(stops_df, getRegion(region),
+                                                  lat_col='stop_lat', lon_col='stop_lon', boundary=boundary)
+    return _STOPS_CACHE[key].copy()
@@ -0,0 +1,140 @@
+'''
+Vectorized point-in-polygon tests for tagging points with the neighborhoods they fall in.
+
+Usage:
+cd project/
+python -m code.accessibility.spatial --output=data/updated_stops.csv
+
+Every test is run over all points at once: the polygon bounding box is used to
+discard points that cannot be inside, then a ray-casting test is evaluated edge by
+edge over the remaining points as NumPy arrays.
+Polygons follow the veroviz convention of a list of [lat, lon] points.
+'''
+''' IMPORTS '''
+import argparse
+import numpy as np
+import pandas as pd
+
+def polygonBounds(poly):
+    '''
+    Return the bounding box of a polygon
+
+    Parameters
+    ----------
+    poly: list
+        list of [lat, lon] points describing the polygon
+
+    Returns
+    -------
+    bounds: tuple
+        (min_lat, min_lon, max_lat, max_lon)
+    '''
+    pts = np.asarray(poly, dtype=float)
+    return (float(pts[:, 0].min()), float(pts[:, 1].min()), float(pts[:, 0].max()), float(pts[:, 1].max()))
+
+def pointsInPolygon(lats, lons, poly, bounds=None):
+    '''
+    Test many points against one polygon with a batched ray-casting test
+
+    Parameters
+    ----------
+    lats, lons: array-like
+        coordinates of the points to test
+    poly: list
+        list of [lat, lon] points describing the polygon
+    bounds: tuple
+        precomputed output of polygonBounds(poly) | computed if not given
+
+    Returns
+    -------
+    inside: np.ndarray
+        boolean array, True where the point is inside the polygon
+    '''
+    lats = np.asarray(lats, dtype=float)
+    lons = np.asarray(lons, dtype=float)
+    if bounds is None:
+        bounds = polygonBounds(poly)
+    min_lat, min_lon, max_lat, max_lon = bounds
+
+    inside = np.zeros(len(lats), dtype=bool)
+    # Only the points inside the bounding box need the full test
+    candidates = np.flatnonzero((lats >= min_lat) & (lats <= max_lat) &
+                                (lons >= min_lon) & (lons <= max_lon))
+    if len(candidates) == 0:
+        return inside
+
+    y = lats[candidates]
+    x = lons[candidates]
+    pts = np.asarray(poly, dtype=float)
+    y1, x1 = pts[:, 0], pts[:, 1]
+    y2, x2 = np.roll(y1, -1), np.roll(x1, -1)
+
+    crossings = np.zeros(len(candidates), dtype=bool)
+    for k in range(len(pts)):
+        # Skip horizontal edges, they can never be crossed by a horizontal ray
+        if y1[k] == y2[k]:
+            continue
+        straddles = (y1[k] > y) != (y2[k] > y)
+        x_cross = x1[k] + (y - y1[k]) * (x2[k] - x1[k]) / (y2[k] - y1[k])
+        crossings ^= straddles & (x < x_cross)
+
+    inside[candidates] = crossings
+    return inside
+
+def tagNeighborhoods(df: pd.DataFrame, neighborhoods: dict, lat_col='lat', lon_col='lon', boundary='boundaryLoose'):
+    '''
+    Add neighborhood membership columns to a dataframe of points
+
+    Parameters
+    ----------
+    df: pd.DataFrame
+        points to tag, e.g. the bus stops or an origin grid
+    neighborhoods: dict
+        output of getNeighborhoods() | keys are the neighborhood names
+    lat_col, lon_col: str
+        names of the coordinate columns, e.g. 'stop_lat' and 'stop_lon' for stops.txt
+    boundary: str
+        "boundaryLoose" or "boundaryTight"
+
+    Returns
+    -------
+    df: pd.DataFrame
+        copy of df with the columns is_in_<name> for each neighborhood,
+        num_neighborhoods and in_multiple_neighborhoods
+    '''
+    df = df.copy()
+    lats = df[lat_col].to_numpy(dtype=float)
+    lons = df[lon_col].to_numpy(dtype=float)
+
+    num_neighborhoods = np.zeros(len(df), dtype=int)
+    for name, nb in neighborhoods.items():
+        bounds = nb.bounds.get(boundary) if hasattr(nb, 'bounds') else None
+        is_in = pointsInPolygon(lats, lons, getattr(nb, boundary), bounds=bounds)
+        df[f'is_in_{name}'] = is_in
+        num_neighborhoods += is_in
+
+    df['num_neighborhoods'] = num_neighborhoods
+    df['in_multiple_neighborhoods'] = num_neighborhoods > 1
+    return df
+
+def filterToNeighborhoods(df: pd.DataFrame, neighborhoods: dict, lat_col='lat', lon_col='lon', boundary='boundaryLoose'):
+    '''
+    Tag the points and keep only the ones inside at least one neighborhood
+    '''
+    tagged = tagNeighborhoods(df, neighborhoods, lat_col=lat_col, lon_col=lon_col, boundary=boundary)
+    return tagged[tagged['num_neighborhoods'] > 0].reset_index(drop=True)
+
+if __name__ == '__main__':
+    from .neighborhoods import getNeighborhoods
+
+    parser = argparse.ArgumentParser(description="Tag bus stops with the neighborhoods they are in")
+    parser.add_argument('--stops', type=str, default='data/google_transit/stops.txt', help='Path to stops.txt')
+    parser.add_argument('--neighborhoods', type=str, default='data/neighborhoods.json', help='Path to neighborhoods.json')
+    parser.add_argument('--output', type=str, default='data/updated_stops.csv', help='Where to save the tagged stops')
+    args = parser.parse_args()
+
+    neighborhoods = getNeighborhoods(file=args.neighborhoods)
+    stops_df = pd.read_csv(args.stops)
+    tagged = filterToNeighborhoods(stops_df, neighborhoods, lat_col='stop_lat', lon_col='stop_lon')
+    tagged.to_csv(args.output, index=False)
+    print(f"Saved {len(tagged)} of {len(stops_df)} stops to {args.output}")
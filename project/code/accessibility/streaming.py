@@ -0,0 +1,187 @@
+'''
+Aggregate experiment outputs (results.csv, best_routes.csv, routes.csv) that do not fit
+in memory, by reading them in chunks of rows (CSV) or record batches (Parquet).
+
+Only the running state of every group is kept: the sum, count, min and max of every
+value column and the first value of the 'first' columns. The state of a chunk is merged
+into the running state, so the memory used is bounded by the number of groups plus one
+chunk, not by the number of rows.
+
+Counts, minimums, maximums and first values are identical to a groupby of the whole
+table, whatever the chunk size. Means are the sum of the partial sums over the count, so
+they agree with the in-memory mean up to floating point rounding (~1e-15 relative).
+
+Usage:
+    from accessibility.streaming import streamAggregate
+    stats = streamAggregate('experiments/BNMC/results.csv', chunksize=500000)
+
+    cd project/
+    python -m code.accessibility.streaming experiments/BNMC/results.csv --chunksize 500000
+'''
+''' IMPORTS '''
+import argparse
+import importlib
+import pandas as pd
+
+# One best route per origin, destination, time slot and preference
+GROUP_KEYS = ('origin_id', 'destination_id', 'time', 'preference')
+
+class StreamingAggregator:
+    def __init__(self, keys=GROUP_KEYS, values=('total_time', 'total_walk'),
+                 stats=('min', 'max', 'mean', 'count'), first=()):
+        '''
+        Parameters
+        ----------
+        keys: columns that identify a group
+        values: columns that are aggregated
+        stats: statistics of every value column, among 'min', 'max', 'mean', 'count'
+        first: columns whose first non-missing value of every group is kept (e.g. locations)
+        '''
+        self.keys = list(keys)
+        self.values = list(values)
+        self.stats = list(stats)
+        self.first = list(first)
+        self.state = None
+        self.pending = []
+        self.pendingRows = 0
+        self.rows = 0
+
+    def update(self, chunk: pd.DataFrame):
+        '''
+        Add the rows of a chunk to the running state
+        '''
+        self.rows += len(chunk)
+        grouped = chunk.groupby(self.keys, sort=False, observed=True)
+        parts = [grouped.size().rename('rows')]
+        for value in self.values:
+            partial = grouped[value].agg(['sum', 'count', 'min', 'max'])
+            parts.append(partial.rename(columns=lambda stat: f"{value}_{stat}"))
+        if self.first:
+            parts.append(grouped[self.first].first())
+        partial = pd.concat(parts, axis=1)
+        self.pending.append(partial)
+        self.pendingRows += len(partial)
+        # Merge when the pending partial states are as large as the running state,
+        # so every row of the state is merged O(log(chunks)) times
+        if self.state is None or self.pendingRows >= len(self.state):
+            self.merge()
+
+    def merge(self):
+        frames = ([] if self.state is None else [self.state]) + self.pending
+        if not frames:
+            return
+        # The running state comes first, so 'first' keeps the earliest row of the file
+        combined = pd.concat(frames) if len(frames) > 1 else frames[0]
+        aggregations = {'rows': 'sum'}
+        for value in self.values:
+            aggregations.update({f"{value}_sum": 'sum', f"{value}_count": 'sum',
+                                 f"{value}_min": 'min', f"{value}_max": 'max'})
+        aggregations.update({col: 'first' for col in self.first})
+        self.state = combined.groupby(level=self.keys, sort=False).agg(aggregations) if len(frames) > 1 else combined
+        self.pending = []
+        self.pendingRows = 0
+
+    def result(self):
+        '''
+        Returns
+        -------
+        table: pd.DataFrame
+            one row per group, sorted by the keys, with the key columns, 'rows' (number of rows),
+            <value>_<stat> for every value and statistic, and the 'first' columns
+        '''
+        self.merge()
+        columns = ['rows'] + [f"{value}_{stat}" for value in self.values for stat in self.stats] + self.first
+        if self.state is None:
+            return pd.DataFrame(columns=self.keys + columns)
+        state = self.state.sort_index()
+        for value in self.values:
+            count = state[f"{value}_count"]
+            state[f"{value}_mean"] = (state[f"{value}_sum"] / count).where(count > 0)
+        return state[columns].reset_index()
+
+
+def readChunks(file_path: str, columns=None, chunksize: int = 1000000, **kwargs):
+    '''
+    Yield the rows of a CSV file (chunks of chunksize rows) or of a Parquet file (record
+    batches of at most chunksize rows, read one row group at a time) as DataFrames.
+    Only the columns are read if given. pyarrow is only needed for Parquet files.
+    '''
+    if file_path.endswith('.parquet'):
+        parquet = importlib.import_module('pyarrow.parquet').ParquetFile(file_path)
+        for batch in parquet.iter_batches(batch_size=chunksize, columns=columns):
+            yield batch.to_pandas()
+    else:
+        kwargs.setdefault('encoding', 'utf-8-sig')  # results.csv starts with a byte order mark
+        yield from pd.read_csv(file_path, usecols=columns, chunksize=chunksize, **kwargs)
+
+
+def filterRows(chunk: pd.DataFrame, where: dict = None):
+    # Keep the rows where every column of where has the given value
+    for col, value in (where or {}).items():
+        chunk = chunk[chunk[col] == value]
+    return chunk
+
+
+def streamAggregate(file_path: str, keys=GROUP_KEYS, values=('total_time', 'total_walk'),
+                    stats=('min', 'max', 'mean', 'count'), first=(), where: dict = None, chunksize: int = 1000000):
+    '''
+    Group the rows of an experiment output without loading it in memory
+
+    Parameters
+    ----------
+    file_path: str
+        CSV or Parquet file, e.g. results.csv
+    keys, values, stats, first
+        see StreamingAggregator
+    where: dict
+        only the rows with these column values are used, e.g. {'preference': 'min_time'}
+    chunksize: int
+        number of rows read at once
+
+    Returns
+    -------
+    table: pd.DataFrame
+        see StreamingAggregator.result()
+    '''
+    aggregator = StreamingAggregator(keys, values, stats, first)
+    columns = list(dict.fromkeys(list(keys) + list(values) + list(first) + list(where or {})))
+    for chunk in readChunks(file_path, columns=columns, chunksize=chunksize):
+        aggregator.update(filterRows(chunk, where))
+    return aggregator.result()
+
+
+def streamEarliestRoute(file_path: str, origin_id: int, destination_id: int, time: int, preference: str,
+                        chunksize: int = 1000000):
+    '''
+    Earliest route of the OD pair leaving at or after time and arriving within the hour,
+    as accessibility.utils.getResults(), reading the file in chunks.
+    Returns None if there is no such route.
+    '''
+    best = None
+    for chunk in readChunks(file_path, chunksize=chunksize):
+        routes = chunk[(chunk['origin_id'] == origin_id) & (chunk['destination_id'] == destination_id) &
+                       (chunk['start_time'] >= float(time)) & (chunk['end_time'] <= float(time + 3600)) &
+                       (chunk['preference'] == preference)]
+        if len(routes):
+            candidate = routes.loc[routes['start_time'].idxmin()]
+            # Strictly earlier only: on ties the first row of the file is kept, as idxmin does
+            if best is None or candidate['start_time'] < best['start_time']:
+                best = candidate
+    return best
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Group an experiment output in chunks.')
+    parser.add_argument('file_path', help='CSV or Parquet file, e.g. experiments/BNMC/results.csv')
+    parser.add_argument('--keys', nargs='+', default=list(GROUP_KEYS), help='Columns that identify a group.')
+    parser.add_argument('--values', nargs='+', default=['total_time', 'total_walk'], help='Columns to aggregate.')
+    parser.add_argument('--chunksize', type=int, default=1000000, help='Number of rows read at once.')
+    parser.add_argument('--output', default=None, help='CSV file for the aggregated table.')
+    args = parser.parse_args()
+
+    table = streamAggregate(args.file_path, keys=args.keys, values=args.values, chunksize=args.chunksize)
+    if args.output:
+        table.to_csv(args.output, index=False)
+        print(f"Saved {len(table)} groups to {args.output}")
+    else:
+        print(table)
@@ -0,0 +1,216 @@
+'''
+Usage:
+cd project/
+python -m code.accessibility.time_layers BNMC min_time --metric=total_time --cell_size=150
+
+Time-sliced accessibility maps.
+All the time slots of results.csv are aggregated per grid cell in one pass, every slot
+is written as a small JSON tile, and a single HTML page is produced in which a slider
+switches between the slots (e.g. the morning peak against late evening) without
+regenerating any map.
+'''
+''' IMPORTS '''
+import argparse
+import json
+import os
+import numpy as np
+import pandas as pd
+from .heatmap_grid import HeatmapGrid, aggregateGrid, gridToGeoJSON, attachOriginLocations
+
+# Yellow-orange-red, the same color scheme as the static heatmap
+COLOR_SCALE = ['#ffffb2', '#fecc5c', '#fd8d3c', '#f03b20', '#bd0026']
+
+def formatSlot(seconds):
+    '''
+    Label a time slot given in seconds after midnight, e.g. 28800 -> "08:00"
+    '''
+    seconds = int(seconds)
+    return f"{seconds // 3600:02}:{(seconds % 3600) // 60:02}"
+
+def slotAggregates(results: pd.DataFrame, origins: pd.DataFrame, metrics: list, preference: str = None,
+                   cell_size: float = None, num_div: int = 10, agg: str = 'mean'):
+    '''
+    Aggregate the metrics per grid cell for every time slot at once
+
+    Parameters
+    ----------
+    results: pd.DataFrame
+        read from results.csv (or best_routes.csv) | must have a 'time' column
+    origins: pd.DataFrame
+        read from origins.csv
+    metrics: list
+        columns to aggregate, e.g. ['total_time', 'total_walk']
+    preference: str
+        keep only the rows of this preference if given | "min_time" or "min_walk"
+    cell_size: float
+        size of a grid cell in meters | if None, the grid has num_div cells along each side
+
+    Returns
+    -------
+    aggregated: pd.DataFrame
+        output of aggregateGrid() with one layer per value of 'time'
+    grid: HeatmapGrid
+    '''
+    if preference is not None and 'preference' in results.columns:
+        results = results[results['preference'] == preference]
+    results = attachOriginLocations(results, origins)
+
+    grid = HeatmapGrid.fromPoints(results['origin_lat'], results['origin_lon'], cell_size=cell_size, num_div=num_div)
+    aggregated = aggregateGrid(results, grid, metrics=metrics, by='time', agg=agg)
+    return aggregated, grid
+
+def slotTiles(aggregated: pd.DataFrame, metrics: list, decimals: int = 1):
+    '''
+    Split the aggregates into one compact, column oriented tile per time slot
+
+    Returns
+    -------
+    tiles: dict
+        keys are the time slots, values are {"time", "label", "cells", <metric>: [...]}
+    '''
+    tiles = {}
+    for time, slot in aggregated.groupby('time', sort=True):
+        tile = {'time': int(time),
+                'label': formatSlot(time),
+                'cells': slot['cell_id'].astype(int).tolist()}
+        for metric in metrics:
+            values = np.round(slot[metric].to_numpy(dtype=float), decimals)
+            tile[metric] = [None if np.isnan(v) else float(v) for v in values]
+        tiles[int(time)] = tile
+    return tiles
+
+def writeSlotTiles(tiles: dict, directory: str):
+    '''
+    Save every tile as <directory>/slot_<time>.json and return the list of paths
+    '''
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for time, tile in tiles.items():
+        path = os.path.join(directory, f"slot_{time}.json")
+        with open(path, 'w') as fp:
+            json.dump(tile, fp, separators=(',', ':'))
+        paths.append(path)
+    return paths
+
+def createTimeSliderMap(aggregated: pd.DataFrame, grid: HeatmapGrid, metric: str, map_file: str, legend: str = None):
+    '''
+    Write a single Leaflet page with the grid cells drawn once and a slider over the time slots
+
+    Parameters
+    ----------
+    aggregated: pd.DataFrame
+        output of slotAggregates()
+    grid: HeatmapGrid
+    metric: str
+        column used to color the cells
+    map_file: str
+        path of the HTML file to create
+
+    Returns
+    -------
+    map_file: str
+    '''
+    tiles = slotTiles(aggregated, [metric])
+    # Every cell that is used by at least one slot is drawn once, the slots only carry values
+    cells = aggregated.drop_duplicates(subset='cell_id')[['cell_id']].sort_values(by='cell_id')
+    geometry = gridToGeoJSON(cells, grid)
+
+    values = aggregated[metric].to_numpy(dtype=float)
+    values = values[~np.isnan(values)]
+    vmin, vmax = (float(values.min()), float(values.max())) if len(values) else (0.0, 1.0)
+    center = grid.unproject(0.0, 0.0)
+
+    page = _TEMPLATE
+    for key, value in {'__GEOMETRY__': json.dumps(geometry, separators=(',', ':')),
+                       '__TILES__': json.dumps(list(tiles.values()), separators=(',', ':')),
+                       '__METRIC__': json.dumps(metric),
+                       '__LEGEND__': json.dumps(legend if legend is not None else metric),
+                       '__COLORS__': json.dumps(COLOR_SCALE),
+                       '__VMIN__': json.dumps(vmin),
+                       '__VMAX__': json.dumps(vmax),
+                       '__CENTER__': json.dumps([float(center[0]), float(center[1])])}.items():
+        page = page.replace(key, value)
+
+    with open(map_file, 'w') as fp:
+        fp.write(page)
+    return map_file
+
+_TEMPLATE = '''<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8"/>
+<link rel="stylesheet" href="https://unpkg.com/leaflet@1.9.4/dist/leaflet.css"/>
+<script src="https://unpkg.com/leaflet@1.9.4/dist/leaflet.js"></script>
+<style>
+html, body, #map {height: 100%; margin: 0;}
+#panel {position: absolute; bottom: 20px; left: 20px; z-index: 1000; background: white;
+        padding: 8px 12px; border-radius: 4px; font-family: sans-serif; font-size: 13px;}
+#slider {width: 320px;}
+</style>
+</head>
+<body>
+<div id="map"></div>
+<div id="panel">
+  <div id="legend"></div>
+  <input id="slider" type="range" min="0" step="1"/> <span id="label"></span>
+</div>
+<script>
+var geometry = __GEOMETRY__, tiles = __TILES__, metric = __METRIC__;
+var colors = __COLORS__, vmin = __VMIN__, vmax = __VMAX__;
+var map = L.map('map').setView(__CENTER__, 14);
+L.tileLayer('https://{s}.basemaps.cartocdn.com/light_all/{z}/{x}/{y}.png',
+            {attribution: '&copy; OpenStreetMap &copy; CARTO'}).addTo(map);
+
+var layers = {};
+L.geoJSON(geometry, {
+  style: {weight: 0, fillOpacity: 0},
+  onEachFeature: function (feature, layer) { layers[feature.properties.cell_id] = layer; }
+}).addTo(map);
+
+function color(v) {
+  var t = vmax > vmin ? (v - vmin) / (vmax - vmin) : 0;
+  return colors[Math.min(colors.length - 1, Math.floor(t * colors.length))];
+}
+
+function show(i) {
+  var tile = tiles[i];
+  for (var id in layers) { layers[id].setStyle({fillOpacity: 0}); layers[id].unbindTooltip(); }
+  tile.cells.forEach(function (id, k) {
+    var v = tile[metric][k];
+    if (v === null) { return; }
+    layers[id].setStyle({fillColor: color(v), fillOpacity: 0.7});
+    layers[id].bindTooltip(metric + ': ' + v);
+  });
+  document.getElementById('label').textContent = tile.label;
+}
+
+var slider = document.getElementById('slider');
+slider.max = tiles.length - 1;
+slider.value = 0;
+slider.oninput = function () { show(parseInt(this.value)); };
+document.getElementById('legend').textContent = __LEGEND__ + ' (' + vmin.toFixed(0) + ' to ' + vmax.toFixed(0) + ')';
+if (tiles.length) { show(0); }
+</script>
+</body>
+</html>
+'''
+
+if __name__ == '__main__':
+    from .utils import getDirectory, getAllRoutes, getExperimentOD, checkPreference
+
+    parser = argparse.ArgumentParser(description="Experiment Details")
+    parser.add_argument('experiment_id', type=str, help='Experiment ID')
+    parser.add_argument('preference', type=str, help='Preference for the experiment')
+    parser.add_argument('--metric', type=str, default='total_time', help='Column used to color the map')
+    parser.add_argument('--cell_size', type=float, default=None, help='Size of a grid cell in meters')
+    args = parser.parse_args()
+
+    preference = checkPreference(args.preference)
+    directory = getDirectory(args.experiment_id)
+    results = getAllRoutes(directory)
+    origins, _ = getExperimentOD(directory)
+
+    aggregated, grid = slotAggregates(results, origins, metrics=[args.metric], preference=preference,
+                                      cell_size=args.cell_size)
+    writeSlotTiles(slotTiles(aggregated, [args.metric]), os.path.join(directory, "tiles"))
+    createTimeSliderMap(aggregated, grid, args.metric, os.path.join(directory, f"time_slider_{preference}.html"))
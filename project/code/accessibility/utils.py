@@ -27,15 +27,22 @@
 
 
 import os
+import functools
 import pandas as pd
 import sys
-import veroviz as vrv
 import numpy as np
+from .lazy import lazyImport, getORSKey
+from .streaming import streamEarliestRoute
+vrv = lazyImport('veroviz')
+
+# project/ and project/experiments/, wherever the script is started from
+PROJECT_DIR = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+EXPERIMENTS_DIR = os.path.join(PROJECT_DIR, 'experiments')
 
 def getDirectory(experiment_id: str):
     '''
     Return path to the experiments folder.
-    Assumes current directory has subdirectories code, data and experiments
+    The folder is project/experiments/<experiment_id>/, found from the location of this file
 
     Parameters
     ----------
@@ -49,7 +56,7 @@ def getDirectory(experiment_id: str):
         should contain origins.csv, destinations.csv and results.csv
 
     '''
-    directory = f"../../experiments/{experiment_id}/"
+    directory = os.path.join(EXPERIMENTS_DIR, experiment_id) + os.sep
     try:
         if not os.path.exists(directory):
             raise FileNotFoundError(f"Experiment {experiment_id} not found!")
@@ -60,17 +67,32 @@ def getDirectory(experiment_id: str):
         directory = input("Enter the correct path to the experiment folder, ensuring the path ends with a \ ")
         return directory
 
-def getResults(directory: str, origin_id: int, destination_id: int, time: int, preference: str):
+@functools.lru_cache(maxsize=4)
+def _readResults(results_path: str, modified: float):
+    return pd.read_csv(results_path)
+
+def readResults(results_path: str):
+    '''
+    Read results.csv once per process (again only if the file changed), so that repeated
+    getResults() calls only filter it
+    '''
+    return _readResults(results_path, os.path.getmtime(results_path))
+
+def getResults(directory: str, origin_id: int, destination_id: int, time: int, preference: str,
+               chunksize: int = None):
     '''
     Return a single route from the pd dataframe taken from results.csv within the experiment folder
+    With chunksize, results.csv is read in chunks of that many rows instead of all at once
 
     '''
     results_path = directory+"results.csv"
     try:
         if not os.path.exists(results_path):
             raise FileNotFoundError(f"Results of experiment not found!")
+        elif chunksize:
+            return streamEarliestRoute(results_path, origin_id, destination_id, time, preference, chunksize=chunksize)
         else:
-            all_routes = pd.read_csv(results_path)
+            all_routes = readResults(results_path)
             filtered_routes = all_routes[(all_routes['origin_id'] == origin_id) & 
                                 (all_routes['destination_id'] == destination_id) &
                                 (all_routes['start_time'] >= float(time)) &
@@ -109,12 +131,18 @@ def getExperimentOD(directory:str):
 
     return origins, destinations
 
+_VERSION_CHECKED = False
+
 def getAPIKey():
     '''
-    Check veroviz version and return api key
+    Check veroviz version (once) and return api key.
+    Call it where a remote provider (ORS-online) is used, not at import time.
     '''
-    print(vrv.checkVersion())
-    return os.environ['ORSKEY']
+    global _VERSION_CHECKED
+    if not _VERSION_CHECKED:
+        print(vrv.checkVersion())
+        _VERSION_CHECKED = True
+    return getORSKey()
 
 def getAllRoutes(directory: str):
     '''
@@ -135,7 +163,7 @@ def getAccessibilityScores(directory: str):
     '''
     Read list of all the acecssiblity scores
     '''
-    score_path = directory+"AI\\ai_1.txt"
+    score_path = os.path.join(directory, "AI", "ai_1.txt")
     try:
         if not os.path.exists(score_path):
             raise FileNotFoundError(f"Accessibility scores not found!")
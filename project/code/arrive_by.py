@@ -0,0 +1,148 @@
+import argparse
+import numpy as np
+import pandas as pd
+from .timeutils import hms_to_seconds, seconds_to_hms
+from .schema import read_table
+
+"""
+Purpose:
+    Arrive-by queries: "what is the latest time I can leave origin o and still reach
+    destination d by 9:00?", for one OD pair or for every OD pair at once.
+
+    The bus routes of every OD pair (the output of find_routes(), i.e. routes.csv) are
+    sorted by end_time, and the running maximum of start_time along that order is
+    stored. The latest departure for a deadline is then found with one binary search
+    from the end: the last route ending by the deadline gives, through the running
+    maximum, the latest start among all the routes that arrive in time.
+    The direct walking route can always be taken, leaving at deadline - total_time.
+
+Usage:
+    cd project/
+    python -m code.arrive_by --experiment_id BNMC --arrive_by 09:00:00
+"""
+
+
+class ArriveByIndex:
+    def __init__(self, routes, include_walking=True):
+        # routes: pd.DataFrame with the columns of find_routes()
+        routes = routes.reset_index(drop=True)
+        self.routes = routes
+        self.origin_ids = pd.Index(pd.unique(routes['origin_id']))
+        self.destination_ids = pd.Index(pd.unique(routes['destination_id']))
+        n_dest = len(self.destination_ids)
+        od = self.origin_ids.get_indexer(routes['origin_id']) * n_dest + self.destination_ids.get_indexer(routes['destination_id'])
+        self.n_od = len(self.origin_ids) * n_dest
+
+        # Bus routes sorted by (OD, end_time) with the running maximum of start_time
+        is_bus = (routes['bus_used'] != 0).to_numpy() & routes['end_time'].notna().to_numpy()
+        rows = np.flatnonzero(is_bus)
+        end = routes['end_time'].to_numpy(dtype=float)[rows]
+        order = np.lexsort((end, od[rows]))
+        self.rows = rows[order]
+        self.od = od[self.rows]
+        self.end = end[order]
+        start = routes['start_time'].to_numpy(dtype=float)[self.rows]
+        self.best_start = pd.Series(start).groupby(self.od).cummax().to_numpy()
+        # Position of the route that reaches the running maximum
+        is_new_max = np.r_[True, (self.od[1:] != self.od[:-1]) | (start[1:] >= self.best_start[:-1])]
+        best_pos = np.where(is_new_max, np.arange(len(start)), 0)
+        self.best_pos = pd.Series(best_pos).groupby(self.od).cummax().to_numpy()
+        self.od_start = np.searchsorted(self.od, np.arange(self.n_od), side='left')
+
+        # Direct walking time of every OD pair (inf if walking is not considered)
+        self.walk_time = np.full(self.n_od, np.inf)
+        self.walk_row = np.full(self.n_od, -1)
+        if include_walking:
+            walks = np.flatnonzero(~(routes['bus_used'] != 0).to_numpy())
+            self.walk_time[od[walks]] = routes['total_time'].to_numpy(dtype=float)[walks]
+            self.walk_row[od[walks]] = walks
+
+    def query(self, od, arrive_by):
+        # Latest departure and route row for arrays of OD codes and deadlines
+        arrive_by = np.broadcast_to(np.asarray(arrive_by, dtype=float), od.shape)
+        # Reverse binary search: last route of the OD pair ending by the deadline
+        span = (self.end.max() if len(self.end) else 0.0) + max(arrive_by.max() if arrive_by.size else 0.0, 0.0) + 1
+        key = self.od * span + self.end
+        pos = np.searchsorted(key, od * span + arrive_by, side='right') - 1
+        has_bus = (pos >= 0) & (pos >= self.od_start[od])
+        pos = np.where(has_bus, pos, 0)
+
+        bus_departure = np.where(has_bus, self.best_start[pos] if len(self.best_start) else -np.inf, -np.inf)
+        bus_row = np.where(has_bus, self.rows[self.best_pos[pos]] if len(self.rows) else -1, -1)
+        walk_departure = arrive_by - self.walk_time[od]
+
+        use_walk = walk_departure >= bus_departure
+        departure = np.where(use_walk, walk_departure, bus_departure)
+        row = np.where(use_walk, self.walk_row[od], bus_row)
+        departure = np.where(np.isfinite(departure), departure, np.nan)
+        return departure, np.where(np.isnan(departure), -1, row)
+
+    def latest_departure(self, origin_id, destination_id, arrive_by):
+        '''
+        Return the route with the latest departure arriving by arrive_by (seconds or "HH:MM:SS"),
+        with a 'latest_departure' column, or None if there is none.
+        '''
+        arrive_by = hms_to_seconds(arrive_by) if isinstance(arrive_by, str) else arrive_by
+        o = self.origin_ids.get_indexer([origin_id])[0]
+        d = self.destination_ids.get_indexer([destination_id])[0]
+        if o < 0 or d < 0:
+            return None
+        departure, row = self.query(np.array([o * len(self.destination_ids) + d]), arrive_by)
+        if row[0] < 0:
+            return None
+        route = self.routes.loc[[row[0]]].copy()
+        route['latest_departure'] = departure[0]
+        route['arrive_by'] = arrive_by
+        return route
+
+    def batch(self, arrive_by):
+        '''
+        Latest departure for every OD pair at once.
+
+        Returns
+        -------
+        departures: np.ndarray
+            (number of origins x number of destinations), NaN where the destination cannot be reached,
+            rows follow self.origin_ids and columns follow self.destination_ids
+        rows: np.ndarray
+            same shape, row of self.routes used (-1 if none)
+        '''
+        arrive_by = hms_to_seconds(arrive_by) if isinstance(arrive_by, str) else arrive_by
+        departure, row = self.query(np.arange(self.n_od), arrive_by)
+        shape = (len(self.origin_ids), len(self.destination_ids))
+        return departure.reshape(shape), row.reshape(shape)
+
+    def batch_routes(self, arrive_by):
+        '''
+        The routes chosen by batch() as a dataframe, one row per reachable OD pair
+        '''
+        arrive_by = hms_to_seconds(arrive_by) if isinstance(arrive_by, str) else arrive_by
+        departures, rows = self.batch(arrive_by)
+        found = rows.ravel() >= 0
+        result = self.routes.loc[rows.ravel()[found]].copy()
+        result['latest_departure'] = departures.ravel()[found]
+        result['arrive_by'] = arrive_by
+        # Walking routes have no fixed times, they are set by the deadline
+        # (float64: the deadline arithmetic does not fit the float32 times of a compacted table)
+        result = result.astype({'start_time': 'float64', 'end_time': 'float64'})
+        walking = result['bus_used'] == 0
+        result.loc[walking, 'start_time'] = result.loc[walking, 'latest_departure']
+        result.loc[walking, 'end_time'] = arrive_by
+        return result.reset_index(drop=True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Latest departure from every origin to arrive at every destination on time.')
+    parser.add_argument('--experiment_id', default='test', help='Unique identifier for the experiment.')
+    parser.add_argument('--arrive_by', default='09:00:00', help='Deadline, "HH:MM:SS" or seconds after midnight.')
+    args = parser.parse_args()
+
+    arrive_by = int(args.arrive_by) if args.arrive_by.strip().isdigit() else hms_to_seconds(args.arrive_by)
+    if arrive_by < 0:
+        parser.error(f"--arrive_by {args.arrive_by!r} is neither HH:MM:SS nor seconds after midnight")
+    routes = read_table(f"experiments/{args.experiment_id}/routes.csv", 'routes')
+    index = ArriveByIndex(routes)
+    result = index.batch_routes(arrive_by)
+    file_path = f"experiments/{args.experiment_id}/arrive_by_{seconds_to_hms(arrive_by).replace(':', '')}.csv"
+    result.to_csv(file_path, index=False)
+    print(f"Saved the latest departures of {len(result)} OD pairs to {file_path}")
@@ -48,6 +48,10 @@ def candidate_bus_pairs(origin_id, destination_id, location_to_stops):
     df_destination = location_to_stops['destination']
     df_od = location_to_stops['origin2destination']
 
+    # Only the stops that can be walked to from this origin / to this destination
+    df_origin = df_origin[df_origin['id'] == origin_id]
+    df_destination = df_destination[df_destination['id'] == destination_id]
+
     # Direct walking distance and time from origin to destination
     direct_dist = df_od.loc[(df_od['origin_id'] == origin_id) & (df_od['destination_id'] == destination_id), 'distance'].iloc[0]
     direct_time = df_od.loc[(df_od['origin_id'] == origin_id) & (df_od['destination_id'] == destination_id), 'time'].iloc[0]
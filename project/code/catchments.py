@@ -0,0 +1,293 @@
+import os
+import heapq
+import argparse
+import xml.etree.ElementTree as ET
+import numpy as np
+import pandas as pd
+
+"""
+Purpose:
+    Offline walking times on a real pedestrian network instead of routeType='manhattan'
+    (which walks straight through highways and rail lines) or online ORS queries.
+
+    The pedestrian graph is read once from a local OSM extract (.osm XML, e.g. exported
+    from openstreetmap.org or Overpass for the region) and cached as .npz.
+    For every bus stop, one Dijkstra search bounded by a cutoff distance is run from
+    the graph nodes closest to the stop (multi-source, each starting at its snapping
+    distance). The result is a sparse stop -> nearby node table of walking distances
+    that is saved in data/ and reused by every experiment: the walking distance from
+    an origin or destination to the stops is then a lookup of the node closest to it.
+    Distances are stored in meters; times are distance / walk_speed.
+
+Usage:
+    cd project/
+    python -m code.catchments data/buffalo.osm --region BNMC --cutoff 1200
+    python routing_template.py --experiment_id BNMC --walking_graph data/buffalo.osm
+"""
+
+# OSM highway values that can be walked on. Motorways and trunk roads are barriers
+# unless they are explicitly tagged foot=yes.
+WALKABLE_HIGHWAYS = {
+    'footway', 'pedestrian', 'path', 'steps', 'living_street', 'residential', 'service', 'unclassified',
+    'tertiary', 'tertiary_link', 'secondary', 'secondary_link', 'primary', 'primary_link', 'track',
+    'cycleway', 'corridor', 'crossing', 'road',
+}
+NO_FOOT = {'no', 'private'}
+EARTH_RADIUS = 6371008.8  # meters
+
+
+def haversine(lat1, lon1, lat2, lon2):
+    # Great circle distance (meters) between arrays of points
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(x, dtype=float)) for x in (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(a))
+
+
+def is_walkable(tags):
+    # tags: dict of the OSM tags of a way
+    foot = tags.get('foot')
+    if foot in NO_FOOT or (tags.get('access') in NO_FOOT and foot not in ('yes', 'designated', 'permissive')):
+        return False
+    highway = tags.get('highway')
+    return highway in WALKABLE_HIGHWAYS or (highway is not None and foot in ('yes', 'designated'))
+
+
+class PedestrianGraph:
+    def __init__(self, node_ids, lat, lon, indptr, indices, weights):
+        # Undirected graph in CSR format: the neighbors of node i are indices[indptr[i]:indptr[i+1]]
+        # and the lengths (meters) of the edges are weights[indptr[i]:indptr[i+1]]
+        self.node_ids = np.asarray(node_ids)
+        self.lat = np.asarray(lat, dtype=float)
+        self.lon = np.asarray(lon, dtype=float)
+        self.indptr = np.asarray(indptr, dtype=np.int64)
+        self.indices = np.asarray(indices, dtype=np.int64)
+        self.weights = np.asarray(weights, dtype=float)
+
+    @classmethod
+    def from_osm(cls, osm_file):
+        '''
+        Read the walkable ways of an OSM XML file into a graph
+        '''
+        coords = {}
+        ways = []
+        for _, element in ET.iterparse(osm_file, events=('end',)):
+            if element.tag == 'node':
+                coords[int(element.get('id'))] = (float(element.get('lat')), float(element.get('lon')))
+                element.clear()
+            elif element.tag == 'way':
+                tags = {tag.get('k'): tag.get('v') for tag in element.iter('tag')}
+                if is_walkable(tags):
+                    ways.append([int(nd.get('ref')) for nd in element.iter('nd')])
+                element.clear()
+
+        # Consecutive nodes of a way are joined by an edge
+        u = np.array([a for way in ways for a in way[:-1]], dtype=np.int64)
+        v = np.array([b for way in ways for b in way[1:]], dtype=np.int64)
+        known = np.array([a in coords and b in coords for a, b in zip(u.tolist(), v.tolist())], dtype=bool)
+        u, v = u[known], v[known]
+        node_ids, codes = np.unique(np.r_[u, v], return_inverse=True)
+        lat = np.array([coords[n][0] for n in node_ids.tolist()])
+        lon = np.array([coords[n][1] for n in node_ids.tolist()])
+        return cls.from_edges(node_ids, lat, lon, codes[:len(u)], codes[len(u):])
+
+    @classmethod
+    def from_edges(cls, node_ids, lat, lon, u, v, weights=None):
+        # Build the CSR arrays from the edge list (u, v); the length is the haversine distance by default
+        u, v = np.asarray(u, dtype=np.int64), np.asarray(v, dtype=np.int64)
+        if weights is None:
+            weights = haversine(np.asarray(lat)[u], np.asarray(lon)[u], np.asarray(lat)[v], np.asarray(lon)[v])
+        src, dst, w = np.r_[u, v], np.r_[v, u], np.r_[weights, weights]
+        order = np.argsort(src, kind='mergesort')
+        indptr = np.r_[0, np.cumsum(np.bincount(src, minlength=len(node_ids)))]
+        return cls(node_ids, lat, lon, indptr, dst[order], w[order])
+
+    def save(self, file_path):
+        np.savez_compressed(file_path, node_ids=self.node_ids, lat=self.lat, lon=self.lon,
+                            indptr=self.indptr, indices=self.indices, weights=self.weights)
+
+    @classmethod
+    def load(cls, file_path):
+        data = np.load(file_path)
+        return cls(data['node_ids'], data['lat'], data['lon'], data['indptr'], data['indices'], data['weights'])
+
+    @classmethod
+    def from_file(cls, osm_file):
+        # Read the OSM file once and use the .npz cache next to it afterwards
+        cache = os.path.splitext(osm_file)[0] + '_graph.npz'
+        if os.path.exists(cache) and os.path.getmtime(cache) >= os.path.getmtime(osm_file):
+            return cls.load(cache)
+        graph = cls.from_osm(osm_file)
+        graph.save(cache)
+        return graph
+
+    def nearest(self, lats, lons, k=2, chunk=2048):
+        '''
+        The k graph nodes closest to every point and the distances to them (meters), as (n, k) arrays
+        '''
+        lats, lons = np.atleast_1d(np.asarray(lats, dtype=float)), np.atleast_1d(np.asarray(lons, dtype=float))
+        k = min(k, len(self.lat))
+        scale = np.cos(np.radians(np.nanmean(self.lat)))
+        nodes = np.zeros((len(lats), k), dtype=np.int64)
+        for start in range(0, len(lats), chunk):
+            # Equirectangular distances are enough to rank the nodes
+            d2 = (lats[start:start + chunk, None] - self.lat[None, :]) ** 2 \
+                + ((lons[start:start + chunk, None] - self.lon[None, :]) * scale) ** 2
+            closest = np.argpartition(d2, k - 1, axis=1)[:, :k]
+            rank = np.argsort(np.take_along_axis(d2, closest, axis=1), axis=1)
+            nodes[start:start + chunk] = np.take_along_axis(closest, rank, axis=1)
+        distances = haversine(lats[:, None], lons[:, None], self.lat[nodes], self.lon[nodes])
+        return nodes, distances
+
+    def dijkstra(self, sources, offsets=None, cutoff=np.inf, targets=None):
+        '''
+        Multi-source Dijkstra: the shortest distance from any source (starting at its offset) to every
+        node closer than cutoff. Returns the arrays (nodes, distances).
+        If targets (node indices) are given, the search stops as soon as all of them are settled: the
+        distances of the targets are exact, the other nodes are only those settled before.
+        '''
+        offsets = np.zeros(len(sources)) if offsets is None else offsets
+        remaining = None if targets is None else set(int(t) for t in np.ravel(targets))
+        best = {}
+        heap = [(float(d), int(s)) for s, d in zip(sources, offsets) if d <= cutoff]
+        heapq.heapify(heap)
+        indptr, indices, weights = self.indptr, self.indices, self.weights
+        while heap:
+            dist, node = heapq.heappop(heap)
+            if node in best:
+                continue
+            best[node] = dist
+            if remaining is not None:
+                remaining.discard(node)
+                if not remaining:
+                    break
+            for i in range(indptr[node], indptr[node + 1]):
+                neighbor = indices[i]
+                new_dist = dist + weights[i]
+                if new_dist <= cutoff and neighbor not in best:
+                    heapq.heappush(heap, (new_dist, int(neighbor)))
+        return np.fromiter(best.keys(), dtype=np.int64, count=len(best)), \
+            np.fromiter(best.values(), dtype=float, count=len(best))
+
+
+class StopCatchments:
+    def __init__(self, stop_ids, nodes, distances, cutoff):
+        # Sparse table: rows (stop_id, node, distance) sorted by node, so the stops near a node
+        # are a contiguous run found with a binary search
+        order = np.lexsort((np.asarray(stop_ids), np.asarray(nodes)))
+        self.stop_ids = np.asarray(stop_ids)[order]
+        self.nodes = np.asarray(nodes, dtype=np.int64)[order]
+        self.distances = np.asarray(distances, dtype=float)[order]
+        self.cutoff = float(cutoff)
+
+    @classmethod
+    def build(cls, graph, stops, cutoff=1200, k=2):
+        '''
+        One cutoff-bounded Dijkstra per stop.
+
+        graph: PedestrianGraph
+        stops: pd.DataFrame with 'stop_id' and 'stop_lat'/'stop_lon' (or 'lat'/'lon')
+        cutoff: maximum walking distance (meters) kept in the table
+        k: number of graph nodes the stop is attached to
+        '''
+        lat_col, lon_col = ('stop_lat', 'stop_lon') if 'stop_lat' in stops.columns else ('lat', 'lon')
+        snapped, offsets = graph.nearest(stops[lat_col], stops[lon_col], k=k)
+        stop_ids, nodes, distances = [], [], []
+        for stop_id, sources, source_offsets in zip(stops['stop_id'].tolist(), snapped, offsets):
+            reached, dist = graph.dijkstra(sources, source_offsets, cutoff=cutoff)
+            stop_ids.append(np.full(len(reached), stop_id))
+            nodes.append(reached)
+            distances.append(dist)
+        return cls(np.concatenate(stop_ids), np.concatenate(nodes), np.concatenate(distances), cutoff)
+
+    def save(self, file_path):
+        np.savez_compressed(file_path, stop_ids=self.stop_ids, nodes=self.nodes, distances=self.distances,
+                            cutoff=self.cutoff)
+
+    @classmethod
+    def load(cls, file_path):
+        data = np.load(file_path)
+        return cls(data['stop_ids'], data['nodes'], data['distances'], data['cutoff'])
+
+    def lookup(self, graph, lats, lons, ids, walk_speed=1.4, k=2):
+        '''
+        Walking distance and time from every point to every stop of its catchment, in the format of
+        location_to_stops['origin'] / ['destination'] of routing_template.py (stop_id, id, time, distance).
+        A point reaches a stop through the best of its k closest graph nodes.
+        '''
+        snapped, offsets = graph.nearest(lats, lons, k=k)
+        point = np.repeat(np.arange(len(snapped)), snapped.shape[1])
+        snapped, offsets = snapped.ravel(), offsets.ravel()
+
+        # Rows of the table for every snapped node
+        lo = np.searchsorted(self.nodes, snapped, side='left')
+        hi = np.searchsorted(self.nodes, snapped, side='right')
+        counts = hi - lo
+        rows = np.repeat(lo, counts) + np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        table = pd.DataFrame({
+            'stop_id': self.stop_ids[rows],
+            'id': np.asarray(ids)[np.repeat(point, counts)],
+            'distance': self.distances[rows] + np.repeat(offsets, counts),
+        })
+        table = table[table['distance'] <= self.cutoff]
+        table = table.groupby(['id', 'stop_id'], sort=False, as_index=False)['distance'].min()
+        table['time'] = table['distance'] / walk_speed
+        return table[['stop_id', 'id', 'time', 'distance']]
+
+
+def point_to_point(graph, origins, destinations, walk_speed=1.4, k=2, cutoff=None):
+    '''
+    Walking distance and time between every origin and destination on the graph, in the format of
+    location_to_stops['origin2destination'] (origin_id, destination_id, time, distance).
+    One Dijkstra per origin, stopped once every destination node is settled or at cutoff meters.
+    cutoff defaults to walk_speed * 3600: a longer walk does not fit in a slot, so it is never a
+    route and its distance may be left at inf (as for the destinations that cannot be reached).
+    '''
+    cutoff = walk_speed * 3600 if cutoff is None else cutoff
+    origin_nodes, origin_offsets = graph.nearest(origins['lat'], origins['lon'], k=k)
+    destination_nodes, destination_offsets = graph.nearest(destinations['lat'], destinations['lon'], k=k)
+    rows = []
+    targets = np.unique(destination_nodes)
+    for origin_id, sources, offsets in zip(origins['name'].tolist(), origin_nodes, origin_offsets):
+        reached, dist = graph.dijkstra(sources, offsets, cutoff=cutoff, targets=targets)
+        dist_of_node = np.full(len(graph.lat), np.inf)
+        dist_of_node[reached] = dist
+        distance = (dist_of_node[destination_nodes] + destination_offsets).min(axis=1)
+        rows.append(pd.DataFrame({'origin_id': origin_id, 'destination_id': destinations['name'].to_numpy(),
+                                  'distance': distance}))
+    table = pd.concat(rows, ignore_index=True)
+    table['time'] = table['distance'] / walk_speed
+    return table[['origin_id', 'destination_id', 'time', 'distance']]
+
+
+def catchment_file(osm_file, region, cutoff):
+    # Where the catchments of a region are saved
+    name = os.path.splitext(os.path.basename(osm_file))[0]
+    return os.path.join('data', f'catchments_{name}_{region}_{int(cutoff)}.npz')
+
+
+def get_catchments(osm_file, stops, region='BNMC', cutoff=1200, overwrite=False):
+    '''
+    Load the catchments of the region from data/, or build and save them
+    '''
+    graph = PedestrianGraph.from_file(osm_file)
+    file_path = catchment_file(osm_file, region, cutoff)
+    if os.path.exists(file_path) and not overwrite:
+        return graph, StopCatchments.load(file_path)
+    catchments = StopCatchments.build(graph, stops, cutoff=cutoff)
+    catchments.save(file_path)
+    return graph, catchments
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build the walking catchments of the bus stops of a region.')
+    parser.add_argument('osm_file', help='Local OSM extract (.osm XML) covering the region.')
+    parser.add_argument('--region', default='BNMC', help='Region whose stops are used. Default is BNMC.')
+    parser.add_argument('--cutoff', type=float, default=1200, help='Maximum walking distance (meters). Default is 1200.')
+    args = parser.parse_args()
+
+    from .accessibility.regions import getRegionStops
+    stops = getRegionStops(args.region)
+    graph, catchments = get_catchments(args.osm_file, stops, region=args.region, cutoff=args.cutoff, overwrite=True)
+    print(f"Pedestrian graph: {len(graph.lat)} nodes, {len(graph.indices) // 2} edges")
+    print(f"Saved {len(catchments.nodes)} stop-node distances for {len(stops)} stops to "
+          f"{catchment_file(args.osm_file, args.region, args.cutoff)}")
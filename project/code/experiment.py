@@ -0,0 +1,334 @@
+import os
+import sys
+import json
+import argparse
+import functools
+import numpy as np
+import pandas as pd
+from .precompute import pre_compute_bus_routes
+from .service_calendar import ServiceCalendar
+from .candidate_routes import candidate_bus_pairs
+from .find_all_routes import find_routes
+from .use_preferences import route_frontier, preference_from_frontier
+from .pruning import prune_routes
+from .accessibility.regions import getRegion, getRegionStops
+from .accessibility.cube import ALL_TIMES, buildCube, saveCube, readCube
+from .accessibility.utils import PROJECT_DIR, EXPERIMENTS_DIR
+from .schema import compact, compact_walking, read_table
+
+"""
+Purpose:
+    One object per experiment that owns all of its data products. Every product is
+    a cached property: it is loaded from the experiment folder if it was saved by an
+    earlier run, computed otherwise (and then saved), and kept in memory for the rest
+    of the process. Entry points share the products instead of rebuilding them.
+
+    Products (files in project/experiments/<experiment_id>/):
+        origins, destinations      origins.csv, destinations.csv
+        walking                    walking_origins_to_stops.csv, walking_destinations_to_stops.csv,
+                                   walking_origins_to_destinations.csv
+        routes                     routes.csv
+        best_routes                best_routes.csv (results.csv of the earlier algorithm if that is all there
+                                   is and results_fallback is True; 'run' never uses it)
+        scores                     AI/ai_1.txt
+        cube                       cube.db (accessibility/cube.py, read by slices)
+    Shared inputs (project/data/): gtfs tables, calendar, region stops, bus_routes (data/bus_routes*.pkl)
+
+    The parameters of the run that saved the products (params.json) are the defaults of
+    the experiment; a saved product is only loaded if the parameters given now are the
+    same, otherwise a ValueError asks for overwrite=True (--overwrite).
+
+    Paths are built from the location of this file, so the experiments are found
+    wherever the command is started from; the GTFS inputs are read from project/data/.
+
+Usage:
+    cd project/
+    python -m code.experiment run BNMC --walk_speed 1.4
+    python -m code.experiment score BNMC
+    python -m code.experiment map BNMC
+    python -m code.experiment heatmap BNMC --preference min_time
+    python -m code.experiment viz BNMC --origin_id 1 --destination_id 1 --time_of_day 28800
+    python -m code.experiment cube BNMC
+
+    from code.experiment import Experiment
+    exp = Experiment('BNMC')
+    exp.best_routes, exp.scores
+"""
+
+GTFS_DIR = os.path.join(PROJECT_DIR, 'data', 'google_transit')
+
+DEFAULT_PARAMS = {
+    'day_of_week': 'Weekday',
+    'date': None,
+    'walk_speed': 1.4,
+    'time_inc': 15 * 60,
+    'region': 'BNMC',
+    'prune_routes': False,
+    'beta': 140,
+    'walking_graph': None,
+    'walking_cutoff': 1200,
+}
+
+
+def script_module(name):
+    # Import a script of code/ (ai_map.py, vizRoute.py, ...) the way it imports itself (from accessibility.X)
+    code_dir = os.path.dirname(os.path.abspath(__file__))
+    if code_dir not in sys.path:
+        sys.path.append(code_dir)
+    return __import__(name)
+
+
+class Experiment:
+    def __init__(self, experiment_id, overwrite=False, results_fallback=True, **params):
+        # params: see DEFAULT_PARAMS; overwrite: recompute the products instead of loading them
+        # results_fallback: use results.csv as the best routes of an experiment that was never routed
+        self.experiment_id = experiment_id
+        self.directory = os.path.join(EXPERIMENTS_DIR, experiment_id)
+        if not os.path.isdir(self.directory):
+            raise FileNotFoundError(f"Experiment {experiment_id} not found in {EXPERIMENTS_DIR}")
+        self.overwrite = overwrite
+        self.results_fallback = results_fallback
+        self.saved_params = {}
+        if os.path.exists(self.path('params.json')) and not overwrite:
+            with open(self.path('params.json')) as json_file:
+                self.saved_params = {k: v for k, v in json.load(json_file).items() if k in DEFAULT_PARAMS}
+        self.params = {**DEFAULT_PARAMS, **self.saved_params, **{k: v for k, v in params.items() if v is not None}}
+        self._gtfs = {}
+
+    def path(self, *names):
+        return os.path.join(self.directory, *names)
+
+    def saved(self, *names):
+        # True if a product can be loaded instead of computed
+        if self.overwrite or not os.path.exists(self.path(*names)):
+            return False
+        self.check_params()
+        return True
+
+    def check_params(self):
+        # The saved products were made with saved_params: refuse to mix them with other parameters
+        mismatched = {k: (v, self.params[k]) for k, v in self.saved_params.items() if v != self.params[k]}
+        if mismatched:
+            raise ValueError(f"The products of {self.experiment_id} were computed with other parameters "
+                             f"(saved, requested): {mismatched}. Use overwrite=True (--overwrite) to recompute them.")
+
+    def refresh(self, *products):
+        '''
+        Forget the products kept in memory (all if none is given), e.g. after changing self.params
+        '''
+        for product in products or [name for name, value in vars(type(self)).items()
+                                    if isinstance(value, functools.cached_property)]:
+            self.__dict__.pop(product, None)
+
+    def save_params(self):
+        with open(self.path('params.json'), 'w') as json_file:
+            json.dump({'experiment_id': self.experiment_id, **self.params}, json_file, indent=4)
+
+    ''' INPUTS '''
+    @functools.cached_property
+    def origins(self):
+        return pd.read_csv(self.path('origins.csv'))
+
+    @functools.cached_property
+    def destinations(self):
+        return pd.read_csv(self.path('destinations.csv'))
+
+    def gtfs(self, name):
+        # A table of the GTFS feed, e.g. gtfs('trips'), read once per experiment
+        if name not in self._gtfs:
+            self._gtfs[name] = pd.read_csv(os.path.join(GTFS_DIR, f'{name}.txt'))
+        return self._gtfs[name]
+
+    @functools.cached_property
+    def calendar(self):
+        return ServiceCalendar.from_gtfs(GTFS_DIR)
+
+    @functools.cached_property
+    def stops(self):
+        # Stops of the region with their is_in_<neighborhood> columns
+        return getRegionStops(self.params['region'])
+
+    @functools.cached_property
+    def stop_data(self):
+        # Stops joined with their stop times, trips and calendar attributes, as a veroviz nodes
+        # dataframe (perform_merge(target_file='calendar') in routing_template.py)
+        routing_template = self._routing_template()
+        df = self.stops.merge(self.gtfs('stop_times'), on='stop_id')
+        df = df.merge(self.gtfs('trips'), on='trip_id')
+        df = df.merge(self.gtfs('calendar_attributes'), on='service_id')
+        return compact(routing_template.vero_viz_node_dataframe(df=df), 'stop_data')
+
+    def _routing_template(self):
+        # routing_template.py lives in project/; its helpers read the parameters from its global 'input'
+        if PROJECT_DIR not in sys.path:
+            sys.path.append(PROJECT_DIR)
+        import routing_template
+        routing_template.input = {'experiment_id': self.experiment_id, **self.params}
+        return routing_template
+
+    ''' STAGES '''
+    @functools.cached_property
+    def walking(self):
+        # location_to_stops of routing_template.py: the walking times and distances
+        if self.overwrite:
+            for name in ['walking_origins_to_stops.csv', 'walking_destinations_to_stops.csv',
+                         'walking_origins_to_destinations.csv']:
+                if os.path.exists(self.path(name)):
+                    os.remove(self.path(name))
+        if self.saved('walking_origins_to_stops.csv') and self.saved('walking_destinations_to_stops.csv') \
+                and self.saved('walking_origins_to_destinations.csv'):
+            return {'origin': read_table(self.path('walking_origins_to_stops.csv'), 'walking'),
+                    'destination': read_table(self.path('walking_destinations_to_stops.csv'), 'walking'),
+                    'origin2destination': read_table(self.path('walking_origins_to_destinations.csv'),
+                                                     'origin2destination')}
+        location_to_stops = self._routing_template().get_walking_df(df=self.stop_data, origins=self.origins,
+                                                                    destinations=self.destinations,
+                                                                    filepath=self.directory + os.sep,
+                                                                    calendar=self.calendar)
+        return compact_walking(location_to_stops)
+
+    @functools.cached_property
+    def bus_routes(self):
+        return pre_compute_bus_routes(stop_ids=self.stops['stop_id'].unique(), prune=self.params['prune_routes'],
+                                      date=self.params['date'], calendar=self.calendar)
+
+    @functools.cached_property
+    def routes(self):
+        if self.saved('routes.csv'):
+            return read_table(self.path('routes.csv'), 'routes')
+        routes = []
+        for origin_id in self.origins['name'].tolist():
+            for destination_id in self.destinations['name'].tolist():
+                bus_pairs = candidate_bus_pairs(origin_id=origin_id, destination_id=destination_id,
+                                                location_to_stops=self.walking)
+                routes.append(find_routes(bus_routes=self.bus_routes, location_to_stops=self.walking,
+                                          bus_pairs=bus_pairs, origin_id=origin_id, destination_id=destination_id))
+        routes = compact(pd.concat(routes, ignore_index=True), 'routes')
+        if self.params['prune_routes']:
+            routes = prune_routes(routes).reset_index(drop=True)
+        routes.to_csv(self.path('routes.csv'), index=False)
+        return routes
+
+    @property
+    def times(self):
+        return range(60 * 60 * 5, 60 * 60 * 22, int(self.params['time_inc']))  # 5am to 10pm
+
+    @functools.cached_property
+    def best_routes(self):
+        if self.saved('best_routes.csv'):
+            return read_table(self.path('best_routes.csv'), 'best_routes')
+        # Results of the earlier routing algorithm, if this experiment was never run with routing_template.py
+        if self.results_fallback and not self.saved('routes.csv') and self.saved('results.csv'):
+            return read_table(self.path('results.csv'), 'best_routes', encoding='utf-8-sig')
+        frontier = route_frontier(self.routes, self.times, beta=self.params['beta'])
+        best_routes = compact(pd.concat([preference_from_frontier(frontier, preference='min_time'),
+                                         preference_from_frontier(frontier, preference='min_walk')],
+                                        ignore_index=True), 'best_routes')
+        best_routes.to_csv(self.path('best_routes.csv'), index=False)
+        return best_routes
+
+    @functools.cached_property
+    def scores(self):
+        '''
+        ai_1 of every origin (in the order of origins.csv): the fraction of the destinations
+        reached by at least one best route
+        '''
+        if self.saved('AI', 'ai_1.txt'):
+            return np.loadtxt(self.path('AI', 'ai_1.txt'), delimiter=',')
+        reached = self.best_routes.drop_duplicates(subset=['origin_id', 'destination_id']) \
+            .groupby('origin_id').size()
+        scores = reached.reindex(self.origins['name'], fill_value=0).to_numpy() / len(self.destinations)
+        os.makedirs(self.path('AI'), exist_ok=True)
+        np.savetxt(self.path('AI', 'ai_1.txt'), scores)
+        return scores
+
+    ''' QUERIES '''
+    def cube(self, **where):
+        '''
+        Slice of the accessibility cube, e.g. cube(level='neighborhood', preference='min_time')
+        (see readCube() for the filters). cube.db is built from the best routes on first use.
+        '''
+        if not self.saved('cube.db') and not getattr(self, '_cube_built', False):
+            saveCube(buildCube(self.best_routes, self.origins, self.destinations, getRegion(self.params['region'])),
+                     self.path('cube.db'))
+            self._cube_built = True
+        return readCube(self.path('cube.db'), **where)
+
+    def best_route(self, origin_id, destination_id, time, preference='min_time'):
+        # Earliest best route of the slot (as accessibility.utils.getResults())
+        routes = self.best_routes
+        if 'preference' in routes.columns:
+            routes = routes[routes['preference'] == preference]
+        routes = routes[(routes['origin_id'] == origin_id) & (routes['destination_id'] == destination_id) &
+                        (routes['start_time'] >= float(time)) & (routes['end_time'] <= float(time + 3600))]
+        return routes.loc[routes['start_time'].idxmin()] if len(routes) else None
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run, score and visualize an experiment.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    for command, description in [('run', 'Compute the walking times, routes and best routes.'),
+                                 ('score', 'Compute the accessibility score of every origin.'),
+                                 ('map', 'Map the origins colored by accessibility score.'),
+                                 ('heatmap', 'Grid heatmap of the best routes.'),
+                                 ('viz', 'Map one best route.'),
+                                 ('cube', 'Aggregate the best routes by origin, neighborhood, slot and preference.')]:
+        sub = subparsers.add_parser(command, help=description)
+        sub.add_argument('experiment_id', help='Unique identifier for the experiment.')
+        sub.add_argument('--overwrite', action='store_true', help='Recompute the products instead of loading them.')
+        if command == 'run':
+            sub.add_argument('--day_of_week', default=None, choices=['Weekday', 'Weekend'])
+            sub.add_argument('--date', default=None, help='Date of the experiment, e.g. 2024-01-15.')
+            sub.add_argument('--walk_speed', type=float, default=None, help='Walking speed (m/s).')
+            sub.add_argument('--time_inc', type=float, default=None, help='Time increment of the slots (s).')
+            sub.add_argument('--region', default=None, help='Service area whose bus stops are used.')
+            sub.add_argument('--prune_routes', action='store_true', default=None,
+                             help='Only keep the Pareto-efficient routes.')
+            sub.add_argument('--walking_graph', default=None, help='Local OSM extract for network walking times.')
+        if command == 'map':
+            sub.add_argument('--cluster', action='store_true', help='Cluster the origins on large maps.')
+        if command in ('heatmap', 'viz'):
+            sub.add_argument('--preference', default='min_time', choices=['min_time', 'min_walk'])
+        if command == 'viz':
+            sub.add_argument('--origin_id', type=int, required=True)
+            sub.add_argument('--destination_id', type=int, required=True)
+            sub.add_argument('--time_of_day', type=int, required=True, help='Time of day in seconds.')
+    args = vars(parser.parse_args())
+
+    command = args.pop('command')
+    params = {k: args.pop(k) for k in list(args) if k in DEFAULT_PARAMS}
+    # 'run' computes the best routes, the other commands can read results.csv of the earlier algorithm
+    exp = Experiment(args.pop('experiment_id'), overwrite=args.pop('overwrite'), results_fallback=command != 'run',
+                     **params)
+
+    if command == 'run':
+        loaded = exp.saved('best_routes.csv')
+        best_routes = exp.best_routes
+        exp.save_params()
+        if loaded:
+            print(f"Loaded {len(best_routes)} best routes from {exp.path('best_routes.csv')} "
+                  f"(computed with the same parameters, use --overwrite to recompute them)")
+        else:
+            print(f"Saved {len(best_routes)} best routes to {exp.path('best_routes.csv')}")
+    elif command == 'score':
+        scores = exp.scores
+        print(f"Mean accessibility score of {len(scores)} origins: {np.mean(scores):.3f}")
+    elif command == 'map':
+        ai_map = script_module('ai_map')
+        ai_map.accessibility(exp.origins, exp.destinations, exp.scores,
+                             map_file=exp.path('accessibility_map.html'), cluster=args['cluster'])
+    elif command == 'heatmap':
+        from .accessibility.WIP.heatmap import createHeatmap
+        createHeatmap(exp.best_routes, args['preference'], origins=exp.origins)
+    elif command == 'cube':
+        cube = exp.cube(time=ALL_TIMES)
+        print(cube[cube['level'] != 'origin'][['level', 'key', 'preference', 'routes', 'reachable',
+                                               'total_time_mean', 'total_time_p50']].to_string(index=False))
+    elif command == 'viz':
+        vizRoute = script_module('vizRoute')
+        result = exp.best_route(args['origin_id'], args['destination_id'], args['time_of_day'], args['preference'])
+        if result is None:
+            sys.exit("No route found for this origin, destination and time")
+        vizRoute.viewRoute(result, exp.origins[exp.origins['name'] == args['origin_id']],
+                           exp.destinations[exp.destinations['name'] == args['destination_id']],
+                           args['preference'], args['time_of_day'])
@@ -1,5 +1,7 @@
 import pandas as pd
 from datetime import datetime
+from .pruning import prune_routes
+from .precompute import ACCESSIBLE, UNKNOWN
 """
 TODO: team 3 must implement this function
 
@@ -17,6 +19,8 @@ Input:
     bus_pairs: the output of candidate_bus_pairs. It is a list of CandidatePair objects.
     origin_id: an integer.
     destination_id: an integer.
+    prune: if True, only the Pareto-efficient routes (latest start, earliest end,
+           least walking) are returned. This never changes the best route.
 
 Output:
     Pandas dataframe.
@@ -27,6 +31,7 @@ Output:
                       as the bus pick up time minus the walking time to that bus stop.
         'end_time': the earlist possible time this route could end. It is calculated
                     as the bus drop off time plus the walking time to the destination.
+        'access': wheelchair accessibility bitmask of the stops and trip (see precompute.wheelchair_mask).
 
 NOTE: 
 bus_pairs contains a lot of information about times and distances. It is possible (likely?)
@@ -35,7 +40,7 @@ contained more efficiently in bus_pairs. However, I will leave it as an argument
 and team 3 can remove it later if it isn't needed.
 """
 
-def find_routes(bus_routes, location_to_stops, bus_pairs, origin_id, destination_id):
+def find_routes(bus_routes, location_to_stops, bus_pairs, origin_id, destination_id, prune=False):
     all_routes = []
     is_feasible = True # Assume the bus pair is feasible - will be set to False if no routes are found
 
@@ -85,6 +90,7 @@ def find_routes(bus_routes, location_to_stops, bus_pairs, origin_id, destination
                 'start_time': (route_info.pick_up_time - walk_to_start_time),
                 'end_time': (route_info.drop_off_time + walk_to_destination_time),
                 'bus_used': 1,
+                'access': getattr(route_info, 'access', UNKNOWN),
                 'is_feasible': is_feasible
             }
             all_routes.append(route_dict)
@@ -109,6 +115,7 @@ def find_routes(bus_routes, location_to_stops, bus_pairs, origin_id, destination
         'start_time': None,
         'end_time': None,
         'bus_used': 0,
+        'access': ACCESSIBLE,
         'is_feasible': is_feasible
     }
     all_routes.append(direct_walk_route)
@@ -116,4 +123,7 @@ def find_routes(bus_routes, location_to_stops, bus_pairs, origin_id, destination
     # filter out the routes based on the current time
     #all_routes = filter_routes_by_current_time(pd.DataFrame(all_routes))
 
-    return pd.DataFrame(all_routes)
\ No newline at end of file
+    all_routes = pd.DataFrame(all_routes)
+    if prune:
+        all_routes = prune_routes(all_routes, report=False)
+    return all_routes
\ No newline at end of file
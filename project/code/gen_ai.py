@@ -1,7 +1,9 @@
+import os
 import pandas as pd
 import argparse
 import numpy as np
 from accessibility.utils import getDirectory, getAllRoutes, getExperimentOD
+from accessibility.streaming import streamAggregate
 
 def ai_1(results: pd.DataFrame, origins: pd.DataFrame, destinations: pd.DataFrame):
     number_of_origins = origins['name'].max()
@@ -23,13 +25,21 @@ def ai_1(results: pd.DataFrame, origins: pd.DataFrame, destinations: pd.DataFram
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description="Experiment Details")
     parser.add_argument('experiment_id', type=str, help='Experiment ID')
+    parser.add_argument('--chunksize', type=int, default=None,
+                        help='Read results.csv in chunks of this many rows instead of loading it in memory')
     args = parser.parse_args()
 
     directory = getDirectory(args.experiment_id)
     origins, destinations = getExperimentOD(directory)
-    results = getAllRoutes(directory)
+    if args.chunksize:
+        # One row per OD pair with at least one route is all ai_1 needs
+        results = streamAggregate(os.path.join(directory, "results.csv"), keys=['origin_id', 'destination_id'],
+                                  values=[], chunksize=args.chunksize)
+    else:
+        results = getAllRoutes(directory)
 
     score1 = ai_1(results, origins, destinations)
-    np.savetxt(directory+f"\\AI\\ai_1.txt", score1)
+    os.makedirs(os.path.join(directory, "AI"), exist_ok=True)
+    np.savetxt(os.path.join(directory, "AI", "ai_1.txt"), score1)
 
 
@@ -0,0 +1,318 @@
+import os
+import json
+import shutil
+import argparse
+import numpy as np
+import pandas as pd
+from .sweeps import sweep
+from .catchments import haversine
+from .accessibility.regions import getRegion, getRegionStops
+from .accessibility.spatial import pointsInPolygon
+from .accessibility.heatmap_grid import HeatmapGrid
+from .accessibility.utils import EXPERIMENTS_DIR
+
+"""
+Purpose:
+    Generate the origins of an experiment with an adaptive quadtree instead of by hand.
+
+    A coarse grid of square cells (cell_size meters) is laid over the neighborhoods of the
+    region, and every cell whose center is inside a neighborhood boundary becomes an origin
+    (at its center). The origins are scored, then the leaves whose score differs from the
+    score of a neighboring leaf (sharing an edge) by more than threshold are split in four,
+    largest difference first, and the children are scored. This is repeated until no leaf
+    varies by more than threshold, the cells are as small as allowed, or budget origins
+    have been scored. Cells are cell_size / 2**k wide, so the finest cells are the smallest
+    of these that are at least min_cell_size wide (e.g. 400 and 60 give 100 m cells).
+    Children whose center is outside the boundaries are dropped; a cell without any child
+    inside is not split.
+
+    Flat areas keep their coarse cells, so the grid is fine only along the edges of the
+    accessibility surface, for a fraction of the OD pairs of a uniform grid of the finest
+    cells (the size of that grid is printed at the end).
+
+    The scores come from evaluate(origins) -> pd.Series of scores indexed by origin name,
+    which is only called on the new origins of every round. The default, SweepEvaluator,
+    is the accessibility of sweeps.py (e.g. the mean total_time_score over the destinations
+    and slots) with manhattan walking distances, as routing_template.py computes them.
+
+Output (in project/experiments/<experiment_id>/):
+    origins.csv         the leaves, with the columns of the hand-made origins.csv
+                        (name, block_id, lat, lon, neighborhood, point_type='adaptive')
+    origin_grid.csv     the same origins with level, cell_size (m), score and variation
+                        (largest score difference to a neighbor)
+    origin_grid.json    the parameters and the origins scored in every round
+
+Usage:
+    cd project/
+    python -m code.origin_grid --experiment_id BNMC_grid --destinations experiments/BNMC/destinations.csv \
+        --cell_size 400 --min_cell_size 50 --budget 400 --threshold 0.05
+"""
+
+
+def manhattan_distance(lat1, lon1, lat2, lon2):
+    # Walking distance (meters) along a north-south and an east-west leg, as routeType='manhattan' of veroviz
+    return haversine(lat1, lon1, lat1, lon2) + haversine(lat1, lon2, lat2, lon2)
+
+
+class SweepEvaluator:
+    def __init__(self, destinations, region='BNMC', walk_speed=1.4, beta=140, preference='min_time',
+                 metric='time_score', time_inc=15 * 60, date=None):
+        '''
+        destinations: pd.DataFrame with name, lat, lon (destinations.csv)
+        metric: 'time_score', 'walking_score' or 'reachable' (see sweeps.py)
+        '''
+        from .precompute import bus_legs
+        self.walk_speed = walk_speed
+        self.beta = beta
+        self.preference = preference
+        self.metric = metric
+        self.times = range(60 * 60 * 5, 60 * 60 * 22, int(time_inc))  # 5am to 10pm
+        self.destinations = destinations
+        self.stops = getRegionStops(region)[['stop_id', 'stop_lat', 'stop_lon']]
+        self.legs = bus_legs(stop_ids=self.stops['stop_id'].unique())
+        if date is not None:
+            from .service_calendar import ServiceCalendar
+            self.legs = self.legs[ServiceCalendar.from_gtfs('data/google_transit').service_mask(self.legs['service_id'], date)]
+        self.destination_stops = self.walking_to_stops(destinations)
+
+    def walking_to_stops(self, points):
+        # The 'origin'/'destination' table of get_walking_df(): every point to every stop
+        ids = np.repeat(points['name'].to_numpy(), len(self.stops))
+        lats = np.repeat(points['lat'].to_numpy(dtype=float), len(self.stops))
+        lons = np.repeat(points['lon'].to_numpy(dtype=float), len(self.stops))
+        stop_lats = np.tile(self.stops['stop_lat'].to_numpy(dtype=float), len(points))
+        stop_lons = np.tile(self.stops['stop_lon'].to_numpy(dtype=float), len(points))
+        distance = manhattan_distance(lats, lons, stop_lats, stop_lons)
+        return pd.DataFrame({'stop_id': np.tile(self.stops['stop_id'].to_numpy(), len(points)), 'id': ids,
+                             'time': distance / self.walk_speed, 'distance': distance})
+
+    def walking_to_destinations(self, origins):
+        # The 'origin2destination' table of get_walking_df()
+        o = origins.loc[origins.index.repeat(len(self.destinations))]
+        d = self.destinations.loc[np.tile(self.destinations.index, len(origins))]
+        distance = manhattan_distance(o['lat'].to_numpy(dtype=float), o['lon'].to_numpy(dtype=float),
+                                      d['lat'].to_numpy(dtype=float), d['lon'].to_numpy(dtype=float))
+        return pd.DataFrame({'origin_id': o['name'].to_numpy(), 'destination_id': d['name'].to_numpy(),
+                             'time': distance / self.walk_speed, 'distance': distance})
+
+    def __call__(self, origins):
+        location_to_stops = {'origin': self.walking_to_stops(origins), 'destination': self.destination_stops,
+                             'origin2destination': self.walking_to_destinations(origins)}
+        cube = sweep(location_to_stops, self.legs, self.times, walk_speeds=(self.walk_speed,), betas=(self.beta,),
+                     preferences=(self.preference,))
+        return cube.set_index('origin_id')[self.metric].reindex(origins['name'].to_numpy(), fill_value=0.0)
+
+
+class OriginGrid:
+    def __init__(self, region='BNMC', cell_size=400, min_cell_size=50, boundary='boundaryTight'):
+        '''
+        Quadtree over the bounding box of the neighborhoods of the region.
+        A cell is (level, row, col); a level 0 cell is cell_size meters wide and every level
+        halves the width, down to the smallest width that is at least min_cell_size (level max_level).
+        '''
+        self.neighborhoods = getRegion(region)
+        self.boundary = boundary
+        bounds = np.array([nb.bounds[boundary] for nb in self.neighborhoods.values()])
+        self.grid = HeatmapGrid(bounds[:, 0].min(), bounds[:, 1].min(), bounds[:, 2].max(), bounds[:, 3].max(),
+                                cell_width=cell_size)
+        self.cell_size = float(cell_size)
+        # The tolerance keeps exact powers of two (400 / 50) from being rounded down by float error
+        self.max_level = max(int(np.floor(np.log2(cell_size / min_cell_size) + 1e-9)), 0)
+
+    def size(self, level):
+        return self.cell_size / 2 ** level
+
+    def centers(self, cells):
+        # (lats, lons) of the centers of the (level, row, col) cells
+        cells = np.asarray(cells, dtype=float).reshape(-1, 3)
+        size = self.cell_size / 2 ** cells[:, 0]
+        return self.grid.unproject(self.grid.min_x + (cells[:, 2] + 0.5) * size,
+                                   self.grid.min_y + (cells[:, 1] + 0.5) * size)
+
+    def neighborhood_of(self, cells):
+        # Key of the first neighborhood containing the center of every cell, None outside the boundaries
+        lats, lons = self.centers(cells)
+        names = np.full(len(lats), None, dtype=object)
+        for name, nb in self.neighborhoods.items():
+            inside = pointsInPolygon(lats, lons, getattr(nb, self.boundary), bounds=nb.bounds[self.boundary])
+            names[inside & (names == None)] = name  # noqa: E711 (elementwise)
+        return names
+
+    def seed(self):
+        # The level 0 cells whose center is inside the region
+        rows, cols = np.meshgrid(np.arange(self.grid.nrows), np.arange(self.grid.ncols), indexing='ij')
+        cells = [(0, int(r), int(c)) for r, c in zip(rows.ravel(), cols.ravel())]
+        return [cell for cell, name in zip(cells, self.neighborhood_of(cells)) if name is not None]
+
+    def children(self, cell):
+        level, row, col = cell
+        cells = [(level + 1, 2 * row + i, 2 * col + j) for i in (0, 1) for j in (0, 1)]
+        return [child for child, name in zip(cells, self.neighborhood_of(cells)) if name is not None]
+
+    def uniform_size(self):
+        # Number of origins of a uniform grid of the finest cells
+        rows, cols = self.grid.nrows * 2 ** self.max_level, self.grid.ncols * 2 ** self.max_level
+        inside = 0
+        for row in range(0, rows, 256):
+            r, c = np.meshgrid(np.arange(row, min(row + 256, rows)), np.arange(cols), indexing='ij')
+            cells = np.column_stack([np.full(r.size, self.max_level), r.ravel(), c.ravel()])
+            inside += int(np.sum(self.neighborhood_of(cells) != None))  # noqa: E711 (elementwise)
+        return inside
+
+    def variation(self, cells, scores, block=512):
+        '''
+        Largest absolute score difference between every cell and the cells sharing an edge
+        with it (of any level); 0 for a cell without neighbors.
+        '''
+        cells = np.asarray(cells, dtype=np.int64).reshape(-1, 3)
+        scores = np.asarray(scores, dtype=float)
+        # Extent of every cell in units of the finest cells
+        span = 2 ** (self.max_level - cells[:, 0])
+        x0, y0 = cells[:, 2] * span, cells[:, 1] * span
+        x1, y1 = x0 + span, y0 + span
+
+        variation = np.zeros(len(cells))
+        for i in range(0, len(cells), block):
+            s = slice(i, i + block)
+            overlap_x = np.minimum(x1[s, None], x1) - np.maximum(x0[s, None], x0) > 0
+            overlap_y = np.minimum(y1[s, None], y1) - np.maximum(y0[s, None], y0) > 0
+            touch_x = (x1[s, None] == x0) | (x0[s, None] == x1)
+            touch_y = (y1[s, None] == y0) | (y0[s, None] == y1)
+            adjacent = (touch_x & overlap_y) | (touch_y & overlap_x)
+            diff = np.where(adjacent, np.abs(scores[s, None] - scores), 0.0)
+            variation[s] = diff.max(axis=1)
+        return variation
+
+    def refine(self, evaluate, budget=500, threshold=0.05, max_splits=None):
+        '''
+        Score the seed cells, then split the varying cells until the budget is spent.
+
+        Parameters
+        ----------
+        evaluate: callable
+            evaluate(origins) -> pd.Series of scores indexed by origins['name']
+        budget: int
+            maximum number of origins scored (parents included)
+        threshold: float
+            a cell is split if its score differs from a neighbor's by more than this
+        max_splits: int
+            maximum number of cells split per round | None for all the candidates that fit
+
+        Returns
+        -------
+        leaves: pd.DataFrame
+            one row per leaf with the columns of origin_grid.csv
+        rounds: list
+            number of origins scored in every round
+        '''
+        leaves = {}
+        unsplittable = set()
+        rounds = []
+        new = self.seed()[:budget]
+        evaluated = 0
+        while new:
+            origins = self.origins(new, first_name=evaluated + 1)
+            scores = evaluate(origins)
+            for cell, score in zip(new, scores.to_numpy(dtype=float)):
+                leaves[cell] = score
+            evaluated += len(new)
+            rounds.append(len(new))
+            print(f"Round {len(rounds)}: scored {len(new)} origins ({evaluated} of {budget}), {len(leaves)} leaves")
+
+            cells = list(leaves)
+            variation = self.variation(cells, [leaves[cell] for cell in cells])
+            # Largest difference first, then the largest cells
+            order = sorted(range(len(cells)), key=lambda k: (-variation[k], cells[k][0]))
+            new = []
+            splits = 0
+            for k in order:
+                cell = cells[k]
+                if variation[k] <= threshold or (max_splits is not None and splits >= max_splits):
+                    break
+                if cell[0] >= self.max_level or cell in unsplittable:
+                    continue
+                children = self.children(cell)
+                if not children:
+                    unsplittable.add(cell)
+                    continue
+                if evaluated + len(new) + len(children) > budget:
+                    continue
+                del leaves[cell]
+                new.extend(children)
+                splits += 1
+
+        cells = list(leaves)
+        leaves = self.origins(cells).assign(score=[leaves[cell] for cell in cells])
+        leaves['variation'] = self.variation(cells, leaves['score'])
+        return leaves, rounds
+
+    def origins(self, cells, first_name=1):
+        '''
+        Origins at the centers of the cells, with the columns of origins.csv, level and cell_size
+        '''
+        cells = list(cells)
+        lats, lons = self.centers(cells)
+        keys = self.neighborhood_of(cells)
+        return pd.DataFrame({
+            'name': np.arange(first_name, first_name + len(cells)),
+            'block_id': [f"{key.lower()}_{level}_{row}_{col}" for key, (level, row, col) in zip(keys, cells)],
+            'lat': lats,
+            'lon': lons,
+            'neighborhood': [self.neighborhoods[key].labelName.replace('<br>', ' ') for key in keys],
+            'point_type': 'adaptive',
+            'level': [cell[0] for cell in cells],
+            'cell_size': [self.size(cell[0]) for cell in cells],
+        })
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generate the origins of an experiment with an adaptive quadtree.')
+    parser.add_argument('--experiment_id', required=True, help='Experiment whose origins.csv is written.')
+    parser.add_argument('--destinations', default=None,
+                        help='destinations.csv to copy into the experiment. Default is the one already there.')
+    parser.add_argument('--region', default='BNMC', help='Region whose neighborhoods are covered. Default is BNMC.')
+    parser.add_argument('--boundary', default='boundaryTight', choices=['boundaryTight', 'boundaryLoose'])
+    parser.add_argument('--cell_size', type=float, default=400, help='Width of the coarse cells (m). Default is 400.')
+    parser.add_argument('--min_cell_size', type=float, default=50,
+                        help='Smallest width of the cells (m), rounded up to cell_size / 2**k. Default is 50.')
+    parser.add_argument('--budget', type=int, default=500, help='Maximum number of origins scored. Default is 500.')
+    parser.add_argument('--threshold', type=float, default=0.05,
+                        help='Split the cells whose score differs from a neighbor by more than this. Default is 0.05.')
+    parser.add_argument('--max_splits', type=int, default=None, help='Maximum number of cells split per round.')
+    parser.add_argument('--metric', default='time_score', choices=['time_score', 'walking_score', 'reachable'])
+    parser.add_argument('--preference', default='min_time', choices=['min_time', 'min_walk'])
+    parser.add_argument('--walk_speed', type=float, default=1.4, help='Walking speed (m/s). Default is 1.4.')
+    parser.add_argument('--beta', type=float, default=140, help='Impedance parameter. Default is 140.')
+    parser.add_argument('--time_inc', type=float, default=15 * 60, help='The time increment. Default is 900s (15 min).')
+    parser.add_argument('--date', default=None, help='Only use the trips running on this date, e.g. 2024-01-15.')
+    parser.add_argument('--overwrite', action='store_true', help='Replace an existing origins.csv.')
+    args = parser.parse_args()
+
+    directory = os.path.join(EXPERIMENTS_DIR, args.experiment_id)
+    origins_file = os.path.join(directory, 'origins.csv')
+    if os.path.exists(origins_file) and not args.overwrite:
+        raise FileExistsError(f"{origins_file} already exists, use --overwrite to replace it")
+    os.makedirs(directory, exist_ok=True)
+    if args.destinations is not None:
+        shutil.copyfile(args.destinations, os.path.join(directory, 'destinations.csv'))
+    destinations = pd.read_csv(os.path.join(directory, 'destinations.csv'))
+
+    evaluate = SweepEvaluator(destinations, region=args.region, walk_speed=args.walk_speed, beta=args.beta,
+                              preference=args.preference, metric=args.metric, time_inc=args.time_inc, date=args.date)
+    origin_grid = OriginGrid(args.region, cell_size=args.cell_size, min_cell_size=args.min_cell_size,
+                             boundary=args.boundary)
+    leaves, rounds = origin_grid.refine(evaluate, budget=args.budget, threshold=args.threshold,
+                                        max_splits=args.max_splits)
+
+    # Number the origins 1..n, neighborhood by neighborhood
+    leaves = leaves.sort_values(by=['neighborhood', 'lat', 'lon'], ascending=[True, False, True], kind='mergesort')
+    leaves['name'] = np.arange(1, len(leaves) + 1)
+    leaves[['name', 'block_id', 'lat', 'lon', 'neighborhood', 'point_type']].to_csv(origins_file, index=False)
+    leaves.to_csv(os.path.join(directory, 'origin_grid.csv'), index=False)
+    with open(os.path.join(directory, 'origin_grid.json'), 'w') as json_file:
+        json.dump({**vars(args), 'rounds': rounds}, json_file, indent=4)
+
+    uniform = origin_grid.uniform_size()
+    finest = origin_grid.size(origin_grid.max_level)
+    print(f"Saved {len(leaves)} origins to {origins_file} ({sum(rounds)} scored, "
+          f"{sum(rounds) / uniform:.1%} of the {uniform} origins of a uniform {finest:g} m grid)")
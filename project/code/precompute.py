@@ -1,60 +1,293 @@
 import pickle
 import json
+import hashlib
 import argparse
 import os
 import pandas as pd
 import numpy as np
-import veroviz as vrv
+from .pruning import prune_legs
+from .service_calendar import ServiceCalendar, to_date
+from .timeutils import hms_to_seconds
+from .schema import compact
 
 """
-TODO: team 0 must complete this function
-
-Purpose: 
+Purpose:
     Find all possible bus routes at all times of day.
     Initially these will be 1-bus routes, however, it
     can be extended to 2-bus routes or other types of routes.
-Input: None
-Output: 
+
+    Every (pick_up, drop_off, trip) leg is generated directly from the GTFS
+    stop_times.txt with a per-trip self-join on stop_sequence: the rows are sorted
+    by (trip_id, stop_sequence) and every pair of row indices (i, j), i < j, of the
+    same trip is generated with NumPy index arithmetic instead of Python loops.
+    If stop_times.txt is not available, the legs are read from data/routes_data.csv.
+Input:
+    stop_ids: the bus stops of interest (e.g. the stops of the region). All stops if None.
+    The pickle name (data/bus_routes[_pruned][_date][_stops].pkl) ends with a hash of the
+    set of stop_ids, so the routes of another region are never loaded.
+    prune: if True, the dominated trips of every stop pair are removed (see pruning.py).
+    date: if given, only the trips running on that date (calendar.txt and
+          calendar_dates.txt, see service_calendar.py) are kept.
+    Every leg carries an 'access' bitmask built from wheelchair_boarding (stops.txt)
+    and wheelchair_accessible (trips.txt), so the wheelchair accessible legs are a
+    mask (see wheelchair_mask) instead of a new merge.
+Output:
     Dictionary:
         keys are tuples (bus_stop_pick_up_id, bus_stop_drop_off_id)
         values are lists of RouteInfo class objects
 """
 
 
-def pre_compute_bus_routes():
+# Bits of the 'access' column: the GTFS value of the pick up stop, the drop off stop and the trip
+# is 1 (accessible) or 0/empty (no information); 2 (not accessible) sets neither bit.
+PICK_UP_ACCESSIBLE = 1
+DROP_OFF_ACCESSIBLE = 2
+TRIP_ACCESSIBLE = 4
+PICK_UP_UNKNOWN = 8
+DROP_OFF_UNKNOWN = 16
+TRIP_UNKNOWN = 32
+ACCESSIBLE = PICK_UP_ACCESSIBLE | DROP_OFF_ACCESSIBLE | TRIP_ACCESSIBLE  # e.g. walking only routes
+UNKNOWN = PICK_UP_UNKNOWN | DROP_OFF_UNKNOWN | TRIP_UNKNOWN
+
+
+def stop_set_key(stop_ids):
+    # Short hash of the set of stops, so the pickles of different regions do not collide
+    if stop_ids is None:
+        return ''
+    stops = np.unique(np.asarray(stop_ids, dtype=np.int64))
+    return '_' + hashlib.blake2b(stops.tobytes(), digest_size=4).hexdigest()
+
+
+def pre_compute_bus_routes(stop_ids=None, gtfs_dir='data/google_transit', bus_route_filename=None,
+                           overwrite=False, prune=False, date=None, calendar=None):
+    if bus_route_filename is None:
+        bus_route_filename = 'bus_routes' + ('_pruned' if prune else '') \
+                             + (f'_{to_date(date):%Y%m%d}' if date is not None else '') \
+                             + stop_set_key(stop_ids) + '.pkl'
+
     # Team 0: DO NOT DELETE THIS
     # Check if we have already precomputed the bus routes
-    bus_route_filename = 'bus_routes.pkl'  # this can be modified if desired
     if not os.path.exists('data/'):
         os.makedirs('data/')  # Create the directory
-    if os.path.exists(f'data/{bus_route_filename}'):
+    if os.path.exists(f'data/{bus_route_filename}') and not overwrite:
         with open(f'data/{bus_route_filename}', 'rb') as f:
             routes = pickle.load(f)
             return routes
 
-    # TODO: team 0 must implement this function
-    # Example (DELETE THIS)
-    routes = {
-        #  Structure: (pick_up_id, drop_off_id) : [RouteInfo(), RouteInfo, ...]
-        (0, 0): [],  # empty because getting picked up and dropped off at the same stop does not make sense
-        (0, 1): [RouteInfo(7 * 60 * 60, 7 * 60 * 60 + 10 * 60),  # pick_up_time = 7am, drop_off_time = 7:10am
-                 RouteInfo(8 * 60 * 60 + 30 * 60, 9 * 60 * 60)]  # pick_up_time = 8:30am, drop_off_time = 9am
-    }
+    legs = bus_legs(stop_ids=stop_ids, gtfs_dir=gtfs_dir)
+
+    # Mask the legs with the trips running on the date
+    if date is not None:
+        if calendar is None:
+            calendar = ServiceCalendar.from_gtfs(gtfs_dir)
+        legs = legs[calendar.service_mask(legs['service_id'], date)]
+
+    # Only keep the trips with the latest pick up and earliest drop off of every stop pair.
+    # Without a date, trips of different services are not compared (they run on different days).
+    if prune:
+        legs = prune_legs(legs, by_service=date is None)
+
+    routes = legs_to_bus_routes(legs)
 
     # Team 0: DO NOT DELETE THIS
     # Save the routes to a pickle file (pickle is likely the most efficient storage format)
-    with open(bus_route_filename, 'wb') as f:
+    with open(f'data/{bus_route_filename}', 'wb') as f:
         pickle.dump(routes, f)
     return routes
 
 
+# Legs already computed in this process, keyed by (gtfs_dir, stop_ids)
+_LEGS_CACHE = {}
+
+
+def bus_legs(stop_ids=None, gtfs_dir='data/google_transit'):
+    """
+    Return the legs table (see compute_bus_legs) with the service_id of every trip.
+    The table is computed once per process and reused for every date.
+    """
+    key = (os.path.abspath(gtfs_dir), None if stop_ids is None else frozenset(np.asarray(stop_ids).tolist()))
+    if key not in _LEGS_CACHE:
+        trips = pd.read_csv(os.path.join(gtfs_dir, 'trips.txt'),
+                            usecols=lambda col: col in ['trip_id', 'service_id', 'wheelchair_accessible'])
+        stop_times_file = os.path.join(gtfs_dir, 'stop_times.txt')
+        if os.path.exists(stop_times_file):
+            stop_times = pd.read_csv(stop_times_file)
+            legs = compute_bus_legs(stop_times, stop_ids=stop_ids, trips=trips)
+        else:
+            print(f"{stop_times_file} not found, using data/routes_data.csv instead")
+            legs = read_routes_data('data/routes_data.csv', stop_ids=stop_ids, trips=trips)
+        stops = pd.read_csv(os.path.join(gtfs_dir, 'stops.txt'),
+                            usecols=lambda col: col in ['stop_id', 'wheelchair_boarding'])
+        _LEGS_CACHE[key] = compact(add_wheelchair_access(legs, stops, trips), 'legs', report=True)
+    return _LEGS_CACHE[key]
+
+
+def add_service_ids(legs, trips):
+    """
+    Add the service_id of the trip of every leg (a lookup, not a merge)
+    """
+    service_of_trip = pd.Series(trips['service_id'].to_numpy(), index=trips['trip_id'].to_numpy())
+    legs['service_id'] = legs['trip_id'].map(service_of_trip)
+    return legs
+
+
+def access_bits(values, accessible_bit, unknown_bit):
+    # GTFS wheelchair value (1 accessible, 0/empty no information, 2 not accessible) -> bits
+    values = pd.Series(values).fillna(0).to_numpy()
+    return np.where(values == 1, accessible_bit, np.where(values == 0, unknown_bit, 0)).astype(np.uint8)
+
+
+def add_wheelchair_access(legs, stops, trips):
+    """
+    Add the 'access' bitmask of every leg from wheelchair_boarding of its pick up and drop off
+    stops and wheelchair_accessible of its trip (lookups, not merges)
+    """
+    boarding = pd.Series(stops['wheelchair_boarding'].to_numpy() if 'wheelchair_boarding' in stops.columns
+                         else np.zeros(len(stops)), index=stops['stop_id'].to_numpy())
+    accessible = pd.Series(trips['wheelchair_accessible'].to_numpy() if 'wheelchair_accessible' in trips.columns
+                           else np.zeros(len(trips)), index=trips['trip_id'].to_numpy())
+    legs['access'] = access_bits(legs['pick_up_id'].map(boarding), PICK_UP_ACCESSIBLE, PICK_UP_UNKNOWN) \
+        | access_bits(legs['drop_off_id'].map(boarding), DROP_OFF_ACCESSIBLE, DROP_OFF_UNKNOWN) \
+        | access_bits(legs['trip_id'].map(accessible), TRIP_ACCESSIBLE, TRIP_UNKNOWN)
+    return legs
+
+
+def wheelchair_mask(access, unknown_accessible=False):
+    """
+    Boolean mask over an 'access' column: True if the pick up stop, the drop off stop and the trip
+    are all wheelchair accessible. With unknown_accessible, missing information counts as accessible.
+    """
+    access = np.asarray(access).astype(np.uint8)
+    ok = access & ACCESSIBLE
+    if unknown_accessible:
+        ok |= (access >> 3) & ACCESSIBLE
+    return ok == ACCESSIBLE
+
+
+def trip_pair_indices(trip_codes):
+    """
+    Given the (sorted) trip of every row, return the arrays (left, right) of all
+    row index pairs left < right that belong to the same trip.
+    """
+    n = len(trip_codes)
+    if n == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    # Index one past the last row of the trip of every row
+    starts = np.flatnonzero(np.r_[True, trip_codes[1:] != trip_codes[:-1]])
+    ends = np.r_[starts[1:], n]
+    group_end = np.repeat(ends, ends - starts)
+
+    # Every row is paired with all the later rows of its trip
+    later = group_end - np.arange(n) - 1
+    left = np.repeat(np.arange(n), later)
+    first_pair = np.cumsum(later) - later
+    right = left + 1 + (np.arange(len(left)) - np.repeat(first_pair, later))
+    return left, right
+
+
+def compute_bus_legs(stop_times, stop_ids=None, trips=None):
+    """
+    Generate every single-bus leg (trip_id, pick_up_id, pick_up_time, drop_off_id, drop_off_time).
+
+    stop_times: pd.DataFrame read from the GTFS stop_times.txt
+    stop_ids: only legs between these stops are kept (all stops if None)
+    trips: pd.DataFrame read from trips.txt | if given, the service_id of every leg is added
+    Times are returned as integer seconds after midnight.
+    """
+    st = stop_times
+    if stop_ids is not None:
+        st = st[st['stop_id'].isin(stop_ids)]
+    st = st.sort_values(by=['trip_id', 'stop_sequence'], kind='mergesort')
+
+    trip_ids = st['trip_id'].to_numpy()
+    stops = st['stop_id'].to_numpy()
+    arrival = hms_to_seconds(st['arrival_time'])
+    departure = hms_to_seconds(st['departure_time']) if 'departure_time' in st.columns else arrival
+    departure = np.where(departure < 0, arrival, departure)
+
+    trip_codes, _ = pd.factorize(trip_ids)
+    left, right = trip_pair_indices(trip_codes)
+
+    # A pick up (drop off) is not possible where pickup_type (drop_off_type) is 1
+    keep = (departure[left] >= 0) & (arrival[right] >= 0) & (stops[left] != stops[right])
+    if 'pickup_type' in st.columns:
+        keep &= st['pickup_type'].fillna(0).to_numpy()[left] != 1
+    if 'drop_off_type' in st.columns:
+        keep &= st['drop_off_type'].fillna(0).to_numpy()[right] != 1
+    left, right = left[keep], right[keep]
+
+    legs = pd.DataFrame({
+        'trip_id': trip_ids[left],
+        'pick_up_id': stops[left],
+        'pick_up_time': departure[left],
+        'drop_off_id': stops[right],
+        'drop_off_time': arrival[right],
+        'walking_distance': 0.0,
+    })
+    return legs if trips is None else add_service_ids(legs, trips)
+
+
+def read_routes_data(file_path, stop_ids=None, trips=None):
+    """
+    Read the legs from the legacy routes_data.csv ("0 days HH:MM:SS" times) into the
+    same format as compute_bus_legs()
+    """
+    routes_df = pd.read_csv(file_path)
+    routes_df = routes_df.rename(columns={'Pick_up_id': 'pick_up_id'})
+    if stop_ids is not None:
+        routes_df = routes_df[routes_df['pick_up_id'].isin(stop_ids) & routes_df['drop_off_id'].isin(stop_ids)]
+    legs = pd.DataFrame({
+        'trip_id': routes_df['trip_id'].to_numpy(),
+        'pick_up_id': routes_df['pick_up_id'].to_numpy(),
+        'pick_up_time': hms_to_seconds(routes_df['pick_up_time']),
+        'drop_off_id': routes_df['drop_off_id'].to_numpy(),
+        'drop_off_time': hms_to_seconds(routes_df['drop_off_time']),
+        'walking_distance': routes_df['walking_distance'].to_numpy(dtype=float),
+    })
+    return legs if trips is None else add_service_ids(legs, trips)
+
+
+def legs_to_bus_routes(legs):
+    """
+    Group the legs by (pick_up_id, drop_off_id) into lists of RouteInfo objects
+    """
+    legs = legs.sort_values(by=['pick_up_id', 'drop_off_id', 'pick_up_time'], kind='mergesort')
+    access = legs['access'].tolist() if 'access' in legs.columns else [UNKNOWN] * len(legs)
+    routes = {}
+    for trip_id, pick_up_id, pick_up_time, drop_off_id, drop_off_time, walking_distance, bits in zip(
+            legs['trip_id'].tolist(), legs['pick_up_id'].tolist(), legs['pick_up_time'].tolist(),
+            legs['drop_off_id'].tolist(), legs['drop_off_time'].tolist(), legs['walking_distance'].tolist(), access):
+        routes.setdefault((pick_up_id, drop_off_id), []).append(
+            RouteInfo(pick_up_time, drop_off_time, walking_distance, trip_id=trip_id, access=bits))
+    return routes
+
+
 """
 This class stores information about a bus ride.
 It is used in the lists in the values of the dictionary bus_routes.
 """
 class RouteInfo:
-    def __init__(self, pick_up_time, drop_off_time, walking_distance=0):
+    def __init__(self, pick_up_time, drop_off_time, walking_distance=0, trip_id=None, access=UNKNOWN):
+        self.trip_id = trip_id  # GTFS trip_id of the bus (int)
+        self.access = access  # wheelchair accessibility bitmask of the stops and trip, see wheelchair_mask() (int)
         self.pick_up_time = pick_up_time  # time of day (seconds) bus picks up rider at this stop (int)
         self.drop_off_time = drop_off_time  # time of day (seconds) bus drops off rider at this stop (int)
         self.walking_distance = walking_distance  # in a 2-bus route, the walking distance (meters) between intermediate stops (float)
-        self.total_time = drop_off_time - pick_up_time  # number of seconds from pick up to drop off (int)
\ No newline at end of file
+        self.total_time = drop_off_time - pick_up_time  # number of seconds from pick up to drop off (int)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Precompute the single-bus legs between the stops of a region.')
+    parser.add_argument('--region', default='BNMC', help='Region whose stops are kept. Default is BNMC.')
+    parser.add_argument('--all_stops', action='store_true', help='Keep the legs between all stops.')
+    parser.add_argument('--prune', action='store_true', help='Remove the dominated trips of every stop pair.')
+    parser.add_argument('--date', default=None, help='Only keep the trips running on this date, e.g. 2024-01-15.')
+    args = parser.parse_args()
+
+    # Import the module by its package name so the pickled RouteInfo objects do not refer to __main__
+    from code import precompute
+    from code.accessibility.regions import getRegionStops
+    stop_ids = None if args.all_stops else getRegionStops(args.region)['stop_id'].unique()
+    bus_routes = precompute.pre_compute_bus_routes(stop_ids=stop_ids, overwrite=True, prune=args.prune,
+                                                    date=args.date)
+    print(f"Saved {sum(len(v) for v in bus_routes.values())} legs between {len(bus_routes)} stop pairs")
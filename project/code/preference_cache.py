@@ -0,0 +1,197 @@
+import hashlib
+import sqlite3
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+
+"""
+Purpose:
+    Memoized route_preferences() (use_preferences.py).
+
+    route_preferences() scans the whole routes table for every (OD pair, slot) and returns
+    the feasible route with the least total_time (or total_walk_time). The answer only
+    depends on the set of feasible routes, and adjacent 15 minute slots of an OD pair often
+    have the same set. The cache therefore keys the answer on
+
+        (data fingerprint, origin_id, destination_id, candidate window, preference, beta)
+
+    where the candidate window is a hash of the rows that fit in the slot (found with two
+    binary searches over the bus routes of the OD pair sorted by start_time), so every slot
+    with the same feasible routes reuses the answer of the first one. beta only changes the
+    scores, not which route is the best, so it is normalized away for 'min_time' and
+    'min_walk'. The data fingerprint is a hash of the routes table, so a persistent cache
+    is never used with other routes.
+
+    The cached value is the position of the best route in the routes table. The returned
+    row is rebuilt for the slot (time, scores, and the start and end of a walking route),
+    so it is the row route_preferences() returns, ties included (the first row of the table).
+    An OD pair and slot without any feasible route gives an empty dataframe.
+
+    Tiers: an in-memory LRU of at most maxsize answers, and optionally a SQLite file
+    (path) that is shared between runs and processes.
+
+Usage:
+    cache = PreferenceCache(routes, path='experiments/BNMC/preferences.db')
+    best = cache.best_route(origin_id=1, destination_id=2, time=28800, preference='min_time', beta=140)
+    cache.report()
+"""
+
+# Columns of the routes table that route_preferences() overwrites
+DERIVED_COLUMNS = ['total_time_score', 'walking_score', 'time']
+# Objective of every preference (the smallest value wins)
+OBJECTIVE = {'min_time': 'total_time', 'min_walk': 'total_walk_time'}
+
+
+def data_fingerprint(routes):
+    """
+    Hash of the routes table, without the columns that route_preferences() overwrites
+    (the scores, 'time', and the start and end times of the walking routes).
+    """
+    table = routes.drop(columns=[c for c in DERIVED_COLUMNS if c in routes.columns])
+    walking = (table['bus_used'] == 0).to_numpy()
+    if walking.any():
+        table = table.copy()
+        table.loc[walking, ['start_time', 'end_time']] = np.nan
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(','.join(map(str, table.columns)).encode())
+    digest.update(pd.util.hash_pandas_object(table, index=False).to_numpy().tobytes())
+    return digest.hexdigest()
+
+
+class PreferenceCache:
+    def __init__(self, routes, window=3600, maxsize=100000, path=None):
+        '''
+        routes: pd.DataFrame, output of find_routes() or routes.csv (it is not modified)
+        window: length of a slot (seconds), as in route_preferences()
+        maxsize: number of answers kept in memory
+        path: SQLite file of the persistent tier (None for memory only)
+        '''
+        self.routes = routes
+        self.window = window
+        self.maxsize = maxsize
+        self.fingerprint = data_fingerprint(routes)
+        self.memory = OrderedDict()
+        self.od_rows = routes.groupby(['origin_id', 'destination_id'], sort=False).indices
+        self.od_index = {}
+        self.is_bus = (routes['bus_used'] != 0).to_numpy()
+        self.start = routes['start_time'].to_numpy(dtype=float)
+        self.end = routes['end_time'].to_numpy(dtype=float)
+        self.total_time = routes['total_time'].to_numpy(dtype=float)
+        self.objectives = {preference: routes[col].to_numpy(dtype=float) for preference, col in OBJECTIVE.items()}
+        self.stats = {'lookups': 0, 'memory_hits': 0, 'adjacent_slot_hits': 0, 'persistent_hits': 0, 'misses': 0}
+
+        self.db = None
+        self.pending = []
+        if path is not None:
+            self.db = sqlite3.connect(path, timeout=60)
+            self.db.execute('CREATE TABLE IF NOT EXISTS preferences (key TEXT PRIMARY KEY, position INTEGER)')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def od(self, origin_id, destination_id):
+        # Bus rows of the OD pair sorted by start_time, and its walking rows
+        key = (origin_id, destination_id)
+        if key not in self.od_index:
+            rows = self.od_rows.get(key, np.zeros(0, dtype=np.int64))
+            bus = rows[self.is_bus[rows]]
+            bus = bus[np.argsort(self.start[bus], kind='mergesort')]
+            self.od_index[key] = (bus, self.start[bus], self.end[bus], rows[~self.is_bus[rows]])
+        return self.od_index[key]
+
+    def candidates(self, origin_id, destination_id, time):
+        # Positions (in table order) of the routes that fit in the slot, as in route_preferences()
+        bus, start, end, walks = self.od(origin_id, destination_id)
+        lo = np.searchsorted(start, float(time), side='left')
+        hi = np.searchsorted(start, float(time + self.window), side='right')
+        fits = bus[lo:hi][end[lo:hi] <= float(time + self.window)]
+        walks = walks[time + self.total_time[walks] <= float(time + self.window)]
+        return np.sort(np.concatenate([fits, walks]))
+
+    def key(self, origin_id, destination_id, candidates, preference, beta):
+        window = hashlib.blake2b(candidates.astype(np.int64).tobytes(), digest_size=16).hexdigest()
+        beta = None if preference in OBJECTIVE else float(beta)
+        return f"{self.fingerprint}|{origin_id}|{destination_id}|{window}|{preference}|{beta}"
+
+    def lookup(self, key, time):
+        # Position of the best route, or None if the key is in no tier
+        self.stats['lookups'] += 1
+        if key in self.memory:
+            self.memory.move_to_end(key)
+            position, slot = self.memory[key]
+            self.stats['memory_hits'] += 1
+            self.stats['adjacent_slot_hits'] += slot != time
+            return position
+        if self.db is not None:
+            row = self.db.execute('SELECT position FROM preferences WHERE key = ?', (key,)).fetchone()
+            if row is not None:
+                self.stats['persistent_hits'] += 1
+                self.remember(key, row[0], time)
+                return row[0]
+        self.stats['misses'] += 1
+        return None
+
+    def remember(self, key, position, time):
+        self.memory[key] = (position, time)
+        if len(self.memory) > self.maxsize:
+            self.memory.popitem(last=False)
+
+    def store(self, key, position, time):
+        self.remember(key, position, time)
+        if self.db is not None:
+            self.pending.append((key, position))
+            if len(self.pending) >= 1000:
+                self.flush()
+
+    def flush(self):
+        if self.db is not None and self.pending:
+            with self.db:
+                self.db.executemany('INSERT OR REPLACE INTO preferences (key, position) VALUES (?, ?)', self.pending)
+            self.pending = []
+
+    def close(self):
+        self.flush()
+        if self.db is not None:
+            self.db.close()
+            self.db = None
+
+    def best_route(self, origin_id, destination_id, time, preference='min_time', beta=140):
+        """
+        Same answer as route_preferences(routes, time, origin_id, destination_id, preference, beta):
+        a dataframe with the best route of the slot, or an empty dataframe if no route fits.
+        """
+        if preference not in OBJECTIVE:
+            raise ValueError("Invalid preference... please provide 'min_time' or 'min_walk'")
+        candidates = self.candidates(origin_id, destination_id, time)
+        key = self.key(origin_id, destination_id, candidates, preference, beta)
+        position = self.lookup(key, time)
+        if position is None:
+            # The first row with the smallest objective, as idxmin
+            position = int(candidates[np.nanargmin(self.objectives[preference][candidates])]) if len(candidates) else -1
+            self.store(key, position, time)
+        return self.materialize(position, time, beta)
+
+    def materialize(self, position, time, beta):
+        # The row of the routes table as route_preferences() returns it for the slot
+        best = self.routes.iloc[[position] if position >= 0 else []].copy()
+        if len(best) and not self.is_bus[position]:
+            best['start_time'] = time
+            best['end_time'] = time + best['total_time']
+        best['total_time_score'] = np.exp(-((best['total_time'] / 60) ** 2) / beta)
+        best['walking_score'] = np.exp(-((best['total_walk_time'] / 60) ** 2) / beta)
+        best['time'] = time
+        return best
+
+    def report(self):
+        """
+        Print and return the hit rates of the cache.
+        """
+        lookups = self.stats['lookups']
+        rate = {k: (v / lookups if lookups else 0.0) for k, v in self.stats.items() if k != 'lookups'}
+        print(f"route_preferences cache: {lookups} lookups, {rate['memory_hits']:.1%} memory hits "
+              f"({rate['adjacent_slot_hits']:.1%} reused from another slot), "
+              f"{rate['persistent_hits']:.1%} persistent hits, {rate['misses']:.1%} computed")
+        return {**self.stats, **{f"{k}_rate": v for k, v in rate.items()}}
@@ -0,0 +1,126 @@
+import numpy as np
+import pandas as pd
+
+"""
+Purpose:
+    Remove the trips/routes that can never be a best route.
+
+    A route is dominated if another route of the same group (stop pair or OD pair)
+    starts at least as late, ends at least as early and walks at most as much.
+    Routes with a different wheelchair 'access' bitmask are never compared, so the
+    wheelchair accessible routes survive pruning.
+    Whenever the dominated route fits in a route_preferences() window, so does the
+    dominating one, and it is at least as good for both 'min_time' and 'min_walk'.
+    Removing dominated routes therefore never changes the best time or best walk.
+
+    The dominance test is a sorted sweep: rows are sorted by (group, start desc,
+    end asc, walk asc), so every dominating row comes before the rows it dominates,
+    and a row is dominated if the running minimum of 'end' over the earlier rows
+    with no more walking is <= its own 'end'. That minimum is a Fenwick tree query
+    over the walk rank: the ranks up to a row's own are the union of at most
+    log2(L) dyadic blocks (L = distinct walks of the group), one per bit level, and
+    every level is answered for all rows at once with a running minimum per block.
+"""
+
+
+def pareto_mask(start, end, walk=None, group=None):
+    """
+    Return a boolean array that is True for the non-dominated rows.
+
+    start, end: arrays of start (departure) and end (arrival) times
+    walk: optional array of walking times (the smaller the better)
+    group: optional array of group codes; rows are only compared within a group
+    Rows with a missing start or end (e.g. walking-only routes) are always kept.
+    Of several identical rows, only the first is kept.
+    """
+    start = np.asarray(start, dtype=float)
+    end = np.asarray(end, dtype=float)
+    n = len(start)
+    walk = np.zeros(n) if walk is None else np.asarray(walk, dtype=float)
+    group = np.zeros(n, dtype=np.int64) if group is None else pd.factorize(np.asarray(group))[0]
+
+    keep = np.ones(n, dtype=bool)
+    valid = np.flatnonzero(~(np.isnan(start) | np.isnan(end) | np.isnan(walk)))
+    if len(valid) == 0:
+        return keep
+
+    # Sort so that every dominating row comes before the rows it dominates
+    order = valid[np.lexsort((walk[valid], end[valid], -start[valid], group[valid]))]
+    s, e, w, g = start[order], end[order], walk[order], group[order]
+
+    first_in_group = np.r_[True, g[1:] != g[:-1]]
+    same_as_previous = ~first_in_group & np.r_[False, (s[1:] == s[:-1]) & (e[1:] == e[:-1]) & (w[1:] == w[:-1])]
+    dominated = same_as_previous
+
+    # Walk rank within each group (0 = least walking) and rank of the end, as exact integers
+    m = len(order)
+    rank = pd.Series(w).groupby(g).rank(method='dense').to_numpy(dtype=np.int64) - 1
+    end_rank = np.unique(e, return_inverse=True)[1].astype(np.int64)
+    # First row of the group of every row: group_start + (rank >> b) numbers the blocks of all groups
+    group_start = np.maximum.accumulate(np.where(first_in_group, np.arange(m), 0))
+    position = np.arange(m, dtype=np.int64)
+    for b in range(int(rank.max() + 1).bit_length()):
+        # Level b: the rows with bit b of rank + 1 set query the block of 2**b ranks
+        # [((rank + 1) >> b) - 1] * 2**b, the other levels cover the rest of [0, rank]
+        block = group_start + (rank >> b)
+        members = np.argsort(block, kind='stable')
+        member_block = block[members]
+        # Running minimum of the end rank within every block, in row order (each block is
+        # shifted below the previous ones so one cumulative minimum does not cross blocks)
+        running_min = np.minimum.accumulate(end_rank[members] - member_block * m) + member_block * m
+        queries = np.flatnonzero(((rank + 1) >> b) & 1)
+        query_block = group_start[queries] + ((rank[queries] + 1) >> b) - 1
+        # Last member of the queried block before the querying row
+        last = np.searchsorted(member_block * m + members, query_block * m + position[queries]) - 1
+        found = (last >= 0) & (member_block[np.maximum(last, 0)] == query_block)
+        dominated[queries[found]] |= running_min[last[found]] <= end_rank[queries[found]]
+
+    keep[order] = ~dominated
+    return keep
+
+
+def prune_routes(routes, group_cols=('origin_id', 'destination_id'), start_col='start_time', end_col='end_time',
+                 walk_col='total_walk_time', report=True):
+    """
+    Keep only the Pareto-efficient routes of every group.
+
+    routes: pd.DataFrame, e.g. the output of find_routes() or routes.csv
+    Returns the pruned dataframe and prints the reduction ratio if report is True.
+    """
+    group_cols = list(group_cols) + (['access'] if 'access' in routes.columns else [])
+    group = routes.groupby(group_cols, sort=False, dropna=False).ngroup().to_numpy()
+    walk = routes[walk_col] if walk_col is not None else None
+    keep = pareto_mask(routes[start_col], routes[end_col], walk, group)
+    pruned = routes[keep]
+    if report:
+        report_reduction(len(routes), len(pruned), 'routes')
+    return pruned
+
+
+def prune_legs(legs, by_service=True, report=True):
+    """
+    Keep only the Pareto-efficient trips (latest pick up, earliest drop off) of every
+    (pick_up_id, drop_off_id) pair of the bus legs from precompute.compute_bus_legs().
+    If by_service is True and the legs have a service_id, trips are only compared with
+    trips of the same service (i.e. running on the same days).
+    """
+    group_cols = ['pick_up_id', 'drop_off_id']
+    if by_service and 'service_id' in legs.columns:
+        group_cols.append('service_id')
+    if 'access' in legs.columns:
+        group_cols.append('access')
+    group = legs.groupby(group_cols, sort=False, dropna=False).ngroup().to_numpy()
+    keep = pareto_mask(legs['pick_up_time'], legs['drop_off_time'], group=group)
+    pruned = legs[keep]
+    if report:
+        report_reduction(len(legs), len(pruned), 'bus legs')
+    return pruned
+
+
+def report_reduction(before, after, what='rows'):
+    """
+    Print how many rows were kept and return the reduction ratio (fraction removed).
+    """
+    ratio = 1 - after / before if before else 0.0
+    print(f"Pruning kept {after} of {before} {what} ({ratio:.1%} reduction)")
+    return ratio
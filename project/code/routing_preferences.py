@@ -1,7 +1,6 @@
 import pandas as pd
-import veroviz as vrv
 import numpy as np
-import datetime
+from .timeutils import hms_to_seconds, seconds_to_minutes
 
 #* valid preference values: 'min_time' (default) or 'min_walk'
 #* beta (default 140) is a tuning parameter bounded between 0 and 1. 
@@ -9,32 +8,32 @@ import datetime
       #if increased, the routes require more time will be punished more 
       #and the value will converge to 0 more quickly. If you want to penalize 
       #time more, decrease this term.
-#* time: format for time as follows: "HH:MM:SS"
+#* time: format for time as follows: "HH:MM:SS" (or integer seconds after midnight)
 #* origin_id and destination_id: must be present in all_routes dataframe
 #* all_routes: dataframe. output from find_all_routes.py
 
 
 def route_preferences(all_routes, time, origin_id, destination_id, preference = 'min_time', beta = 140): 
-    # Convert time string to datetime object
-    time = datetime.datetime.strptime(time, "%H:%M:%S")
+    # time may be given as "HH:MM:SS" or as seconds; everything below is integer seconds
+    time = hms_to_seconds(time) if isinstance(time, str) else int(time)
+
     #filter the routes based on the origin and destionation
-    filtered_routes = all_routes[(all_routes['origin_id'] == origin_id) & 
-                                 (all_routes['destination_id'] == destination_id) & 
-                                 (all_routes['start_time'] >= time.strftime("%H:%M:%S")) & 
-                                 (all_routes['end_time'] <= (time + datetime.timedelta(hours=1)).strftime("%H:%M:%S"))]
+    start_time = hms_to_seconds(all_routes['start_time'])
+    end_time = hms_to_seconds(all_routes['end_time'])
+    mask = ((all_routes['origin_id'].to_numpy() == origin_id) &
+            (all_routes['destination_id'].to_numpy() == destination_id) &
+            (start_time >= time) &
+            (end_time >= 0) & (end_time <= time + 3600))
+    filtered_routes = all_routes[mask].copy()
     
-    # Create identical time columns to process later
-    filtered_routes['bus_riding_time_mins'] = filtered_routes['bus_riding_time']
-    filtered_routes['waiting_time_mins'] = filtered_routes['waiting_time'] #waiting from start time to first bus time, can be removed
-    filtered_routes['total_walking_time_mins'] = filtered_routes['total_walking_time']
-    filtered_routes['adjusted_total_time_mins'] = filtered_routes['adjusted_total_time']
-
-    time_cols = ['bus_riding_time_mins', 'waiting_time_mins', 'total_walking_time_mins', 'adjusted_total_time_mins']
-
-    #convert identical time columns to minutes for exponential calculations
-    for col in time_cols:
-        filtered_routes[col] = pd.to_datetime(filtered_routes[col], format='%H:%M:%S')
-        filtered_routes[col] = filtered_routes[col].dt.hour * 60 + filtered_routes[col].dt.minute + filtered_routes[col].dt.second / 60
+    # Create identical time columns to process later, in minutes for exponential calculations
+    # (waiting time is from start time to first bus time, can be removed)
+    time_cols = {'bus_riding_time_mins': 'bus_riding_time',
+                 'waiting_time_mins': 'waiting_time',
+                 'total_walking_time_mins': 'total_walking_time',
+                 'adjusted_total_time_mins': 'adjusted_total_time'}
+    for col, source in time_cols.items():
+        filtered_routes[col] = seconds_to_minutes(hms_to_seconds(filtered_routes[source]))
         
     
     #time impedance function - will be used in part for accessibility measure
@@ -50,7 +49,7 @@ def route_preferences(all_routes, time, origin_id, destination_id, preference =
     min_walking_distance = filtered_routes.loc[filtered_routes['total_walk'].idxmin()]
 
     #locate the route with minimum total time
-    min_time = filtered_routes.loc[filtered_routes['adjusted_total_time'].idxmin()]
+    min_time = filtered_routes.loc[filtered_routes['adjusted_total_time_mins'].idxmin()]
     
     #return the trip that has the minimum overall time 
     if preference == 'min_time':
@@ -0,0 +1,223 @@
+import os
+import argparse
+import numpy as np
+import pandas as pd
+from .use_preferences import route_frontier, preference_from_frontier
+from .schema import read_table
+
+"""
+Purpose:
+    What-if evaluation of service changes (e.g. NFTA dropping a stop or a route)
+    without running the whole pipeline again.
+
+    A Scenario removes stops, routes or trips, or makes a route less frequent
+    (scales its headway). All of these only remove trips, so a route can only get
+    worse, and an (OD pair, time slot) whose best route uses none of the removed
+    stops and trips keeps the same best route. The ScenarioEngine keeps a reverse
+    index from every stop_id (start_stop_id/end_stop_id) and trip_id to the rows
+    of best_routes that use it, and recomputes only those rows from the routes of
+    their OD pair. The work is proportional to the change, not to the city.
+
+Usage:
+    cd project/
+    python -m code.scenarios --experiment_id BNMC --remove_stops 6155 6156
+    python -m code.scenarios --experiment_id BNMC --remove_routes 8 --headway_scale 2 --scale_routes 20
+"""
+
+
+class Scenario:
+    def __init__(self, remove_stops=(), remove_routes=(), remove_trips=(), headway_scale=1.0, scale_routes=None,
+                 name='scenario'):
+        # remove_stops: stop_ids that are no longer served
+        # remove_routes: route_ids that are discontinued
+        # remove_trips: trip_ids that are cancelled
+        # headway_scale: the time between buses is multiplied by this (>= 1), e.g. 2 keeps every other trip
+        # scale_routes: route_ids whose headway is scaled (all routes if None)
+        if headway_scale < 1:
+            raise ValueError("headway_scale must be >= 1: a scenario can only remove trips")
+        self.remove_stops = set(remove_stops)
+        self.remove_routes = set(remove_routes)
+        self.remove_trips = set(remove_trips)
+        self.headway_scale = headway_scale
+        self.scale_routes = None if scale_routes is None else set(scale_routes)
+        self.name = name
+
+    def removed_trips(self, trips=None, legs=None):
+        '''
+        Return the set of removed trip_ids.
+
+        trips: pd.DataFrame read from trips.txt | needed for remove_routes and headway_scale
+        legs: pd.DataFrame from precompute.bus_legs() | the departure times used to order
+              the trips of a route when scaling headways
+        '''
+        removed = set(self.remove_trips)
+        if self.remove_routes:
+            removed |= set(trips.loc[trips['route_id'].isin(self.remove_routes), 'trip_id'])
+
+        if self.headway_scale > 1:
+            first_departure = legs.groupby('trip_id')['pick_up_time'].min()
+            scaled = trips if self.scale_routes is None else trips[trips['route_id'].isin(self.scale_routes)]
+            scaled = scaled[scaled['trip_id'].isin(first_departure.index)].copy()
+            scaled['departure'] = scaled['trip_id'].map(first_departure)
+            # Trips of the same route, direction and service, in order of departure
+            group_cols = [col for col in ['route_id', 'direction_id', 'service_id'] if col in scaled.columns]
+            scaled = scaled.sort_values(by=group_cols + ['departure'], kind='mergesort')
+            rank = scaled.groupby(group_cols, sort=False).cumcount().to_numpy()
+            # Keep trip i if it starts a new block of headway_scale trips (evenly spread)
+            keep = np.floor(rank / self.headway_scale) > np.floor((rank - 1) / self.headway_scale)
+            removed |= set(scaled.loc[~keep, 'trip_id'])
+        return removed
+
+
+def apply_scenario(table, removed_trips, removed_stops, trip_col='trip_id', stop_cols=('start_stop_id', 'end_stop_id')):
+    '''
+    Boolean mask over the rows of a route table (routes.csv, best_routes.csv or the legs of
+    precompute.py with stop_cols=('pick_up_id', 'drop_off_id')): True if the row survives the scenario.
+    '''
+    keep = ~table[trip_col].isin(removed_trips).to_numpy()
+    for col in stop_cols:
+        keep &= ~table[col].isin(removed_stops).to_numpy()
+    return keep
+
+
+class ScenarioEngine:
+    def __init__(self, routes, best_routes, beta=140, window=3600):
+        # routes: the output of find_routes() (routes.csv)
+        # best_routes: the baseline best routes (best_routes.csv), with a 'time' column
+        self.routes = routes.reset_index(drop=True)
+        self.best_routes = best_routes.reset_index(drop=True)
+        if 'preference' not in self.best_routes.columns:
+            self.best_routes['preference'] = 'min_time'
+        self.beta = beta
+        self.window = window
+
+        # Rows of routes of every OD pair
+        self.od_rows = self.routes.groupby(['origin_id', 'destination_id'], sort=False).indices
+
+        # Reverse index: stop_id / trip_id -> rows of best_routes that use it
+        self.stop_index = {}
+        for col in ['start_stop_id', 'end_stop_id']:
+            for stop_id, rows in self.best_routes.groupby(col, sort=False).indices.items():
+                self.stop_index.setdefault(stop_id, []).append(rows)
+        self.stop_index = {stop_id: np.unique(np.concatenate(rows)) for stop_id, rows in self.stop_index.items()}
+        self.trip_index = self.best_routes.groupby('trip_id', sort=False).indices
+
+    def affected_rows(self, removed_trips, removed_stops):
+        # Rows of best_routes whose route uses a removed stop or trip
+        rows = [self.trip_index[t] for t in removed_trips if t in self.trip_index] \
+            + [self.stop_index[s] for s in removed_stops if s in self.stop_index]
+        return np.unique(np.concatenate(rows)) if rows else np.zeros(0, dtype=np.int64)
+
+    def evaluate(self, scenario, trips=None, legs=None):
+        '''
+        Apply the scenario and recompute the affected best routes.
+
+        Returns
+        -------
+        best_routes: pd.DataFrame
+            the best routes under the scenario (unaffected rows are the baseline rows)
+        scores: pd.DataFrame
+            the accessibility scores of every origin before and after (see scoreDiff)
+        '''
+        removed_trips = scenario.removed_trips(trips, legs)
+        removed_stops = scenario.remove_stops
+        affected = self.affected_rows(removed_trips, removed_stops)
+        keys = self.best_routes.loc[affected, ['origin_id', 'destination_id', 'time', 'preference']]
+        print(f"Scenario '{scenario.name}': {len(removed_trips)} trips and {len(removed_stops)} stops removed, "
+              f"{len(affected)} of {len(self.best_routes)} best routes affected")
+
+        # Routes of the affected OD pairs that survive the scenario
+        pairs = keys[['origin_id', 'destination_id']].drop_duplicates()
+        rows = [self.od_rows[od] for od in zip(pairs['origin_id'], pairs['destination_id']) if od in self.od_rows]
+        routes = self.routes.loc[np.concatenate(rows)] if rows else self.routes.iloc[:0]
+        routes = routes[apply_scenario(routes, removed_trips, removed_stops)]
+
+        # Recompute the affected (OD pair, slot) best routes of every preference
+        recomputed = []
+        if len(keys):
+            frontier = route_frontier(routes, keys['time'].unique(), beta=self.beta, window=self.window)
+            for preference in keys['preference'].unique():
+                best = preference_from_frontier(frontier, preference=preference)
+                wanted = keys[keys['preference'] == preference]
+                recomputed.append(best.merge(wanted, on=['origin_id', 'destination_id', 'time', 'preference']))
+
+        unaffected = np.ones(len(self.best_routes), dtype=bool)
+        unaffected[affected] = False
+        best_routes = pd.concat([self.best_routes[unaffected]] + recomputed, ignore_index=True)
+        best_routes = best_routes.sort_values(by=['preference', 'time', 'origin_id', 'destination_id'], kind='mergesort')
+        best_routes = best_routes.reset_index(drop=True)
+        return best_routes, scoreDiff(self.best_routes, best_routes)
+
+
+def accessibilityScores(best_routes, origin_ids=None, n_destinations=None, n_times=None):
+    '''
+    Accessibility of every origin (and preference) from best routes:
+        'reachable': fraction of the destinations reached in at least one slot (as ai_1 in gen_ai.py)
+        'time_score': mean total_time_score over all (destination, slot), 0 where none is reachable
+    '''
+    if n_destinations is None:
+        n_destinations = best_routes['destination_id'].nunique()
+    if n_times is None:
+        n_times = best_routes['time'].nunique()
+    grouped = best_routes.groupby(['preference', 'origin_id'])
+    scores = pd.DataFrame({
+        'reachable': grouped['destination_id'].nunique() / n_destinations,
+        'time_score': grouped['total_time_score'].sum() / (n_destinations * n_times),
+    })
+    if origin_ids is not None:
+        index = pd.MultiIndex.from_product([scores.index.get_level_values(0).unique(), origin_ids],
+                                           names=['preference', 'origin_id'])
+        scores = scores.reindex(index, fill_value=0.0)
+    return scores
+
+
+def scoreDiff(baseline, scenario, labels=('baseline', 'scenario')):
+    '''
+    Accessibility scores before and after a scenario, one row per (preference, origin_id).
+    labels are the suffixes of the two sets of score columns.
+    '''
+    n_destinations = baseline['destination_id'].nunique()
+    n_times = baseline['time'].nunique()
+    origin_ids = baseline['origin_id'].unique()
+    before = accessibilityScores(baseline, origin_ids, n_destinations, n_times)
+    after = accessibilityScores(scenario, origin_ids, n_destinations, n_times).reindex(before.index, fill_value=0.0)
+    diff = before.join(after, lsuffix=f'_{labels[0]}', rsuffix=f'_{labels[1]}')
+    for col in ['reachable', 'time_score']:
+        diff[f'{col}_change'] = diff[f'{col}_{labels[1]}'] - diff[f'{col}_{labels[0]}']
+    return diff.reset_index()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Evaluate a service change against the baseline best routes.')
+    parser.add_argument('--experiment_id', default='test', help='Unique identifier for the experiment.')
+    parser.add_argument('--name', default='scenario', help='Name of the scenario, used in the output file names.')
+    parser.add_argument('--remove_stops', type=int, nargs='*', default=[], help='stop_ids that are no longer served.')
+    parser.add_argument('--remove_routes', type=int, nargs='*', default=[], help='route_ids that are discontinued.')
+    parser.add_argument('--remove_trips', type=int, nargs='*', default=[], help='trip_ids that are cancelled.')
+    parser.add_argument('--headway_scale', type=float, default=1.0,
+                        help='Multiply the time between buses by this (>= 1). Default is 1.')
+    parser.add_argument('--scale_routes', type=int, nargs='*', default=None,
+                        help='route_ids whose headway is scaled. Default is all routes.')
+    parser.add_argument('--region', default='BNMC', help='Region whose stops are used for --headway_scale.')
+    args = parser.parse_args()
+
+    directory = f"experiments/{args.experiment_id}/"
+    routes = read_table(directory + 'routes.csv', 'routes')
+    best_routes = read_table(directory + 'best_routes.csv', 'best_routes')
+    scenario = Scenario(remove_stops=args.remove_stops, remove_routes=args.remove_routes,
+                        remove_trips=args.remove_trips, headway_scale=args.headway_scale,
+                        scale_routes=args.scale_routes, name=args.name)
+
+    trips, legs = None, None
+    if args.remove_routes or args.headway_scale > 1:
+        trips = pd.read_csv(os.path.join('data/google_transit', 'trips.txt'))
+    if args.headway_scale > 1:
+        from .precompute import bus_legs
+        from .accessibility.regions import getRegionStops
+        legs = bus_legs(stop_ids=getRegionStops(args.region)['stop_id'].unique())
+
+    engine = ScenarioEngine(routes, best_routes)
+    scenario_routes, scores = engine.evaluate(scenario, trips=trips, legs=legs)
+    scenario_routes.to_csv(directory + f'best_routes_{args.name}.csv', index=False)
+    scores.to_csv(directory + f'scores_{args.name}.csv', index=False)
+    print(scores[['preference', 'reachable_change', 'time_score_change']].groupby('preference').mean())
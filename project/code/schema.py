@@ -0,0 +1,173 @@
+import pandas as pd
+
+"""
+Purpose:
+    Explicit compact dtypes for the tables that are loaded or produced, instead of the
+    default pandas inference (float64/int64 everywhere, object strings, float stop ids
+    filled with NaN on the walking only rows).
+
+    int32      whole seconds of the timetable (pick up/drop off, slot 'time') and ids
+    Int32      the same where the walking only rows have no value (trip_id, stop ids, bus times)
+    float32    distances (meters), scores and the seconds that include walking; float32 keeps
+               times of day to within 8 ms, far below the resolution of the walking times
+    int8/uint8 bus_used, the wheelchair 'access' bitmask
+    category   preference, service_id, service_description, route_id
+    Latitudes and longitudes stay float64.
+
+    Integer columns are cast safely: a column with missing values gets the nullable type,
+    and a column whose values are not whole numbers (or do not fit) is left as it is.
+    Columns that are not in the schema of the table are left as they are.
+
+Usage:
+    from .schema import compact, read_table
+    routes = read_table('experiments/BNMC/routes.csv', 'routes', report=True)
+    best_routes = compact(best_routes, 'best_routes')
+"""
+
+ROUTES = {
+    'trip_id': 'Int32',
+    'bus_start_time': 'Int32',
+    'bus_end_time': 'Int32',
+    'bus_riding_time': 'Int32',
+    'walk_to_start_time': 'float32',
+    'walk_to_destination_time': 'float32',
+    'walk_to_start': 'float32',
+    'walk_to_destination': 'float32',
+    'total_walk_time': 'float32',
+    'destination_id': 'int32',
+    'origin_id': 'int32',
+    'start_stop_id': 'Int32',
+    'end_stop_id': 'Int32',
+    'total_walk': 'float32',
+    'total_time': 'float32',
+    'start_time': 'float32',
+    'end_time': 'float32',
+    'bus_used': 'int8',
+    'access': 'uint8',
+    'is_feasible': 'bool',
+}
+
+SCHEMAS = {
+    # find_all_routes.find_routes() / routes.csv
+    'routes': ROUTES,
+    # route_preferences(), preference_from_frontier() / best_routes.csv, frontier.csv, results.csv
+    'best_routes': {
+        **ROUTES,
+        'total_time_score': 'float32',
+        'walking_score': 'float32',
+        'time': 'int32',
+        'preference': 'category',
+    },
+    # precompute.bus_legs()
+    'legs': {
+        'trip_id': 'int32',
+        'pick_up_id': 'int32',
+        'pick_up_time': 'int32',
+        'drop_off_id': 'int32',
+        'drop_off_time': 'int32',
+        'walking_distance': 'float32',
+        'service_id': 'category',
+        'access': 'uint8',
+    },
+    # walking_origins_to_stops.csv, walking_destinations_to_stops.csv ('time' is the walking time)
+    'walking': {
+        'stop_id': 'int32',
+        'id': 'int32',
+        'time': 'float32',
+        'distance': 'float32',
+    },
+    # walking_origins_to_destinations.csv
+    'origin2destination': {
+        'origin_id': 'int32',
+        'destination_id': 'int32',
+        'time': 'float32',
+        'distance': 'float32',
+    },
+    # Stops joined with stop_times, trips and calendar_attributes (routing_template.perform_merge)
+    'stop_data': {
+        'stop_id': 'int32',
+        'trip_id': 'int32',
+        'stop_sequence': 'int16',
+        'route_id': 'category',
+        'service_id': 'category',
+        'service_description': 'category',
+        'direction_id': 'int8',
+    },
+}
+
+# Keys of the location_to_stops dictionary (routing_template.get_walking_df) -> schema
+WALKING_SCHEMAS = {'origin': 'walking', 'destination': 'walking', 'origin2destination': 'origin2destination'}
+
+
+def memory_usage(df):
+    # Bytes used by the table, strings included
+    return int(df.memory_usage(deep=True).sum())
+
+
+def report_memory(before, after, what='table'):
+    """
+    Print the memory used before and after and return the reduction ratio (fraction saved).
+    """
+    ratio = 1 - after / before if before else 0.0
+    print(f"{what}: {before / 2 ** 20:.1f} MB -> {after / 2 ** 20:.1f} MB ({ratio:.1%} less memory)")
+    return ratio
+
+
+# Nullable type used for the integer columns with missing values
+NULLABLE = {'int8': 'Int8', 'int16': 'Int16', 'int32': 'Int32', 'uint8': 'UInt8', 'bool': 'boolean'}
+
+
+def cast_column(column, dtype):
+    # Cast one column to dtype, or return it unchanged if that would lose information
+    if column.dtype == dtype:
+        return column
+    numpy_dtype = dtype.lower() if dtype.lower() in NULLABLE else None
+    try:
+        if numpy_dtype is not None:
+            # Through the nullable type: raises if the values are not whole numbers or do not fit
+            nullable = column.astype(NULLABLE[numpy_dtype])
+            return nullable if nullable.isna().any() else nullable.astype(numpy_dtype)
+        return column.astype(dtype)
+    except (TypeError, ValueError, OverflowError):
+        return column
+
+
+def compact(df, table, report=False):
+    """
+    Return df with the dtypes of SCHEMAS[table] (see the module docstring).
+
+    df: pd.DataFrame
+    table: 'routes', 'best_routes', 'legs', 'walking', 'origin2destination' or 'stop_data'
+    report: if True, print the memory used before and after
+    """
+    schema = SCHEMAS[table]
+    before = memory_usage(df) if report else 0
+    df = df.assign(**{col: cast_column(df[col], dtype) for col, dtype in schema.items() if col in df.columns})
+    if report:
+        report_memory(before, memory_usage(df), what=table)
+    return df
+
+
+def compact_walking(location_to_stops, report=False):
+    # compact() every table of a location_to_stops dictionary
+    return {key: compact(df, WALKING_SCHEMAS[key], report=report) if df is not None else None
+            for key, df in location_to_stops.items()}
+
+
+def read_table(file_path, table, report=False, **kwargs):
+    """
+    Read a CSV file with the dtypes of SCHEMAS[table].
+
+    Without report, the floats and categories are parsed directly into their compact type
+    (no float64/object copy of these columns is made); the integer columns are narrowed
+    after parsing. With report, the file is read with the default inference
+    first, so the memory saved is measured.
+    """
+    if report:
+        return compact(pd.read_csv(file_path, **kwargs), table, report=True)
+    dtype = kwargs.pop('dtype', {})
+    header = pd.read_csv(file_path, nrows=0, **kwargs).columns
+    parse = {col: col_dtype for col, col_dtype in SCHEMAS[table].items()
+             if col in header and col_dtype in ('float32', 'category')}
+    df = pd.read_csv(file_path, dtype={**parse, **dtype}, **kwargs)
+    return compact(df, table)
@@ -0,0 +1,268 @@
+import os
+import json
+import argparse
+import functools
+import numpy as np
+import pandas as pd
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+from .arrive_by import ArriveByIndex
+from .scenarios import accessibilityScores
+from .timeutils import hms_to_seconds
+from .schema import read_table
+
+"""
+Purpose:
+    A local HTTP/JSON service that loads an experiment once and keeps its indexes in
+    memory, so vizRoute.py, ai_map.py, the heatmaps or a notebook can ask questions
+    without rereading the CSVs and re-importing veroviz/matplotlib every time.
+
+    Loaded once:
+        best routes (best_routes.csv, or results.csv), sorted by start_time per (OD pair, preference)
+        all routes (routes.csv if it exists) for the departure window and arrive-by queries
+        accessibility scores of every origin (see scenarios.accessibilityScores)
+        GeoJSON of the origins, destinations and bus stops, and the GTFS shapes of the trips
+
+Endpoints (GET, times are seconds or "HH:MM:SS"):
+    /health
+    /best_route?origin=1&destination=2&time=28800&preference=min_time
+        same answer as accessibility.utils.getResults()
+    /departures?origin=1&destination=2&time=28800&window=3600
+        every route leaving at or after time and arriving by time + window
+    /arrive_by?origin=1&destination=2&arrive_by=09:00:00
+        route with the latest departure arriving by the deadline (see arrive_by.py)
+    /score?origin=1&preference=min_time     (all origins if origin is omitted)
+    /geometry?origin=1&destination=2&time=28800&preference=min_time
+        GeoJSON of the walking and bus legs of the best route
+    /layer?name=origins|destinations|stops
+        GeoJSON points
+
+Usage:
+    cd project/
+    python -m code.service --experiment_id BNMC --port 8765
+    python -m code.accessibility.client --port 8765 --requests 20000 --concurrency 8   (load generator)
+"""
+
+
+def records(df):
+    # JSON-ready rows: numpy scalars become Python numbers and NaN becomes None
+    df = df.astype(object).where(df.notna(), None)
+    return [{k: (v.item() if isinstance(v, np.generic) else v) for k, v in row.items()}
+            for row in df.to_dict(orient='records')]
+
+
+def point_features(df, id_col, lat_col, lon_col, properties=()):
+    return {'type': 'FeatureCollection', 'features': [
+        {'type': 'Feature',
+         'geometry': {'type': 'Point', 'coordinates': [float(lon), float(lat)]},
+         'properties': {'id': i.item() if isinstance(i, np.generic) else i,
+                        **{p: (v.item() if isinstance(v, np.generic) else v) for p, v in zip(properties, values)}}}
+        for i, lat, lon, *values in zip(df[id_col], df[lat_col], df[lon_col], *[df[p] for p in properties])]}
+
+
+class RouteTable:
+    def __init__(self, routes, by=('origin_id', 'destination_id')):
+        # Rows of every group sorted by start_time: a window query is a binary search
+        routes = routes.reset_index(drop=True)
+        bus = routes[routes['start_time'].notna()].sort_values(by=list(by) + ['start_time'], kind='mergesort')
+        self.rows = records(bus)
+        self.start = bus['start_time'].to_numpy(dtype=float)
+        self.end = bus['end_time'].to_numpy(dtype=float)
+        self.groups = {key: (rows.min(), rows.max() + 1) for key, rows in
+                       pd.Series(np.arange(len(bus))).groupby([bus[c].to_numpy() for c in by]).groups.items()}
+        # Walking only routes (no fixed start time) of every group
+        walks = routes[routes['start_time'].isna()]
+        self.walks = {key: rec for key, rec in zip(zip(*[walks[c].tolist() for c in by]), records(walks))}
+
+    def window(self, key, time, window=3600):
+        # Positions of the routes of the group with time <= start_time and end_time <= time + window
+        lo, hi = self.groups.get(key, (0, 0))
+        first = lo + np.searchsorted(self.start[lo:hi], time, side='left')
+        last = lo + np.searchsorted(self.start[lo:hi], time + window, side='right')
+        return [i for i in range(first, last) if self.end[i] <= time + window]
+
+
+class RoutingService:
+    def __init__(self, directory, gtfs_dir='data/google_transit'):
+        self.directory = directory
+        self.origins = pd.read_csv(os.path.join(directory, 'origins.csv'))
+        self.destinations = pd.read_csv(os.path.join(directory, 'destinations.csv'))
+
+        best_file = os.path.join(directory, 'best_routes.csv')
+        best_routes = read_table(best_file if os.path.exists(best_file) else os.path.join(directory, 'results.csv'),
+                                 'best_routes', encoding='utf-8-sig')
+        if 'preference' not in best_routes.columns:
+            best_routes['preference'] = pd.Categorical(['min_time'] * len(best_routes))
+        self.best = RouteTable(best_routes, by=('origin_id', 'destination_id', 'preference'))
+
+        routes_file = os.path.join(directory, 'routes.csv')
+        routes = read_table(routes_file, 'routes') if os.path.exists(routes_file) else best_routes
+        self.routes = RouteTable(routes)
+        self.arrive_by = ArriveByIndex(routes)
+        self.arrive_by_rows = records(self.arrive_by.routes)
+        self.od_code = {(o, d): i * len(self.arrive_by.destination_ids) + j
+                        for i, o in enumerate(self.arrive_by.origin_ids.tolist())
+                        for j, d in enumerate(self.arrive_by.destination_ids.tolist())}
+
+        scores = accessibilityScores(best_routes, origin_ids=self.origins['name'].to_numpy(),
+                                     n_destinations=len(self.destinations))
+        self.scores = {key: {k: float(v) for k, v in row.items()} for key, row in scores.iterrows()}
+
+        stops = pd.read_csv(os.path.join(gtfs_dir, 'stops.txt'))
+        self.stop_locations = dict(zip(stops['stop_id'].tolist(), zip(stops['stop_lat'].tolist(),
+                                                                      stops['stop_lon'].tolist())))
+        self.origin_locations = dict(zip(self.origins['name'].tolist(),
+                                         zip(self.origins['lat'].tolist(), self.origins['lon'].tolist())))
+        self.destination_locations = dict(zip(self.destinations['name'].tolist(),
+                                              zip(self.destinations['lat'].tolist(), self.destinations['lon'].tolist())))
+        self.layers = {
+            'origins': point_features(self.origins, 'name', 'lat', 'lon',
+                                      [c for c in ['neighborhood', 'point_type'] if c in self.origins.columns]),
+            'destinations': point_features(self.destinations, 'name', 'lat', 'lon'),
+            'stops': point_features(stops, 'stop_id', 'stop_lat', 'stop_lon', ['stop_name']),
+        }
+
+        # Shape points of every trip, for the bus leg of the route geometry
+        trips = pd.read_csv(os.path.join(gtfs_dir, 'trips.txt'), usecols=['trip_id', 'shape_id'])
+        shapes = pd.read_csv(os.path.join(gtfs_dir, 'shapes.txt')).sort_values(by=['shape_id', 'shape_pt_sequence'])
+        self.shape_of_trip = dict(zip(trips['trip_id'].tolist(), trips['shape_id'].tolist()))
+        self.shapes = {shape_id: group[['shape_pt_lat', 'shape_pt_lon']].to_numpy()
+                       for shape_id, group in shapes.groupby('shape_id', sort=False)}
+
+    def best_route(self, origin, destination, time, preference='min_time', window=3600):
+        # Earliest best route of the slot, as in accessibility.utils.getResults()
+        found = self.best.window((origin, destination, preference), time, window)
+        if found:
+            return self.best.rows[found[0]]
+        walk = self.best.walks.get((origin, destination, preference))
+        return walk if walk is not None and walk['total_time'] <= window else None
+
+    def departures(self, origin, destination, time, window=3600):
+        routes = [self.routes.rows[i] for i in self.routes.window((origin, destination), time, window)]
+        walk = self.routes.walks.get((origin, destination))
+        return routes + ([walk] if walk is not None and walk['total_time'] <= window else [])
+
+    def latest_departure(self, origin, destination, arrive_by):
+        code = self.od_code.get((origin, destination))
+        if code is None:
+            return None
+        departure, row = self.arrive_by.query(np.array([code]), arrive_by)
+        if row[0] < 0:
+            return None
+        return {**self.arrive_by_rows[row[0]], 'latest_departure': float(departure[0]), 'arrive_by': arrive_by}
+
+    def score(self, origin=None, preference='min_time'):
+        if origin is None:
+            return {str(o): s for (p, o), s in self.scores.items() if p == preference}
+        return self.scores.get((preference, origin))
+
+    @functools.lru_cache(maxsize=4096)
+    def bus_shape(self, trip_id, start_stop_id, end_stop_id):
+        # Shape points of the trip between the two stops, [lon, lat] pairs
+        start, end = self.stop_locations[start_stop_id], self.stop_locations[end_stop_id]
+        points = self.shapes.get(self.shape_of_trip.get(trip_id))
+        if points is None:
+            return [[start[1], start[0]], [end[1], end[0]]]
+        first = int(np.argmin(((points - start) ** 2).sum(axis=1)))
+        last = first + int(np.argmin(((points[first:] - end) ** 2).sum(axis=1)))
+        line = [[start[1], start[0]]] + points[first:last + 1, ::-1].tolist() + [[end[1], end[0]]]
+        return line
+
+    def geometry(self, origin, destination, time, preference='min_time'):
+        route = self.best_route(origin, destination, time, preference)
+        if route is None:
+            return None
+        o, d = self.origin_locations[origin], self.destination_locations[destination]
+
+        def leg(mode, coordinates):
+            return {'type': 'Feature', 'properties': {'mode': mode},
+                    'geometry': {'type': 'LineString', 'coordinates': coordinates}}
+
+        if not route['bus_used']:
+            features = [leg('walk', [[o[1], o[0]], [d[1], d[0]]])]
+        else:
+            start_stop, end_stop = int(route['start_stop_id']), int(route['end_stop_id'])
+            s, e = self.stop_locations[start_stop], self.stop_locations[end_stop]
+            features = [leg('walk', [[o[1], o[0]], [s[1], s[0]]]),
+                        leg('bus', self.bus_shape(int(route['trip_id']), start_stop, end_stop)),
+                        leg('walk', [[e[1], e[0]], [d[1], d[0]]])]
+        return {'type': 'FeatureCollection', 'features': features, 'properties': route}
+
+    def handle(self, path, query):
+        '''
+        Answer one request. Returns (HTTP status, JSON-ready answer).
+        '''
+        def param(name, cast=int, default=None):
+            value = query.get(name, [default])[0]
+            if value is None:
+                raise ValueError(f"missing parameter '{name}'")
+            return cast(value)
+
+        def seconds(value):
+            return hms_to_seconds(value) if ':' in value else float(value)
+
+        if path == '/health':
+            return 200, {'status': 'ok', 'directory': self.directory}
+        if path == '/best_route':
+            answer = self.best_route(param('origin'), param('destination'), param('time', seconds),
+                                     param('preference', str, 'min_time'), param('window', float, 3600))
+        elif path == '/departures':
+            answer = self.departures(param('origin'), param('destination'), param('time', seconds),
+                                     param('window', float, 3600))
+        elif path == '/arrive_by':
+            answer = self.latest_departure(param('origin'), param('destination'), param('arrive_by', seconds))
+        elif path == '/score':
+            answer = self.score(param('origin') if 'origin' in query else None, param('preference', str, 'min_time'))
+        elif path == '/geometry':
+            answer = self.geometry(param('origin'), param('destination'), param('time', seconds),
+                                   param('preference', str, 'min_time'))
+        elif path == '/layer':
+            answer = self.layers.get(param('name', str))
+        else:
+            return 404, {'error': f"unknown endpoint {path}"}
+        return (200, answer) if answer is not None else (404, {'error': 'not found'})
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep the connection open between requests
+    disable_nagle_algorithm = True  # send small answers at once instead of waiting for an ACK
+    service = None
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        try:
+            status, answer = self.service.handle(url.path, parse_qs(url.query))
+        except (ValueError, KeyError) as e:
+            status, answer = 400, {'error': str(e)}
+        body = json.dumps(answer).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # one line per request would dominate the latency
+
+
+def serve(service, host='127.0.0.1', port=8765):
+    handler = type('Handler', (RequestHandler,), {'service': service})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve the routes and scores of an experiment over HTTP/JSON.')
+    parser.add_argument('--experiment_id', default='test', help='Unique identifier for the experiment.')
+    parser.add_argument('--host', default='127.0.0.1', help='Address to listen on. Default is 127.0.0.1.')
+    parser.add_argument('--port', type=int, default=8765, help='Port to listen on. Default is 8765.')
+    args = parser.parse_args()
+
+    service = RoutingService(f"experiments/{args.experiment_id}/")
+    server = serve(service, args.host, args.port)
+    print(f"Serving experiment {args.experiment_id} on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
@@ -0,0 +1,116 @@
+import os
+import datetime
+import numpy as np
+import pandas as pd
+
+"""
+Purpose:
+    Answer "which services/trips run on this date?" from the GTFS calendar.txt and
+    calendar_dates.txt, including the holiday exceptions.
+
+    Every service_id gets one bit per date of the feed (packed with np.packbits).
+    Questions about a date are answered by reading one column of bits and indexing it
+    with the service codes of the trips or stop times, so the route tables can be
+    masked for any date without merging them with the calendar again.
+
+Usage:
+    calendar = ServiceCalendar.from_gtfs('data/google_transit')
+    mask = calendar.service_mask(df['service_id'], '2024-01-15')
+    df_on_date = df[mask]
+"""
+
+WEEKDAYS = ['monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday']
+
+
+def to_date(date):
+    """
+    Convert '2024-01-15', '20240115', 20240115 or a datetime/date to a datetime.date
+    """
+    if isinstance(date, (int, np.integer)):
+        date = str(date)
+    return pd.Timestamp(date).date()
+
+
+class ServiceCalendar:
+    def __init__(self, calendar, calendar_dates=None):
+        # calendar: pd.DataFrame read from calendar.txt
+        # calendar_dates: pd.DataFrame read from calendar_dates.txt (optional)
+        service_ids = pd.Index(pd.unique(pd.concat([calendar['service_id'],
+                                                    calendar_dates['service_id'] if calendar_dates is not None
+                                                    else pd.Series(dtype=calendar['service_id'].dtype)])))
+        start = pd.to_datetime(calendar['start_date'].astype(str), format='%Y%m%d')
+        end = pd.to_datetime(calendar['end_date'].astype(str), format='%Y%m%d')
+        first, last = start.min(), end.max()
+        if calendar_dates is not None and len(calendar_dates):
+            exception_dates = pd.to_datetime(calendar_dates['date'].astype(str), format='%Y%m%d')
+            first, last = min(first, exception_dates.min()), max(last, exception_dates.max())
+
+        self.first_date = first.date()
+        self.n_days = (last - first).days + 1
+        self.service_ids = service_ids
+
+        # Regular weekly service
+        days = pd.date_range(first, last, freq='D')
+        weekday = days.weekday.to_numpy()
+        day_number = np.arange(self.n_days)
+        active = np.zeros((len(service_ids), self.n_days), dtype=bool)
+        rows = service_ids.get_indexer(calendar['service_id'])
+        weekly = calendar[WEEKDAYS].to_numpy(dtype=bool)[:, weekday]
+        start_day = (start - first).dt.days.to_numpy()[:, None]
+        end_day = (end - first).dt.days.to_numpy()[:, None]
+        active[rows] = weekly & (day_number >= start_day) & (day_number <= end_day)
+
+        # Exceptions: 1 = service added on that date, 2 = service removed
+        if calendar_dates is not None and len(calendar_dates):
+            rows = service_ids.get_indexer(calendar_dates['service_id'])
+            cols = (exception_dates - first).dt.days.to_numpy()
+            exception_type = calendar_dates['exception_type'].to_numpy()
+            active[rows[exception_type == 1], cols[exception_type == 1]] = True
+            active[rows[exception_type == 2], cols[exception_type == 2]] = False
+
+        # One row of bits per service_id
+        self.bits = np.packbits(active, axis=1)
+
+    @classmethod
+    def from_gtfs(cls, gtfs_dir='data/google_transit'):
+        calendar = pd.read_csv(os.path.join(gtfs_dir, 'calendar.txt'))
+        dates_file = os.path.join(gtfs_dir, 'calendar_dates.txt')
+        calendar_dates = pd.read_csv(dates_file) if os.path.exists(dates_file) else None
+        return cls(calendar, calendar_dates)
+
+    def day_index(self, date):
+        # Position of the date in the bitsets, -1 if the date is outside of the feed
+        day = (to_date(date) - self.first_date).days
+        return day if 0 <= day < self.n_days else -1
+
+    def dates(self):
+        return [self.first_date + datetime.timedelta(days=d) for d in range(self.n_days)]
+
+    def service_bits(self, date):
+        # Boolean array over self.service_ids: True if the service runs on the date
+        day = self.day_index(date)
+        if day < 0:
+            return np.zeros(len(self.service_ids), dtype=bool)
+        return ((self.bits[:, day >> 3] >> (7 - (day & 7))) & 1).astype(bool)
+
+    def active_services(self, date):
+        return self.service_ids[self.service_bits(date)].to_numpy()
+
+    def service_codes(self, service_ids):
+        # Position of every service_id in the bitsets (-1 if unknown); compute once per table
+        return self.service_ids.get_indexer(pd.Index(service_ids))
+
+    def service_mask(self, service_ids, date, codes=None):
+        # Boolean mask over the rows: True if the service of the row runs on the date.
+        # Pass the output of service_codes() as codes to reuse it across dates.
+        if codes is None:
+            codes = self.service_codes(service_ids)
+        running = np.r_[self.service_bits(date), False]  # code -1 maps to False
+        return running[codes]
+
+    def day_masks(self, service_ids, dates=None):
+        # Boolean matrix (dates x rows) with the mask of every date, e.g. of every trip
+        codes = self.service_codes(service_ids)
+        dates = self.dates() if dates is None else dates
+        return np.vstack([self.service_mask(None, date, codes=codes) for date in dates]) if len(dates) \
+            else np.zeros((0, len(codes)), dtype=bool)
@@ -0,0 +1,282 @@
+import os
+import sys
+import json
+import time
+import socket
+import sqlite3
+import subprocess
+import pandas as pd
+from .schema import read_table
+
+"""
+Purpose:
+    Split a routing_template.py run over several processes or machines.
+
+    A shard is a block of origins x a block of time slots. The manifest
+    (<shard_dir>/manifest.json) lists the shards and the parameters of the run, and a
+    SQLite job table (<shard_dir>/jobs.db) on the shared storage records which worker
+    claimed which shard. A worker claims the next pending shard in a write transaction
+    (BEGIN IMMEDIATE), so two workers never get the same shard, computes the routes and
+    best routes of its origins and slots, writes them to <shard_dir>/parts/ and marks the
+    shard done. A shard whose worker died is claimed again once its lease has expired,
+    and a shard that raised an error is tried again (three attempts in total).
+
+    The routes of an origin do not depend on the slot, so they are written by the first
+    slot block of every origin block only. Splitting the slots recomputes the routes of
+    the origin block in every slot block; it pays off when the best routes dominate.
+
+    merge_shards() checks that every shard is done, that every shard wrote the same outputs
+    (e.g. best_routes_wheelchair in all of them or in none), that every part has the number of
+    rows recorded by its worker and only contains the origins and slots of its shard,
+    and concatenates the parts into routes.csv and best_routes.csv in the order of an
+    unsharded run.
+
+    SQLite locking needs a file system with working POSIX locks (local disks, most
+    NFSv4 mounts); the job table is only touched for a few milliseconds per shard.
+
+Usage:
+    cd project/
+    python routing_template.py --experiment_id BNMC --shard manifest --origins_per_shard 20 --slots_per_shard 17
+    python routing_template.py --experiment_id BNMC --shard work        (on every node, as many times as wanted)
+    python routing_template.py --experiment_id BNMC --shard merge
+    python routing_template.py --experiment_id BNMC --shard local --workers 4   (all three on this machine)
+"""
+
+# Parameters that change the outputs: every worker must run with the same values
+RUN_PARAMS = ['day_of_week', 'date', 'walk_speed', 'time_inc', 'region', 'prune_routes', 'frontier',
+              'walking_graph', 'walking_cutoff', 'wheelchair', 'unknown_accessible']
+
+
+def make_shards(origin_ids, times, origins_per_shard, slots_per_shard=None):
+    # Blocks of origins x blocks of time slots, origin major (the order of an unsharded run)
+    origin_ids, times = list(origin_ids), list(times)
+    slots_per_shard = slots_per_shard or len(times) or 1
+    shards = []
+    for i in range(0, len(origin_ids), origins_per_shard):
+        for j in range(0, len(times), slots_per_shard):
+            shards.append({'shard_id': len(shards), 'origin_ids': origin_ids[i:i + origins_per_shard],
+                           'times': times[j:j + slots_per_shard], 'first_slot_block': j == 0})
+    return shards
+
+
+def write_manifest(shard_dir, origin_ids, times, params, origins_per_shard=50, slots_per_shard=None,
+                   overwrite=False):
+    """
+    Write manifest.json and create the job table with one pending job per shard.
+    An existing manifest is kept if it was made with the same parameters (so the manifest
+    step can be run by every node); with different parameters, overwrite=True replaces it.
+    """
+    manifest_path = os.path.join(shard_dir, 'manifest.json')
+    run_params = {k: params.get(k) for k in RUN_PARAMS}
+    manifest = {'params': run_params,
+                'shards': make_shards([int(o) for o in origin_ids], [int(t) for t in times],
+                                      origins_per_shard, slots_per_shard)}
+    if os.path.exists(manifest_path) and not overwrite:
+        existing = read_manifest(shard_dir)
+        if existing['params'] != run_params or existing['shards'] != manifest['shards']:
+            raise ValueError(f"{manifest_path} was made with other parameters: remove {shard_dir} or use another one")
+        return existing
+
+    os.makedirs(os.path.join(shard_dir, 'parts'), exist_ok=True)
+    for file_name in os.listdir(os.path.join(shard_dir, 'parts')):
+        os.remove(os.path.join(shard_dir, 'parts', file_name))
+    with JobTable(os.path.join(shard_dir, 'jobs.db')) as jobs:
+        jobs.reset([shard['shard_id'] for shard in manifest['shards']])
+    tmp_path = manifest_path + '.tmp'
+    with open(tmp_path, 'w') as json_file:
+        json.dump(manifest, json_file, indent=4)
+    os.replace(tmp_path, manifest_path)
+    print(f"Wrote {len(manifest['shards'])} shards to {manifest_path}")
+    return manifest
+
+
+def read_manifest(shard_dir):
+    with open(os.path.join(shard_dir, 'manifest.json')) as json_file:
+        return json.load(json_file)
+
+
+class JobTable:
+    """
+    The SQLite table of the shards: status 'pending', 'running', 'done' or 'failed',
+    the worker that claimed it, when, and the number of rows of every part it wrote.
+    """
+    def __init__(self, db_path, timeout=60):
+        self.connection = sqlite3.connect(db_path, timeout=timeout, isolation_level=None)
+        self.connection.execute("""CREATE TABLE IF NOT EXISTS jobs (
+            shard_id INTEGER PRIMARY KEY, status TEXT NOT NULL, worker TEXT, claimed_at REAL,
+            finished_at REAL, attempts INTEGER NOT NULL DEFAULT 0, parts TEXT, error TEXT)""")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.connection.close()
+
+    def transaction(self, statements):
+        # Run (sql, parameters) pairs in one write transaction and return the rows of the last one
+        cursor = self.connection.cursor()
+        cursor.execute('BEGIN IMMEDIATE')
+        try:
+            for sql, parameters in statements:
+                rows = cursor.execute(sql, parameters).fetchall()
+            cursor.execute('COMMIT')
+        except BaseException:
+            cursor.execute('ROLLBACK')
+            raise
+        return rows
+
+    def reset(self, shard_ids):
+        self.transaction([('DELETE FROM jobs', ())] +
+                         [("INSERT INTO jobs (shard_id, status) VALUES (?, 'pending')", (i,)) for i in shard_ids])
+
+    def claim(self, worker, lease=3600, max_attempts=3):
+        """
+        Return the id of the next pending shard (or of a shard whose lease expired, or that
+        failed less than max_attempts times) after marking it as running for the worker,
+        or None if no shard is left.
+        """
+        now = time.time()
+        cursor = self.connection.cursor()
+        cursor.execute('BEGIN IMMEDIATE')
+        try:
+            row = cursor.execute("""SELECT shard_id FROM jobs WHERE status = 'pending'
+                                    OR (status = 'running' AND claimed_at < ?)
+                                    OR (status = 'failed' AND attempts < ?) ORDER BY shard_id LIMIT 1""",
+                                 (now - lease, max_attempts)).fetchone()
+            if row is not None:
+                cursor.execute("""UPDATE jobs SET status = 'running', worker = ?, claimed_at = ?,
+                                  attempts = attempts + 1, error = NULL WHERE shard_id = ?""", (worker, now, row[0]))
+            cursor.execute('COMMIT')
+        except BaseException:
+            cursor.execute('ROLLBACK')
+            raise
+        return None if row is None else row[0]
+
+    def finish(self, shard_id, worker, parts):
+        # parts: number of rows of every part written for the shard
+        self.transaction([("""UPDATE jobs SET status = 'done', finished_at = ?, parts = ?
+                              WHERE shard_id = ? AND worker = ?""",
+                           (time.time(), json.dumps(parts), shard_id, worker))])
+
+    def fail(self, shard_id, worker, error):
+        self.transaction([("UPDATE jobs SET status = 'failed', error = ? WHERE shard_id = ? AND worker = ?",
+                           (error, shard_id, worker))])
+
+    def jobs(self):
+        rows = self.connection.execute('SELECT shard_id, status, worker, attempts, parts, error FROM jobs '
+                                       'ORDER BY shard_id').fetchall()
+        return pd.DataFrame(rows, columns=['shard_id', 'status', 'worker', 'attempts', 'parts', 'error'])
+
+
+def part_path(shard_dir, name, shard_id):
+    return os.path.join(shard_dir, 'parts', f"{name}_{shard_id:05d}.csv")
+
+
+def run_worker(shard_dir, compute_shard, params, worker=None, lease=3600):
+    """
+    Claim and compute shards until none is left.
+
+    compute_shard(shard) returns a dictionary {name: pd.DataFrame} of the outputs of the
+    shard (e.g. 'routes', 'best_routes'); every output is written to a temporary file and
+    renamed, so a part is either complete or missing.
+    Returns the ids of the shards computed by this worker.
+    """
+    worker = worker or f"{socket.gethostname()}-{os.getpid()}"
+    manifest = read_manifest(shard_dir)
+    mismatched = {k: (manifest['params'].get(k), params.get(k)) for k in RUN_PARAMS
+                  if manifest['params'].get(k) != params.get(k)}
+    if mismatched:
+        raise ValueError(f"Worker parameters differ from the manifest (manifest, worker): {mismatched}")
+    shards = {shard['shard_id']: shard for shard in manifest['shards']}
+
+    done = []
+    with JobTable(os.path.join(shard_dir, 'jobs.db')) as jobs:
+        while True:
+            shard_id = jobs.claim(worker, lease=lease)
+            if shard_id is None:
+                break
+            start = time.time()
+            try:
+                outputs = compute_shard(shards[shard_id])
+                parts = {}
+                for name, table in outputs.items():
+                    path = part_path(shard_dir, name, shard_id)
+                    table.to_csv(path + f".{worker}.tmp", index=False)
+                    os.replace(path + f".{worker}.tmp", path)
+                    parts[name] = len(table)
+            except Exception as e:
+                jobs.fail(shard_id, worker, repr(e))
+                print(f"[{worker}] shard {shard_id} failed: {e!r}")
+                continue
+            jobs.finish(shard_id, worker, parts)
+            done.append(shard_id)
+            print(f"[{worker}] shard {shard_id} done in {time.time() - start:.1f}s ({parts})")
+    return done
+
+
+def check_part(part, shard, name):
+    # The rows of a part must belong to the origins (and slots) of its shard
+    if 'origin_id' in part.columns and not part['origin_id'].isin(shard['origin_ids']).all():
+        raise ValueError(f"{name} of shard {shard['shard_id']} has rows of other origins")
+    if name != 'routes' and 'time' in part.columns and not part['time'].isin(shard['times']).all():
+        raise ValueError(f"{name} of shard {shard['shard_id']} has rows of other time slots")
+
+
+def merge_shards(shard_dir, output_dir):
+    """
+    Verify the parts of all the shards and concatenate them into <output_dir>/<name>.csv.
+    Returns the merged tables.
+    """
+    manifest = read_manifest(shard_dir)
+    with JobTable(os.path.join(shard_dir, 'jobs.db')) as jobs:
+        table = jobs.jobs()
+    not_done = table[table['status'] != 'done']
+    if len(not_done):
+        raise RuntimeError(f"{len(not_done)} of {len(table)} shards are not done:\n{not_done.to_string(index=False)}")
+    rows_of = {shard_id: json.loads(parts) for shard_id, parts in zip(table['shard_id'], table['parts'])}
+    # Every shard writes the same outputs (routes only in the first slot block of its origins)
+    names = {name for parts in rows_of.values() for name in parts}
+    for shard in manifest['shards']:
+        expected = names if shard['first_slot_block'] else names - {'routes'}
+        if set(rows_of[shard['shard_id']]) != expected:
+            raise ValueError(f"Shard {shard['shard_id']} wrote {sorted(rows_of[shard['shard_id']])}, "
+                             f"expected {sorted(expected)}: were the workers started with different arguments?")
+
+    pieces = {}
+    for shard in manifest['shards']:
+        for name, rows in rows_of[shard['shard_id']].items():
+            part = read_table(part_path(shard_dir, name, shard['shard_id']),
+                              'routes' if name == 'routes' else 'best_routes')
+            if len(part) != rows:
+                raise ValueError(f"{name} of shard {shard['shard_id']} has {len(part)} rows, {rows} were written")
+            check_part(part, shard, name)
+            pieces.setdefault(name, []).append(part)
+
+    merged = {}
+    for name, parts in pieces.items():
+        df = pd.concat(parts, ignore_index=True)
+        if 'time' in df.columns and name != 'routes':
+            # Unsharded order: preference blocks (in order of appearance), then time, origin, destination
+            keys = (['preference'] if 'preference' in df.columns else []) + ['time', 'origin_id', 'destination_id']
+            if 'preference' in df.columns:
+                df['preference'] = pd.Categorical(df['preference'], categories=df['preference'].unique())
+            df = df.sort_values(by=keys, kind='mergesort').reset_index(drop=True)
+            if 'preference' in df.columns:
+                df['preference'] = df['preference'].astype(str)
+        df.to_csv(os.path.join(output_dir, f"{name}.csv"), index=False)
+        merged[name] = df
+        print(f"Merged {len(parts)} parts into {os.path.join(output_dir, name + '.csv')} ({len(df)} rows)")
+    return merged
+
+
+def launch_local(command, workers=2):
+    """
+    Start workers processes running command (a list of arguments, e.g. routing_template.py
+    with --shard work) on this machine and wait for them. Returns their exit codes.
+    """
+    processes = [subprocess.Popen([sys.executable] + command + ['--worker_id', f"local-{i}"])
+                 for i in range(workers)]
+    return [process.wait() for process in processes]
@@ -0,0 +1,179 @@
+import argparse
+import numpy as np
+import pandas as pd
+from .use_preferences import route_frontier, preference_from_frontier
+from .schema import read_table
+
+"""
+Purpose:
+    Sensitivity studies over walk_speed, beta and max_walk in one run.
+
+    The walking times are computed with routeType='manhattan', so they are
+    distance / walk_speed. The candidate stop pairs (total walk <= direct walk) do not
+    depend on the speed, and neither do the bus legs, so the walking distances and
+    the (OD pair, stop pair, trip) table are built once. For every walk_speed the
+    times are a cheap transform of that table and the Pareto frontier of every
+    (OD pair, slot) is computed once (see use_preferences.route_frontier).
+
+    max_walk (seconds of walking per route) is a filter on the frontier: the best route
+    among the routes walking at most max_walk is always on the unfiltered frontier.
+    beta only enters the impedance exp(-(t/60)^2/beta), so all betas are evaluated at
+    once as an extra array dimension.
+
+Output:
+    A tidy dataframe (the results cube) with one row per
+    (walk_speed, max_walk, beta, preference, origin_id) and the columns
+        'reachable': fraction of the destinations reached in at least one slot
+        'time_score': mean total_time_score over all (destination, slot), 0 if unreachable
+        'walking_score': mean walking_score over all (destination, slot), 0 if unreachable
+
+Usage:
+    cd project/
+    python -m code.sweeps --experiment_id BNMC --walk_speeds 1.0 1.2 1.4 --betas 70 140 280 --max_walks 600 1200 inf
+    (the walking_*.csv files of routing_template.py must be in the experiment folder)
+"""
+
+
+def candidate_table(location_to_stops):
+    '''
+    All (origin, destination, pick up stop, drop off stop) candidates of candidate_bus_pairs(),
+    in meters, for every OD pair at once. A stop pair is a candidate if its total walk is not
+    longer than the direct walk, which does not depend on the walking speed.
+    '''
+    df_origin = location_to_stops['origin'][['id', 'stop_id', 'distance']].rename(
+        columns={'id': 'origin_id', 'stop_id': 'start_stop_id', 'distance': 'walk_to_start'})
+    df_destination = location_to_stops['destination'][['id', 'stop_id', 'distance']].rename(
+        columns={'id': 'destination_id', 'stop_id': 'end_stop_id', 'distance': 'walk_to_destination'})
+    df_od = location_to_stops['origin2destination'][['origin_id', 'destination_id', 'distance']].rename(
+        columns={'distance': 'direct_walk'})
+
+    candidates = []
+    # One origin at a time to bound the size of the cross join
+    for origin_id, od in df_od.groupby('origin_id', sort=False):
+        pairs = od.merge(df_origin[df_origin['origin_id'] == origin_id], on='origin_id')
+        pairs = pairs.merge(df_destination, on='destination_id')
+        keep = (pairs['walk_to_start'] + pairs['walk_to_destination'] <= pairs['direct_walk']) \
+            & (pairs['start_stop_id'] != pairs['end_stop_id'])
+        candidates.append(pairs[keep])
+    return pd.concat(candidates, ignore_index=True) if candidates else pd.DataFrame()
+
+
+def route_table(candidates, legs, location_to_stops):
+    '''
+    Join the candidates with the bus legs (precompute.bus_legs()) and add the direct walk of every
+    OD pair: the routes of find_routes() with distances instead of times.
+    '''
+    bus = candidates.merge(legs[['trip_id', 'pick_up_id', 'pick_up_time', 'drop_off_id', 'drop_off_time']],
+                           left_on=['start_stop_id', 'end_stop_id'], right_on=['pick_up_id', 'drop_off_id'])
+    bus = bus.drop(columns=['pick_up_id', 'drop_off_id', 'direct_walk']).rename(
+        columns={'pick_up_time': 'bus_start_time', 'drop_off_time': 'bus_end_time'})
+    bus['total_walk'] = bus['walk_to_start'] + bus['walk_to_destination']
+    bus['bus_used'] = 1
+
+    walk = location_to_stops['origin2destination'][['origin_id', 'destination_id', 'distance']].rename(
+        columns={'distance': 'total_walk'})
+    walk = walk.assign(walk_to_start=walk['total_walk'], walk_to_destination=0.0, bus_used=0)
+    return pd.concat([bus, walk], ignore_index=True)
+
+
+def routes_at_speed(routes, walk_speed):
+    '''
+    The times of the routes of route_table() for a walking speed (m/s), with the columns of find_routes()
+    '''
+    routes = routes.copy()
+    routes['walk_to_start_time'] = routes['walk_to_start'] / walk_speed
+    routes['walk_to_destination_time'] = routes['walk_to_destination'] / walk_speed
+    routes['total_walk_time'] = routes['total_walk'] / walk_speed
+    routes['bus_riding_time'] = routes['bus_end_time'] - routes['bus_start_time']
+    # Walking only routes have no bus riding time
+    routes['total_time'] = routes['bus_riding_time'].fillna(0) + routes['total_walk_time']
+    routes['start_time'] = routes['bus_start_time'] - routes['walk_to_start_time']
+    routes['end_time'] = routes['bus_end_time'] + routes['walk_to_destination_time']
+    return routes
+
+
+def sweep(location_to_stops, legs, times, walk_speeds=(1.4,), betas=(140,), max_walks=(np.inf,),
+          preferences=('min_time', 'min_walk'), window=3600):
+    '''
+    Evaluate the grid walk_speeds x max_walks x betas x preferences.
+
+    Parameters
+    ----------
+    location_to_stops: dict
+        output of get_walking_df() in routing_template.py (only the distances are used)
+    legs: pd.DataFrame
+        bus legs with trip_id, pick_up_id, pick_up_time, drop_off_id, drop_off_time (precompute.bus_legs())
+    times: iterable of int
+        start of the time slots (seconds)
+
+    Returns
+    -------
+    cube: pd.DataFrame
+        the tidy results cube described at the top of this file
+    '''
+    routes = route_table(candidate_table(location_to_stops), legs, location_to_stops)
+    origin_ids = location_to_stops['origin2destination']['origin_id'].unique()
+    n_destinations = location_to_stops['origin2destination']['destination_id'].nunique()
+    n_cells = n_destinations * len(list(times))
+    betas = np.asarray(betas, dtype=float)
+
+    cube = []
+    for walk_speed in walk_speeds:
+        frontier = route_frontier(routes_at_speed(routes, walk_speed), times, window=window)
+        for max_walk in max_walks:
+            feasible = frontier[frontier['total_walk_time'] <= max_walk]
+            for preference in preferences:
+                best = preference_from_frontier(feasible, preference=preference)
+                # Impedance of every route for every beta: (routes x betas)
+                time_scores = np.exp(-((best['total_time'].to_numpy(dtype=float)[:, None] / 60) ** 2) / betas)
+                walking_scores = np.exp(-((best['total_walk_time'].to_numpy(dtype=float)[:, None] / 60) ** 2) / betas)
+                origin = best['origin_id'].to_numpy()
+                time_sum = pd.DataFrame(time_scores).groupby(origin).sum().reindex(origin_ids, fill_value=0.0)
+                walking_sum = pd.DataFrame(walking_scores).groupby(origin).sum().reindex(origin_ids, fill_value=0.0)
+                reachable = best.groupby('origin_id')['destination_id'].nunique() \
+                    .reindex(origin_ids, fill_value=0) / n_destinations
+
+                cube.append(pd.DataFrame({
+                    'walk_speed': walk_speed,
+                    'max_walk': max_walk,
+                    'beta': np.repeat(betas, len(origin_ids)),
+                    'preference': preference,
+                    'origin_id': np.tile(origin_ids, len(betas)),
+                    'reachable': np.tile(reachable.to_numpy(), len(betas)),
+                    'time_score': time_sum.to_numpy().T.ravel() / n_cells,
+                    'walking_score': walking_sum.to_numpy().T.ravel() / n_cells,
+                }))
+    return pd.concat(cube, ignore_index=True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Accessibility scores for a grid of walk_speed, beta and max_walk.')
+    parser.add_argument('--experiment_id', default='test', help='Unique identifier for the experiment.')
+    parser.add_argument('--walk_speeds', type=float, nargs='+', default=[1.4], help='Walking speeds (m/s).')
+    parser.add_argument('--betas', type=float, nargs='+', default=[140], help='Impedance parameters beta.')
+    parser.add_argument('--max_walks', type=float, nargs='+', default=[np.inf],
+                        help='Maximum walking time of a route (seconds), "inf" for no limit.')
+    parser.add_argument('--time_inc', type=float, default=15 * 60, help='The time increment. Default is 900s (15 min).')
+    parser.add_argument('--date', default=None, help='Only use the trips running on this date, e.g. 2024-01-15.')
+    parser.add_argument('--region', default='BNMC', help='Region whose stops are used. Default is BNMC.')
+    args = parser.parse_args()
+
+    from .precompute import bus_legs
+    from .service_calendar import ServiceCalendar
+    from .accessibility.regions import getRegionStops
+
+    directory = f"experiments/{args.experiment_id}/"
+    location_to_stops = {
+        'origin': read_table(directory + 'walking_origins_to_stops.csv', 'walking'),
+        'destination': read_table(directory + 'walking_destinations_to_stops.csv', 'walking'),
+        'origin2destination': read_table(directory + 'walking_origins_to_destinations.csv', 'origin2destination'),
+    }
+    legs = bus_legs(stop_ids=getRegionStops(args.region)['stop_id'].unique())
+    if args.date is not None:
+        legs = legs[ServiceCalendar.from_gtfs('data/google_transit').service_mask(legs['service_id'], args.date)]
+
+    times = range(60 * 60 * 5, 60 * 60 * 22, int(args.time_inc))  # 5am to 10pm
+    cube = sweep(location_to_stops, legs, times, walk_speeds=args.walk_speeds, betas=args.betas,
+                 max_walks=args.max_walks)
+    cube.to_csv(directory + 'sweep.csv', index=False)
+    print(cube.groupby(['walk_speed', 'max_walk', 'beta', 'preference'])[['reachable', 'time_score']].mean())
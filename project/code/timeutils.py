@@ -0,0 +1,63 @@
+import numpy as np
+import pandas as pd
+
+"""
+Purpose:
+    One representation of time for the whole project: integer seconds after midnight
+    (np.int32). These helpers convert the different string formats found in the data
+    to seconds and back, for whole columns at once.
+
+    Accepted strings:
+        "HH:MM:SS"           e.g. "08:31:26", also GTFS times past midnight like "25:10:00"
+        "H:MM:SS"            e.g. "8:31:26"
+        "D days HH:MM:SS"    e.g. "0 days 08:31:26" (pandas timedelta strings in routes_data.csv)
+    Numbers are assumed to already be seconds.
+    Missing or unparsable values become MISSING (-1).
+"""
+
+MISSING = -1
+
+_TIME_PATTERN = r'^\s*(?:(\d+)\s+days?,?\s+)?(\d+):(\d{1,2}):(\d{1,2})(?:\.\d*)?\s*$'
+
+
+def hms_to_seconds(times, missing=MISSING):
+    """
+    Convert a time string, or a column/array/list of them, to integer seconds.
+    A single string returns an int; anything else returns an np.int32 array.
+    """
+    if isinstance(times, str):
+        return int(hms_to_seconds([times], missing=missing)[0])
+
+    times = pd.Series(times, copy=False)
+    if pd.api.types.is_numeric_dtype(times.dtype):
+        return times.fillna(missing).to_numpy().astype(np.int32)
+
+    parts = times.astype('string').str.extract(_TIME_PATTERN)
+    parts = parts.apply(pd.to_numeric, errors='coerce')
+    days = parts[0].fillna(0)
+    seconds = ((days * 24 + parts[1]) * 60 + parts[2]) * 60 + parts[3]
+    return seconds.fillna(missing).to_numpy().astype(np.int32)
+
+
+def seconds_to_hms(seconds):
+    """
+    Convert seconds to HH:MM:SS format.
+    A single number returns a string; anything else returns an array of strings.
+    Hours are not wrapped, so 90000 is "25:00:00" like in GTFS.
+    """
+    if np.isscalar(seconds):
+        seconds = int(seconds)
+        return f"{seconds // 3600:02}:{(seconds % 3600) // 60:02}:{seconds % 60:02}"
+
+    seconds = np.asarray(seconds).astype(np.int64)
+    hours = pd.Series(seconds // 3600).astype(str).str.zfill(2)
+    minutes = pd.Series((seconds % 3600) // 60).astype(str).str.zfill(2)
+    secs = pd.Series(seconds % 60).astype(str).str.zfill(2)
+    return (hours + ':' + minutes + ':' + secs).to_numpy()
+
+
+def seconds_to_minutes(seconds):
+    """
+    Convert integer seconds to (float) minutes, e.g. for the time impedance function.
+    """
+    return np.asarray(seconds, dtype=np.float64) / 60
@@ -1,5 +1,7 @@
 import pandas as pd
 import numpy as np
+from .pruning import pareto_mask
+from .timeutils import seconds_to_hms
 
 #* valid preference values: 'min_time' (default) or 'min_walk'
 #* beta (default 140) is a tuning parameter bounded between 0 and 1. 
@@ -11,16 +13,7 @@ import numpy as np
 #* origin_id and destination_id: must be present in all_routes dataframe
 #* all_routes: dataframe. output from find_all_routes.py
 
-# support function
-
-def seconds_to_hms(seconds):
-    """
-    to convert seconds to HH:MM:SS format
-    """
-    hours = int(seconds // 3600)
-    minutes =int((seconds % 3600) // 60)
-    seconds = int(seconds % 60)
-    return f"{hours:02}:{minutes:02}:{seconds:02}"
+# support function: seconds_to_hms (to convert seconds to HH:MM:SS format) lives in timeutils.py
 
     #time impedance function - will be used in part for accessibility measure
     #total_time_score is the value of the exponential time impedance function for total trip time (walking to/from buses + bus riding time)
@@ -57,4 +50,87 @@ def route_preferences(all_routes, time, origin_id, destination_id, preference='m
     
     # TODO: for now, we have two preferences... will be expanded
     else:
-        return "Invalid preference... please provide 'min_time' or 'min_walk'"
\ No newline at end of file
+        return "Invalid preference... please provide 'min_time' or 'min_walk'"
+
+# Pareto frontier of the routes of every OD pair and time slot.
+# A route is on the frontier if no other feasible route of the same OD pair and slot
+# is at least as good on total_time, total_walk_time and bus_used (and better on one).
+# total_time_score and walking_score decrease with time, so the best route for
+# 'min_time', 'min_walk' or any positively weighted sum of the scores is always
+# on the frontier and can be answered without rescanning all routes.
+
+def route_frontier(all_routes, times, beta=140, window=3600):
+    # Columns that identify an OD pair
+    od_cols = ['origin_id', 'destination_id']
+    times = np.asarray(sorted(times), dtype=float)
+    routes = all_routes.reset_index(drop=True)
+    od_codes = routes.groupby(od_cols, sort=False).ngroup().to_numpy()
+    is_bus = (routes['bus_used'] != 0).to_numpy()
+
+    # Bus routes: for every (OD, slot), the feasible rows are a contiguous run of the rows
+    # sorted by (OD, start_time) that is found with two binary searches, then filtered on end_time
+    bus_rows = np.flatnonzero(is_bus)
+    start = routes['start_time'].to_numpy(dtype=float)[bus_rows]
+    span = max(np.nanmax(start) if len(start) else 0.0, times.max() if len(times) else 0.0) + 2 * window + 1
+    key = od_codes[bus_rows] * span + start
+    order = np.argsort(key, kind='mergesort')
+    bus_rows, key = bus_rows[order], key[order]
+
+    n_od = od_codes.max() + 1 if len(od_codes) else 0
+    query_od = np.repeat(np.arange(n_od), len(times))
+    query_time = np.tile(times, n_od)
+    lo = np.searchsorted(key, query_od * span + query_time, side='left')
+    hi = np.searchsorted(key, query_od * span + query_time + window, side='right')
+    counts = hi - lo
+    slot_of_pair = np.repeat(query_time, counts)
+    row_of_pair = bus_rows[np.repeat(lo, counts) + np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)]
+    fits = routes['end_time'].to_numpy(dtype=float)[row_of_pair] <= slot_of_pair + window
+    pairs = routes.iloc[row_of_pair[fits]].copy()
+    pairs['time'] = slot_of_pair[fits]
+
+    # Walking routes are available at every slot, starting at the slot time
+    walks = routes[~is_bus]
+    walks = walks[walks['total_time'] <= window]
+    walks = walks.loc[walks.index.repeat(len(times))].copy()
+    walks['time'] = np.tile(times, len(walks) // len(times) if len(times) else 0)
+    walks['start_time'] = walks['time']
+    walks['end_time'] = walks['time'] + walks['total_time']
+
+    candidates = pd.concat([pairs, walks], ignore_index=True)
+    group = candidates.groupby(od_cols + ['time'], sort=False).ngroup().to_numpy()
+    # pareto_mask keeps the latest 'start', earliest 'end' and least 'walk', so the
+    # total_time is negated to minimize all three criteria
+    keep = pareto_mask(-candidates['total_time'].to_numpy(dtype=float),
+                       candidates['total_walk_time'].to_numpy(dtype=float),
+                       candidates['bus_used'].to_numpy(dtype=float),
+                       group)
+    frontier = candidates[keep].copy()
+
+    # Time impedance function
+    frontier['total_time_score'] = np.exp(-((frontier['total_time'] / 60) ** 2) / beta)
+    frontier['walking_score'] = np.exp(-((frontier['total_walk_time'] / 60) ** 2) / beta)
+    frontier['time'] = frontier['time'].astype(int)
+    return frontier.sort_values(by=['time'] + od_cols, kind='mergesort').reset_index(drop=True)
+
+
+# Answer a preference for every OD pair and slot from the frontier.
+# preference: 'min_time', 'min_walk' or 'weighted'; for 'weighted', the route with the
+# largest weights['total_time_score'] * total_time_score + weights['walking_score'] * walking_score
+# is returned (the weights must not be negative).
+def preference_from_frontier(frontier, preference='min_time', weights=None):
+    keys = ['time', 'origin_id', 'destination_id']
+    if preference == 'min_time':
+        objective = frontier['total_time']
+    elif preference == 'min_walk':
+        objective = frontier['total_walk_time']
+    elif preference == 'weighted':
+        if weights is None:
+            weights = {'total_time_score': 0.5, 'walking_score': 0.5}
+        objective = -sum(weight * frontier[col] for col, weight in weights.items())
+    else:
+        return "Invalid preference... please provide 'min_time', 'min_walk' or 'weighted'"
+
+    best_idx = objective.groupby([frontier[k] for k in keys], sort=False).idxmin()
+    best = frontier.loc[best_idx.to_numpy()].copy()
+    best['preference'] = preference
+    return best.sort_values(by=keys, kind='mergesort').reset_index(drop=True)
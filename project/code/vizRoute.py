@@ -10,15 +10,15 @@ import pandas as pd
 import time
 import sys
 import numpy as np
-import veroviz as vrv
-import matplotlib.pyplot as plt
 #Functions
-from use_preferences import route_preferences
 from accessibility.utils import getDirectory, getResults, checkPreference, getExperimentOD, \
     getAPIKey
-from accessibility.neighborhoods import getNeighborhoods, createMapNeighborhoods
-#GET API Key
-ORS_API_KEY = getAPIKey()
+from accessibility.neighborhoods import createMapNeighborhoods
+from accessibility.regions import getRegion
+from accessibility.client import RoutingClient
+from accessibility.lazy import lazyImport
+vrv = lazyImport('veroviz')
+plt = lazyImport('matplotlib.pyplot')
 
 def getData():
     '''
@@ -30,12 +30,11 @@ def getData():
     trips_df = pd.read_csv(f"data/google_transit/trips.txt")
     return stops_df, shapes_df, trips_df
 
-def creatMapObj(origin_id: int, destination_id: int, mode: str, time: int):
+def creatMapObj(origin_id: int, destination_id: int, mode: str, time: int, region: str = 'BNMC'):
     '''
     Use existing code to create a map oject
     '''
-    neighborhoods = getNeighborhoods(url  = "https://raw.githubusercontent.com/IE-670/bnmc/data/neighborhoods.json", 
-                                    file = f"data/neighborhoods.json")
+    neighborhoods = getRegion(region)
     nbhdMapObject = createMapNeighborhoods(neighborhoods, mapObject=None, addLabel=False)
 
     map_name = "route-"+ str(origin_id) + "-" + str(destination_id) + "-" + mode + str(time) + ".html"
@@ -74,7 +73,7 @@ def showWalking(routeMap, start: list, start_name: str, start_icon: str, end: li
                     routeType        = 'pedestrian',
                     leafletColor     = 'black',
                     dataProvider     = 'ORS-online',
-                    dataProviderArgs = {'APIkey': ORS_API_KEY})
+                    dataProviderArgs = {'APIkey': getAPIKey()})
     assignmentsDF = pd.concat([assignmentsDF, shapepointsDF], ignore_index=True, sort=False)
 
     #add to map
@@ -233,7 +232,7 @@ def showBus(routeMap, bus_start: list, bus_end: list, route_shape):
                         routeType        = 'fastest',
                         leafletColor     = 'black',
                         dataProvider     = 'ORS-online',
-                        dataProviderArgs = {'APIkey': ORS_API_KEY})
+                        dataProviderArgs = {'APIkey': getAPIKey()})
         assignmentsDF = pd.concat([assignmentsDF, shapepointsDF], ignore_index=True, sort=False)
 
         if len(route_shape)>1:
@@ -246,7 +245,7 @@ def showBus(routeMap, bus_start: list, bus_end: list, route_shape):
                                 routeType        = 'fastest',
                                 leafletColor     = 'black',
                                 dataProvider     = 'ORS-online',
-                                dataProviderArgs = {'APIkey': ORS_API_KEY})
+                                dataProviderArgs = {'APIkey': getAPIKey()})
                     assignmentsDF = pd.concat([assignmentsDF, shapepointsDF], ignore_index=True, sort=False)
 
         #Add last arc from the last shape point to bus_stop_end
@@ -256,7 +255,7 @@ def showBus(routeMap, bus_start: list, bus_end: list, route_shape):
                 routeType        = 'fastest',
                 leafletColor     = 'black',
                 dataProvider     = 'ORS-online',
-                dataProviderArgs = {'APIkey': ORS_API_KEY})
+                dataProviderArgs = {'APIkey': getAPIKey()})
         assignmentsDF = pd.concat([assignmentsDF, shapepointsDF], ignore_index=True, sort=False)
     
     else:
@@ -267,7 +266,7 @@ def showBus(routeMap, bus_start: list, bus_end: list, route_shape):
                 routeType        = 'fastest',
                 leafletColor     = 'black',
                 dataProvider     = 'ORS-online',
-                dataProviderArgs = {'APIkey': ORS_API_KEY})
+                dataProviderArgs = {'APIkey': getAPIKey()})
         assignmentsDF = pd.concat([assignmentsDF, shapepointsDF], ignore_index=True, sort=False)
 
     nodesDF = vrv.initDataframe('nodes')
@@ -352,17 +351,23 @@ if __name__ == '__main__':
     parser.add_argument('--experiment_id', type=str, help='ID of the experiment')
     parser.add_argument('--preference', type=str, help='Preference for the experiment')
     parser.add_argument('--time_of_day', type=int, help='Time of Day in seconds')
+    parser.add_argument('--server_port', type=int, default=None,
+                        help='Ask the routing service (python -m code.service) on this port instead of reading results.csv')
     args = parser.parse_args()
 
     preference = checkPreference(args.preference)
     directory = getDirectory(args.experiment_id)
 
-    result = getResults(directory,args.origin_id,args.destination_id,args.time_of_day,args.preference)
+    if args.server_port is not None:
+        result = pd.Series(RoutingClient(port=args.server_port).bestRoute(args.origin_id, args.destination_id,
+                                                                          args.time_of_day, args.preference))
+    else:
+        result = getResults(directory,args.origin_id,args.destination_id,args.time_of_day,args.preference)
     
     origins, destinations = getExperimentOD(directory)
     origin = origins.loc[origins["name"] == args.origin_id]
     destination = destinations.loc[destinations["name"] == args.destination_id]
 
-    viewRoute(result, origin, destination, args.preferemce, args.time_of_day)
+    viewRoute(result, origin, destination, args.preference, args.time_of_day)
 
     
@@ -9,21 +9,38 @@ python3 routing_template.py --experiment_id BNMC
 You can change the experiment id from 'BNMC' to other ids as desired.
 There are other arguments you can specify as well, which can be
 found in the first few lines of the intialize() funciton.
+
+Sharded runs (see code/shards.py):
+python3 routing_template.py --experiment_id BNMC --shard manifest --origins_per_shard 20
+python3 routing_template.py --experiment_id BNMC --shard work     (on every node)
+python3 routing_template.py --experiment_id BNMC --shard merge
+python3 routing_template.py --experiment_id BNMC --shard local --workers 4
 """
 import pickle
 import json
 import argparse
 import os
+import sys
 import pandas as pd
 import numpy as np
-import veroviz as vrv
 from datetime import datetime
 from datetime import timedelta
+from code.precompute import pre_compute_bus_routes, wheelchair_mask
+from code.service_calendar import ServiceCalendar
 from code.candidate_routes import candidate_bus_pairs
 from code.find_all_routes import find_routes
-from code.use_preferences import route_preferences
-
-def get_walking_df(df, origins, destinations, filepath, overwrite=False):
+from code.use_preferences import route_frontier, preference_from_frontier
+from code.pruning import prune_routes
+from code.schema import compact, compact_walking, read_table
+from code.shards import write_manifest, run_worker, merge_shards, launch_local
+from code.preference_cache import PreferenceCache
+from code.scenarios import scoreDiff
+from code.catchments import get_catchments, point_to_point
+from code.accessibility.regions import getRegionStops, listRegions
+from code.accessibility.lazy import lazyImport
+vrv = lazyImport('veroviz')
+
+def get_walking_df(df, origins, destinations, filepath, overwrite=False, calendar=None):
     '''
     Compute the walking times and distances from:
         -origins to bus stops
@@ -37,6 +54,8 @@ def get_walking_df(df, origins, destinations, filepath, overwrite=False):
     destinations: pd.DataFrame
     filepath: str
         path to the experiment being run
+    calendar: ServiceCalendar
+        used to keep the stops served on input['date'], if a date is given
     
     Returns
     -------
@@ -88,8 +107,13 @@ def get_walking_df(df, origins, destinations, filepath, overwrite=False):
             and (location_to_stops['origin2destination'] is not None)):
         return location_to_stops
 
-    # Filter based on weekday or weekend
-    df = df[df["service_description"] == input['day_of_week']]
+    # Filter based on the date if one is given, otherwise on weekday or weekend
+    if input.get('date') is not None:
+        if calendar is None:
+            calendar = ServiceCalendar.from_gtfs('data/google_transit')
+        df = df[calendar.service_mask(df['service_id'], input['date'])]
+    else:
+        df = df[df["service_description"] == input['day_of_week']]
 
     # Only look at the bus stops.
     # In this dataframe, we only care about the bus stop location and ID.
@@ -97,6 +121,30 @@ def get_walking_df(df, origins, destinations, filepath, overwrite=False):
     # the VeroViz function.
     stops_full = df.drop_duplicates(subset='id', keep='first')
 
+    # Walking on the pedestrian network of a local OSM extract: the stop catchments are
+    # precomputed once (see catchments.py) and the walking times become lookups
+    if input.get('walking_graph') is not None:
+        graph, catchments = get_catchments(input['walking_graph'], getRegionStops(input['region']),
+                                           region=input['region'], cutoff=input['walking_cutoff'])
+        stop_locations = stops_full[['stop_id', 'lat', 'lon']]
+        for key, pois, file_path in [('origin', origins, origin_file_path),
+                                     ('destination', destinations, destination_file_path)]:
+            if location_to_stops[key] is None:
+                print(f"Looking up walking distances between the {key}s and the bus stops...")
+                table = catchments.lookup(graph, pois['lat'], pois['lon'], pois['name'], walk_speed=input['walk_speed'])
+                table = table.merge(stop_locations, on='stop_id')[['stop_id', 'id', 'lat', 'lon', 'time', 'distance']]
+                table.to_csv(file_path, index=False)
+                location_to_stops[key] = table
+        if location_to_stops['origin2destination'] is None:
+            print("Computing pairwise walking distances between origins and destinations..")
+            # The direct walk also bounds the walks through the stops (candidate_bus_pairs), so it is
+            # kept exact up to the longest walk through two catchments
+            cutoff = max(input['walk_speed'] * 3600, 2 * input['walking_cutoff'])
+            location_to_stops['origin2destination'] = point_to_point(graph, origins, destinations,
+                                                                     walk_speed=input['walk_speed'], cutoff=cutoff)
+            location_to_stops['origin2destination'].to_csv(walking_file_path, index=False)
+        return location_to_stops
+
     def walking_iterate_helper(stops_full, pois, file_path, rename_cols=False):
         full_df = pd.DataFrame()
 
@@ -210,12 +258,56 @@ def initialize():
     parser.add_argument('--experiment_id', default="test", help='Unique identifier for the experiment.')
     parser.add_argument('--day_of_week', default='Weekday', choices=['Weekday', 'Weekend'],
                         help='Day type: "Weekday" or "Weekend". Default is "Weekday".')
+    parser.add_argument('--date', default=None,
+                        help='Date of the experiment, e.g. 2024-01-15. Uses calendar.txt and calendar_dates.txt '
+                             '(holidays included) instead of --day_of_week. Default is None.')
     parser.add_argument('--walk_speed', type=float, default=1.4,
                         help='Walking speed in meters per second (m/s). Default is 1.4.')
     parser.add_argument('--overwrite_routes', type=bool, default=True,
                         help='If false, the routes will not be calculated again if they already exist. Default is True.')
     parser.add_argument('--time_inc', type=float, default=15 * 60,  # default = 15 min
                         help='The time increment when using route_preferences(). Default is 900s (15 min).')
+    parser.add_argument('--prune_routes', action='store_true',
+                        help='Only keep the Pareto-efficient trips of every stop pair and OD pair. '
+                             'This shrinks routes.csv without changing the best routes.')
+    parser.add_argument('--frontier', action='store_true',
+                        help='Compute the Pareto frontier of every OD pair and time slot in one pass and '
+                             'answer both min_time and min_walk from it.')
+    parser.add_argument('--wheelchair', action='store_true',
+                        help='Also compute the best routes using only wheelchair accessible stops and trips '
+                             '(wheelchair_boarding/wheelchair_accessible), and compare the scores.')
+    parser.add_argument('--unknown_accessible', action='store_true',
+                        help='With --wheelchair, stops and trips without accessibility information count as accessible.')
+    parser.add_argument('--walking_graph', default=None,
+                        help='Local OSM extract (.osm) used to walk on the pedestrian network instead of '
+                             'manhattan distances. Default is None.')
+    parser.add_argument('--walking_cutoff', type=float, default=1200,
+                        help='With --walking_graph, the maximum walking distance to a bus stop (meters). Default is 1200.')
+    parser.add_argument('--region', default='BNMC',
+                        help=f'Service area whose bus stops are used. Registered regions: {sorted(listRegions())}. '
+                             'A path to a boundary file in the format of data/neighborhoods.json also works. Default is BNMC.')
+
+    parser.add_argument('--preference_cache', default=None,
+                        help='SQLite file where the best route of every OD pair and slot is kept between runs '
+                             '(without --frontier). Default is None (in memory only).')
+    parser.add_argument('--shard', default=None, choices=['manifest', 'work', 'merge', 'local'],
+                        help='Sharded run: write the shard manifest, claim and compute shards until none is left, '
+                             'merge the parts into routes.csv and best_routes.csv, or all three with local worker '
+                             'processes. Default is None (no sharding).')
+    parser.add_argument('--shard_dir', default=None,
+                        help='Shared folder of the manifest, job table and parts. '
+                             'Default is experiments/<experiment_id>/shards.')
+    parser.add_argument('--origins_per_shard', type=int, default=50,
+                        help='With --shard manifest/local, the number of origins of a shard. Default is 50.')
+    parser.add_argument('--slots_per_shard', type=int, default=None,
+                        help='With --shard manifest/local, the number of time slots of a shard. Default is all slots.')
+    parser.add_argument('--workers', type=int, default=2,
+                        help='With --shard local, the number of worker processes. Default is 2.')
+    parser.add_argument('--worker_id', default=None,
+                        help='With --shard work, the name of the worker in the job table. Default is <host>-<pid>.')
+    parser.add_argument('--lease', type=float, default=3600,
+                        help='With --shard work, seconds after which a running shard is given to another worker. '
+                             'Default is 3600.')
 
     # Parse the arguments
     args = parser.parse_args()
@@ -224,9 +316,25 @@ def initialize():
     input = {
         'experiment_id': args.experiment_id,
         'day_of_week': args.day_of_week,
+        'date': args.date,
         'walk_speed': args.walk_speed,
         'overwrite_routes': args.overwrite_routes,
-        'time_inc': args.time_inc
+        'time_inc': args.time_inc,
+        'region': args.region,
+        'prune_routes': args.prune_routes,
+        'frontier': args.frontier,
+        'wheelchair': args.wheelchair,
+        'unknown_accessible': args.unknown_accessible,
+        'walking_graph': args.walking_graph,
+        'walking_cutoff': args.walking_cutoff,
+        'preference_cache': args.preference_cache,
+        'shard': args.shard,
+        'shard_dir': args.shard_dir or f"experiments/{args.experiment_id}/shards",
+        'origins_per_shard': args.origins_per_shard,
+        'slots_per_shard': args.slots_per_shard,
+        'workers': args.workers,
+        'worker_id': args.worker_id,
+        'lease': args.lease
     }
 
     experiment_id = input['experiment_id']
@@ -255,10 +363,9 @@ def initialize():
         - A DataFrame containing all connected entries from the target_file file.
         """
 
-        # Read the updated stops data from the CSV file
-        # This is my cleaned, filtered dataframe of only the stops we care about.
-        # TODO: if we want to include stops outside of our neighborhoods, this will need to be extended
-        updated_stops_df = pd.read_csv('data/updated_stops.csv')
+        # Only keep the stops inside the neighborhoods of the region.
+        # The stops are tagged with an is_in_<neighborhood> column for every neighborhood.
+        updated_stops_df = getRegionStops(input['region'])
 
         # Initialize an empty dictionary to store your dataframes
         df = {'stops': updated_stops_df}  # Add the updated stops dataframe with the key 'stops'
@@ -313,11 +420,67 @@ def initialize():
     df = perform_merge(target_file='calendar')
 
     # Add the columns needed to be considered a veroviz nodes dataframe
-    df = vero_viz_node_dataframe(df=df)
+    df = compact(vero_viz_node_dataframe(df=df), 'stop_data', report=True)
 
     return df, origins, destinations, input
 
 
+def compute_routes(origins, destinations, location_to_stops, bus_routes):
+    """
+    All the routes of every OD pair (origin major, as in routes.csv).
+    """
+    routes = pd.DataFrame()
+    for _, origin_row in origins.iterrows():
+        for _, destination_row in destinations.iterrows():
+            bus_pairs = candidate_bus_pairs(origin_id=origin_row['name'],
+                                            destination_id=destination_row['name'],
+                                            location_to_stops=location_to_stops)
+
+            these_routes = find_routes(bus_routes=bus_routes,
+                                        location_to_stops=location_to_stops,
+                                        bus_pairs=bus_pairs,
+                                        origin_id=origin_row['name'],
+                                        destination_id=destination_row['name'])
+            routes = pd.concat([routes, these_routes])
+    routes.reset_index(drop=True, inplace=True)
+    return routes
+
+
+def compute_best_routes(routes, times, origins, destinations, frontier=False, frontier_file='frontier.csv',
+                        cache_file=None):
+    """
+    Best routes of every OD pair and time slot.
+    With frontier=True, the Pareto frontier is computed in one pass (and saved as frontier_file
+    unless it is None) and both min_time and min_walk are answered from it; otherwise the
+    route_preferences() answer with preference 'min_time' is looked up for every OD pair and
+    slot in a PreferenceCache (persisted in cache_file if given, see code/preference_cache.py).
+    """
+    best_routes = pd.DataFrame()
+    if frontier:
+        # One pass over all routes; every preference is then answered from the frontier
+        frontier = route_frontier(routes, times, beta=140)
+        if frontier_file is not None:
+            frontier.to_csv(f"experiments/{input['experiment_id']}/{frontier_file}", index=False)
+        best_routes = pd.concat([preference_from_frontier(frontier, preference='min_time'),
+                                 preference_from_frontier(frontier, preference='min_walk')])
+    else:
+        these_best_routes = []
+        with PreferenceCache(routes, path=cache_file) as cache:
+            for time in times:
+                for _, origin_row in origins.iterrows():
+                    for _, destination_row in destinations.iterrows():
+                        these_best_routes.append(cache.best_route(time=time,
+                                                                  origin_id=origin_row['name'],
+                                                                  destination_id=destination_row['name'],
+                                                                  preference='min_time',
+                                                                  beta=140))
+            cache.report()
+        if these_best_routes:
+            best_routes = pd.concat(these_best_routes)
+    best_routes.reset_index(drop=True, inplace=True)
+    return best_routes
+
+
 """
 This is a (unneccessary/unsafe/bad) method of hand-creating a VeroViz
 dataframe in order to keep all the other columns that we want to use.
@@ -343,15 +506,12 @@ def vero_viz_node_dataframe(df):
     df['leafletIconType'] = "info-sign"
 
     if 'in_multiple_neighborhoods' in df.columns:
-        # Define conditions
-        conditions = [
-            df['in_multiple_neighborhoods'],
-            df['is_in_AT'],
-            df['is_in_FB'],
-            df['is_in_MP']
-        ]
+        # Define conditions: one for each is_in_<neighborhood> column of the region
+        neighborhood_cols = [col for col in df.columns if col.startswith('is_in_')]
+        conditions = [df['in_multiple_neighborhoods']] + [df[col] for col in neighborhood_cols]
         # Define corresponding choices
-        choices = ['red', 'green', 'orange', 'blue']
+        palette = ['green', 'orange', 'blue', 'purple', 'cadetblue', 'darkgreen', 'pink', 'gray']
+        choices = ['red'] + [palette[i % len(palette)] for i in range(len(neighborhood_cols))]
         df['leafletColor'] = np.select(conditions, choices, default='blue')
         df['cesiumColor'] = df['leafletColor']
     else:
@@ -367,109 +527,126 @@ def vero_viz_node_dataframe(df):
     return df
 
 
+def wheelchair_routes(routes, routes_file_path=None):
+    """
+    The routes whose legs are wheelchair accessible (a mask on the 'access' bits).
+    routes.csv files saved before the 'access' column was added cannot be filtered.
+    """
+    if 'access' not in routes.columns:
+        source = f"{routes_file_path} was saved without" if routes_file_path else "The routes have no"
+        sys.exit(f"{source} the 'access' column needed by --wheelchair: delete it to recompute the routes, "
+                 f"or use a new experiment_id")
+    return routes[wheelchair_mask(routes['access'], unknown_accessible=input['unknown_accessible'])]
+
+
+def compute_shard(shard, df, origins, destinations, bus_routes, calendar):
+    """
+    Routes (first slot block of the origins only) and best routes of one shard of the
+    manifest (see code/shards.py). The walking tables of the experiment are used if they
+    exist, otherwise the ones of the shard's origins are computed in the shard folder.
+    """
+    shard_origins = origins[origins['name'].isin(shard['origin_ids'])]
+    walking_dir = f"experiments/{input['experiment_id']}/"
+    if not all(os.path.exists(walking_dir + name) for name in ['walking_origins_to_stops.csv',
+                                                               'walking_destinations_to_stops.csv',
+                                                               'walking_origins_to_destinations.csv']):
+        walking_dir = os.path.join(input['shard_dir'], 'walking', f"{shard['shard_id']:05d}") + os.sep
+        os.makedirs(walking_dir, exist_ok=True)
+    location_to_stops = compact_walking(get_walking_df(df=df, origins=shard_origins, destinations=destinations,
+                                                       filepath=walking_dir, calendar=calendar))
+
+    routes = compact(compute_routes(shard_origins, destinations, location_to_stops, bus_routes), 'routes')
+    if input['prune_routes']:
+        routes = prune_routes(routes, report=False).reset_index(drop=True)
+    outputs = {'routes': routes} if shard['first_slot_block'] else {}
+    outputs['best_routes'] = compact(compute_best_routes(routes, shard['times'], shard_origins, destinations,
+                                                         frontier=input['frontier'], frontier_file=None,
+                                                         cache_file=input['preference_cache']),
+                                     'best_routes')
+    if input['wheelchair']:
+        accessible_routes = wheelchair_routes(routes)
+        outputs['best_routes_wheelchair'] = compact(compute_best_routes(accessible_routes, shard['times'],
+                                                                        shard_origins, destinations,
+                                                                        frontier=True, frontier_file=None),
+                                                    'best_routes')
+    return outputs
+
+
 if __name__ == '__main__':
     df, origins, destinations, input = initialize()  # This has already been implemented
-
-    # support function
-    def seconds_to_hms(seconds):
-        """
-        to convert seconds to HH:MM:SS format
-        """
-        hours = seconds // 3600
-        minutes = (seconds % 3600) // 60
-        seconds = seconds % 60
-        return f"{hours:02}:{minutes:02}:{seconds:02}" 
-
-    def convert_into_seconds(time):
-        total_seconds = 0
-        parts = time.split()
-        if len(parts) == 1:
-            time_parts = parts[0].split(":")
-            total_seconds += int(time_parts[0]) * 3600 + int(time_parts[1]) * 60 + int(time_parts[2])
-        else:
-            if parts[0] != "0":
-                total_seconds += int(parts[0]) * 86400
-            time_parts = parts[-1].split(":")
-            total_seconds += int(time_parts[0]) * 3600 + int(time_parts[1]) * 60 + int(time_parts[2])
-        return total_seconds
+    times = range(60 * 60 * 5, 60 * 60 * 22, int(input['time_inc']))  # 5am to 10pm
+
+    # Sharded run: the manifest and the merge do not need the bus routes
+    if input['shard'] in ('manifest', 'local'):
+        write_manifest(input['shard_dir'], origins['name'], times, input,
+                       origins_per_shard=input['origins_per_shard'], slots_per_shard=input['slots_per_shard'])
+    if input['shard'] == 'local':
+        # The last --shard argument wins, so the workers get the same arguments with --shard work
+        exit_codes = launch_local(sys.argv + ['--shard', 'work'], workers=input['workers'])
+        if any(exit_codes):
+            sys.exit(f"Worker exit codes: {exit_codes}")
+    if input['shard'] in ('merge', 'local'):
+        merge_shards(input['shard_dir'], f"experiments/{input['experiment_id']}/")
+    if input['shard'] in ('manifest', 'merge', 'local'):
+        sys.exit()
 
     # Obtain the bus route dictionary (does NOT consider walking, origins, or destinations)
     print("Getting bus route info...")
-
-    # Define the RouteInfo class
-    class RouteInfo:
-        def __init__(self, trip_id, pick_up_time, drop_off_time, walking_distance=0):
-            self.trip_id = trip_id
-            self.pick_up_time = pick_up_time
-            self.drop_off_time = drop_off_time
-            self.walking_distance = walking_distance
-            #self.total_time = (drop_off_time - pick_up_time).total_seconds()
-
-    # Read the CSV file into a DataFrame
-    routes_df = pd.read_csv('data/routes_data.csv')
-
-    # Initialize an empty dictionary to store the data
-    bus_routes = {}
-
-    for index, row in routes_df.iterrows():
-        pick_up_id = row['pick_up_id']
-        drop_off_id = row['drop_off_id']
-        route_info = RouteInfo(row['trip_id'],
-                            convert_into_seconds(row['pick_up_time']), 
-                            convert_into_seconds(row['drop_off_time']), 
-                            row['walking_distance'])
-        if (pick_up_id, drop_off_id) not in bus_routes:
-            bus_routes[(pick_up_id, drop_off_id)] = []
-        bus_routes[(pick_up_id, drop_off_id)].append(route_info)
+    calendar = ServiceCalendar.from_gtfs('data/google_transit')
+    bus_routes = pre_compute_bus_routes(stop_ids=df['stop_id'].unique(), prune=input['prune_routes'],
+                                        date=input['date'], calendar=calendar)
     print("Beginning Algorithm...")
 
+    if input['shard'] == 'work':
+        run_worker(input['shard_dir'],
+                   lambda shard: compute_shard(shard, df, origins, destinations, bus_routes, calendar),
+                   input, worker=input['worker_id'], lease=input['lease'])
+        sys.exit()
+
     location_to_stops = get_walking_df(df=df,
                                        origins=origins, destinations=destinations,
                                        filepath=f"experiments/{input['experiment_id']}/",
-                                       overwrite=False)  # This has already been implemented
+                                       overwrite=False, calendar=calendar)  # This has already been implemented
+    location_to_stops = compact_walking(location_to_stops)
 
     # Do not recalculate the routes if they already exist
     routes_file_path = f"experiments/{input['experiment_id']}/routes.csv"
     if not os.path.exists(routes_file_path):
         # Loop through the origins and destinations to find all routes
-        routes = pd.DataFrame()
-        for _, origin_row in origins.iterrows():
-            for _, destination_row in destinations.iterrows():
-                bus_pairs = candidate_bus_pairs(origin_id=origin_row['name'],
-                                                destination_id=destination_row['name'],
-                                                location_to_stops=location_to_stops)
-
-                these_routes = find_routes(bus_routes=bus_routes,
-                                            location_to_stops=location_to_stops,
-                                            bus_pairs=bus_pairs,
-                                            origin_id=origin_row['name'],
-                                            destination_id=destination_row['name'])
-                routes = pd.concat([routes, these_routes])
-        routes.reset_index(drop=True, inplace=True)
+        routes = compact(compute_routes(origins, destinations, location_to_stops, bus_routes), 'routes', report=True)
+        if input['prune_routes']:
+            routes = prune_routes(routes).reset_index(drop=True)
         routes.to_csv(routes_file_path, index=False)
         
     else:
-        routes = pd.read_csv(routes_file_path)
+        routes = read_table(routes_file_path, 'routes', report=True)
+        if input['wheelchair']:
+            # Fail before the best routes are computed, not after
+            wheelchair_routes(routes.head(0), routes_file_path)
     print("All routes dataframe created...")  
       
     # Analyze the routes
-    best_routes = pd.DataFrame()
     print("Calculating best routes...")
-    for time in range(60 * 60 * 5, 60 * 60 * 22, input['time_inc']):  # 5am to 10pm
-        for _, origin_row in origins.iterrows():
-            for _, destination_row in destinations.iterrows():
-                these_best_routes = route_preferences(time=time,
-                                                      origin_id=origin_row['name'],
-                                                      destination_id=destination_row['name'],
-                                                      all_routes=routes,
-                                                      preference='min_time',
-                                                      beta=140
-                                                      )
-                best_routes = pd.concat([best_routes, these_best_routes])
-                
-    best_routes.reset_index(drop=True, inplace=True)
+    best_routes = compact(compute_best_routes(routes, times, origins, destinations, frontier=input['frontier'],
+                                              cache_file=input['preference_cache']),
+                          'best_routes', report=True)
     best_routes.to_csv(f"experiments/{input['experiment_id']}/best_routes.csv",
                        index=False)
 
+    # Same analysis with only the wheelchair accessible routes (a mask on the 'access' bits).
+    # The routes are filtered before the best routes are computed, never after.
+    if input['wheelchair']:
+        print("Calculating wheelchair accessible best routes...")
+        accessible_routes = wheelchair_routes(routes, routes_file_path)
+        wheelchair_best_routes = compact(compute_best_routes(accessible_routes, times, origins, destinations,
+                                                             frontier=True, frontier_file='frontier_wheelchair.csv'),
+                                         'best_routes')
+        wheelchair_best_routes.to_csv(f"experiments/{input['experiment_id']}/best_routes_wheelchair.csv",
+                                      index=False)
+        standard = best_routes if 'preference' in best_routes.columns else best_routes.assign(preference='min_time')
+        scores = scoreDiff(standard[standard['preference'].isin(wheelchair_best_routes['preference'].unique())],
+                           wheelchair_best_routes, labels=('standard', 'wheelchair'))
+        scores.to_csv(f"experiments/{input['experiment_id']}/scores_wheelchair.csv", index=False)
+
     # TODO: use best_routes to create accessibility metrics
     # TODO: plot the accessibility metrics
\ No newline at end of file